@@ -1,3 +1,23 @@
+__version__ = '1.0.0'
+
 from .result_tree import ResultTree
 from .utils import VarType
-from .dataloader import DataLoader
\ No newline at end of file
+from .events import ProgressPrinter, JsonLinesLogger
+
+# Modules depending on pandas are imported on first use, so importing
+# prettyresults stays fast for tools that only work with results
+_LAZY_ATTRIBUTES = {
+    'DataLoader': 'dataloader',
+    'VariableSchema': 'schema',
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        value = getattr(importlib.import_module('.' + _LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
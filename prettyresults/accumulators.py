@@ -0,0 +1,240 @@
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+import numpy as np
+from scipy import stats
+from collections import namedtuple
+
+# Frequencies of a variable, overall and per year (see FrequencyAccumulator)
+FrequencyCounts = namedtuple('FrequencyCounts', ['value_counts', 'num_nans', 'sample_size', 'cross_year'])
+
+def _as_float_array(series):
+    return pd.to_numeric(series).to_numpy(dtype=np.float64, na_value=np.nan)
+
+class MeanVarianceAccumulator(object):
+    '''
+    Mergeable accumulator of the mean and variance of a variable.
+
+    Chunk statistics are combined with the parallel variant of Welford's algorithm
+    (Chan et al.), which is numerically stable and gives the same result regardless
+    of how the data was split.
+    '''
+    def __init__(self):
+        self.total = 0  # number of values, including NaNs
+        self.n = 0      # number of non-NaN values
+        self.mean = 0.0
+        self.m2 = 0.0   # sum of squared differences from the mean
+
+    def update(self, series):
+        '''Adds a chunk of values (NaNs are counted, but otherwise ignored).'''
+        values = _as_float_array(series)
+        valid = values[~np.isnan(values)]
+        chunk = MeanVarianceAccumulator()
+        chunk.total = len(values)
+        chunk.n = len(valid)
+        if chunk.n:
+            chunk.mean = float(valid.mean())
+            chunk.m2 = float(((valid - chunk.mean)**2).sum())
+        self.merge(chunk)
+
+    def merge(self, other):
+        '''Adds the values accumulated by another MeanVarianceAccumulator.'''
+        n = self.n + other.n
+        if n:
+            delta = other.mean - self.mean
+            self.mean += delta * other.n / n
+            self.m2 += other.m2 + delta**2 * self.n * other.n / n
+        self.n = n
+        self.total += other.total
+
+    def variance(self):
+        '''Sample variance (ddof=1).'''
+        return self.m2 / (self.n - 1) if self.n > 1 else np.nan
+
+    def confidence_interval(self, confidence=0.95):
+        '''Returns the same (mean, lower, upper, n) tuple as
+        :func:`prettyresults.descriptives.mean_confidence_interval`.'''
+        mean = self.mean if self.n else np.nan
+        sem = np.sqrt(self.variance() / self.n) if self.n > 1 else np.nan
+        interval_length = stats.t.ppf((1.0+confidence)/2, self.n-1) * sem
+        return (mean, mean-interval_length, mean+interval_length, self.n)
+
+class HistogramAccumulator(object):
+    '''
+    Mergeable accumulator of a histogram.
+
+    If value_range is given, the histogram has fixed bins over that range and only the
+    bin counts are stored (values outside the range are ignored). Otherwise, the count
+    of each distinct value is stored, so the histogram can be computed exactly over the
+    final data range (the same one a histogram of the whole data would use).
+    '''
+    def __init__(self, bins=None, value_range=None):
+        '''
+        Args:
+            bins (int, sequence or None): number of bins (10 if None), or the bin edges,
+                as accepted by numpy.histogram.
+            value_range (tuple or None): (min, max) of the bins. Ignored if bins are edges.
+        '''
+        self.bins = 10 if bins is None else bins
+        self.value_range = value_range
+        if value_range is None:
+            self.value_counts = pd.Series(dtype=np.float64)
+        else:
+            self.bin_counts = np.zeros(len(self._edges()) - 1, dtype=np.int64)
+
+    def _edges(self):
+        return np.histogram_bin_edges([], self.bins, self.value_range)
+
+    def update(self, series):
+        '''Adds a chunk of values (NaNs are ignored).'''
+        values = _as_float_array(series)
+        values = values[~np.isnan(values)]
+        if self.value_range is None:
+            unique, counts = np.unique(values, return_counts=True)
+            self._merge_value_counts(pd.Series(counts, index=unique))
+        else:
+            self.bin_counts += np.histogram(values, self.bins, self.value_range)[0]
+
+    def _merge_value_counts(self, value_counts):
+        self.value_counts = self.value_counts.add(value_counts, fill_value=0)
+
+    def merge(self, other):
+        '''Adds the values accumulated by another HistogramAccumulator, with the same bins.'''
+        if self.value_range != other.value_range or not np.array_equal(self.bins, other.bins):
+            raise ValueError('Cannot merge histograms with different bins')
+        if self.value_range is None:
+            self._merge_value_counts(other.value_counts)
+        else:
+            self.bin_counts += other.bin_counts
+
+    def hist_args(self):
+        '''Returns (x, bins, weights) arguments for numpy.histogram, which compute the
+        accumulated histogram.'''
+        if self.value_range is None:
+            return self.value_counts.index.values, self.bins, self.value_counts.values
+        edges = self._edges()
+        return edges[:-1], edges, self.bin_counts
+
+class FrequencyAccumulator(object):
+    '''
+    Mergeable accumulator of the value counts of a variable, overall and per year.
+
+    Counts are kept in a (year, value) table, with an extra slot for NaN in both axes.
+    Values are kept in order of first appearance (or in category order, for categorical
+    variables), so ties are broken like pandas.Series.value_counts over the whole data
+    when chunks are merged in order.
+    '''
+    def __init__(self):
+        self.values = None
+        self.years = None
+        self.table = None
+        self.sample_size = 0
+
+    def update(self, series, per_year_series=None):
+        '''Adds a chunk of values.
+
+        Args:
+            series (pandas.Series): the variable values.
+            per_year_series (pandas.Series or None): the year of each value, if
+                per-year counts are needed.
+        '''
+        if per_year_series is None:
+            per_year_series = pd.Series(np.zeros(len(series)), index=series.index, name=None)
+        self.update_codes(series, year_codes(per_year_series))
+
+    def update_codes(self, series, per_year_codes):
+        '''Like update, but taking the per-year series encoded by :func:`year_codes`.'''
+        codes, values = value_codes(series)
+        per_year, years = per_year_codes
+        # Shift codes by one, so NaN gets index 0 both for years and values
+        num_slots = len(values) + 1
+        table = np.bincount((per_year + 1) * num_slots + (codes + 1),
+                            minlength=(len(years) + 1) * num_slots).reshape(len(years) + 1, num_slots)
+        chunk = FrequencyAccumulator()
+        chunk.values, chunk.years, chunk.table, chunk.sample_size = values, years, table, len(series)
+        self.merge(chunk)
+
+    @staticmethod
+    def _union(index, other):
+        # Appends the new elements of other, keeping the order of both
+        if index.equals(other):
+            return index
+        return index.append(other[~other.isin(index)])
+
+    @staticmethod
+    def _align(table, index, union, axis):
+        # Reorders table slots (after the NaN one) to follow union
+        positions = np.concatenate([[0], union.get_indexer(index) + 1])
+        shape = list(table.shape)
+        shape[axis] = len(union) + 1
+        res = np.zeros(shape, dtype=table.dtype)
+        if axis == 0:
+            res[positions] = table
+        else:
+            res[:, positions] = table
+        return res
+
+    def merge(self, other):
+        '''Adds the counts accumulated by another FrequencyAccumulator.'''
+        if other.table is None:
+            return
+        if self.table is None:
+            self.values, self.years, self.table = other.values, other.years, other.table.copy()
+            self.sample_size = other.sample_size
+            return
+        values = self._union(self.values, other.values)
+        years = self._union(self.years, other.years)
+        table = self._align(self._align(self.table, self.years, years, 0), self.values, values, 1)
+        table += self._align(self._align(other.table, other.years, years, 0), other.values, values, 1)
+        self.values, self.years, self.table = values, years, table
+        self.sample_size += other.sample_size
+
+    def counts(self):
+        '''Returns the accumulated counts as a FrequencyCounts named tuple.
+
+        The result is equivalent to calling series.value_counts(), series.isna().sum() and
+        pandas.crosstab(per_year_series, series) over the whole data.
+        '''
+        if self.table is None:
+            raise ValueError('No data has been accumulated')
+        totals = self.table.sum(axis=0)
+        value_counts = pd.Series(totals[1:], index=self.values, name='count').sort_values(ascending=False)
+
+        # pandas.crosstab only includes the observed years and values, sorted
+        year_order = np.argsort(self.years.values, kind='stable')
+        cross = self.table[1:, 1:][year_order]
+        years = self.years[year_order]
+        observed_years = cross.sum(axis=1) > 0
+        observed_values = cross.sum(axis=0) > 0
+        cross_year = pd.DataFrame(cross[observed_years][:, observed_values],
+                                  index=years[observed_years], columns=self.values[observed_values])
+        if not isinstance(self.values, pd.CategoricalIndex):
+            cross_year.sort_index(axis=1, inplace=True)
+        return FrequencyCounts(value_counts, int(totals[0]), self.sample_size, cross_year)
+
+def value_codes(series, sort=False):
+    '''Encodes a series as integer codes.
+    
+    Args:
+        series (pandas.Series): the values.
+        sort (bool): if True, values of non-categorical series are sorted. Otherwise,
+            they are kept in order of first appearance. Categories are always kept
+            in their order.
+    Returns:
+        A (codes, values) tuple. Codes are -1 for NaN, and values is an index
+        (a CategoricalIndex for categorical series) named as the series.
+    '''
+    if isinstance(series.dtype, CategoricalDtype):
+        return series.cat.codes.values, pd.CategoricalIndex(series.cat.categories, dtype=series.dtype,
+                                                            name=series.name)
+    codes, values = pd.factorize(series, sort=sort)
+    return codes, pd.Index(values, name=series.name)
+
+def year_codes(per_year_series):
+    '''Encodes a per-year series, for :func:`prettyresults.descriptives.frequency_counts`
+    and :meth:`FrequencyAccumulator.update_codes`.
+
+    Returns:
+        A (codes, years) tuple, as returned by pandas.factorize (with sort=True).
+    '''
+    codes, years = pd.factorize(per_year_series, sort=True)
+    return codes, pd.Index(years, name=per_year_series.name)
@@ -0,0 +1,118 @@
+import os
+from os import path
+import pickle
+import tempfile
+
+DEFAULT_MAX_SIZE = 4 * 1024**3 # 4 GiB
+
+# Version of the layout of cache entries. Part of the keys computed by DataLoader,
+# so entries written by incompatible versions are not looked up
+FORMAT_VERSION = 1
+
+class DataCache(object):
+    '''
+    A local, on-disk cache of pre-processed datasets.
+
+    Each entry holds a dataframe and the list of warnings emitted while producing it,
+    and is identified by a key (normally computed by :class:`prettyresults.DataLoader`
+    from the input file contents and the variable metadata). Entries are stored as pickle
+    files, which preserve the exact dtypes of the dataframe (including categoricals).
+
+    When the total size of the cache exceeds max_size, the least recently used entries
+    are evicted.
+    '''
+    _EXTENSION = '.pkl'
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        '''
+        Args:
+            directory (str): directory where cache entries are stored. Created if it does not exist.
+            max_size (int): maximum total size of the cache entries, in bytes.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+
+    def _entry_path(self, key):
+        return path.join(self.directory, key + self._EXTENSION)
+
+    def _entries(self):
+        res = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith(self._EXTENSION):
+                full_path = path.join(self.directory, fname)
+                try:
+                    res.append((os.stat(full_path), full_path))
+                except FileNotFoundError: # removed concurrently
+                    pass
+        return res
+
+    def get(self, key):
+        '''Retrieves a cache entry.
+
+        Args:
+            key (str): the entry key.
+        Returns:
+            A (dataframe, warnings) tuple, or None if the entry does not exist or
+            cannot be read (e.g. it was written by another pandas version). Unreadable
+            entries are removed.
+        '''
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                res = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception: # truncated entry, or objects that no longer exist (e.g. after an upgrade)
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError: # removed concurrently
+                pass
+            return None
+        os.utime(entry_path) # mark as recently used
+        return res
+
+    def put(self, key, df, warnings):
+        '''Stores a cache entry, replacing any previous entry with the same key,
+        and evicts old entries if the cache grows over its maximum size.
+
+        Args:
+            key (str): the entry key.
+            df (pandas.DataFrame): the dataframe to store.
+            warnings (list of tuples): the warnings associated to the dataframe.
+        '''
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((df, warnings), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._entry_path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._evict(keep=self._entry_path(key))
+
+    def invalidate(self, key=None):
+        '''Removes a cache entry, or all of them if key is None.
+
+        Args:
+            key (str or None): the entry to remove.
+        '''
+        if key is None:
+            paths = [entry_path for _, entry_path in self._entries()]
+        else:
+            paths = [self._entry_path(key)]
+        for entry_path in paths:
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, keep):
+        entries = sorted(self._entries(), key=lambda entry: entry[0].st_mtime)
+        total_size = sum(stat.st_size for stat, _ in entries)
+        for stat, entry_path in entries:
+            if total_size <= self.max_size:
+                break
+            if entry_path != keep:
+                os.remove(entry_path)
+                total_size -= stat.st_size
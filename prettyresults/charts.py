@@ -0,0 +1,188 @@
+import io
+import threading
+import numpy as np
+import pandas as pd
+from matplotlib import rcParams
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+
+# Room (in inches) left around the chart area of templates, so titles, tick labels and
+# legends drawn outside it still fall inside the canvas and can be cropped
+_MARGIN = 2.0
+
+# Padding (in inches) around the cropped chart, like savefig's pad_inches
+_PAD = 0.1
+
+def _render(figure):
+    # Renders the figure as JPEG bytes, cropped to its contents like
+    # savefig(bbox_inches='tight') does, but with a single draw
+    canvas = figure.canvas
+    canvas.draw()
+    bbox = figure.get_tightbbox(canvas.get_renderer()).padded(_PAD)
+    width, height = figure.get_size_inches()
+    buffer = io.BytesIO()
+    if bbox.x0 < 0 or bbox.y0 < 0 or bbox.x1 > width or bbox.y1 > height:
+        # Contents overflow the canvas: let matplotlib resize it
+        figure.savefig(buffer, format='jpg', bbox_inches='tight')
+        return buffer.getvalue()
+    dpi = figure.dpi
+    pixels = np.asarray(canvas.buffer_rgba())
+    # Pixel rows are counted from the top
+    left, right = int(np.floor(bbox.x0 * dpi)), int(np.ceil(bbox.x1 * dpi))
+    top, bottom = int(np.floor((height - bbox.y1) * dpi)), int(np.ceil((height - bbox.y0) * dpi))
+    image = Image.fromarray(pixels[top:bottom, left:right]).convert('RGB')
+    image.save(buffer, format='jpeg', dpi=(dpi, dpi))
+    return buffer.getvalue()
+
+def _make_figure(width, height, position):
+    # A figure where the chart area has the given size (in inches), and position
+    # (left, bottom, right, top, as figure fractions), plus _MARGIN on every side
+    figure = Figure(figsize=(width + 2*_MARGIN, height + 2*_MARGIN))
+    FigureCanvasAgg(figure)
+    left, bottom, right, top = position
+    axes = figure.add_axes([
+        (_MARGIN + left*width) / (width + 2*_MARGIN),
+        (_MARGIN + bottom*height) / (height + 2*_MARGIN),
+        (right - left)*width / (width + 2*_MARGIN),
+        (top - bottom)*height / (height + 2*_MARGIN),
+    ])
+    return figure, axes
+
+def _colors():
+    return rcParams['axes.prop_cycle'].by_key()['color']
+
+class _BarChartTemplate(object):
+    # A bar chart like utils.freq_bar. Bars are updated in place when the shape of the
+    # data does not change, and recreated otherwise
+    def __init__(self):
+        self.figure, self.axes = _make_figure(8, 5, (0.125, 0.05, 0.9, 0.95))
+        self.bars = []
+        self.bar_labels = []
+        self.legend = None
+
+    def render(self, values, title, xlabel, ylabel, rot):
+        frame = values.to_frame() if isinstance(values, pd.Series) else values
+        heights = frame.values
+        num_groups, num_series = heights.shape
+        axes = self.axes
+        if [len(bars) for bars in self.bars] != [num_groups] * num_series:
+            for bars in self.bars:
+                bars.remove()
+            positions = np.arange(num_groups)
+            width = 0.5 / num_series
+            colors = _colors()
+            self.bars = [
+                axes.bar(positions + (i - (num_series - 1) / 2) * width, heights[:, i], width,
+                         color=colors[i % len(colors)], label=str(frame.columns[i]))
+                for i in range(num_series)
+            ]
+            axes.set_xticks(positions)
+            axes.set_xlim(-0.5, num_groups - 0.5)
+        else:
+            for i, (bars, series_heights) in enumerate(zip(self.bars, heights.T)):
+                for rect, height in zip(bars, series_heights):
+                    rect.set_height(height)
+                bars.set_label(str(frame.columns[i])) # shown by the legend
+        for labels in self.bar_labels:
+            for label in labels:
+                label.remove()
+        self.bar_labels = [axes.bar_label(bars, labels=[str(int(height)) for height in series_heights],
+                                          fontsize=8, fontweight='bold')
+                           for bars, series_heights in zip(self.bars, heights.T)]
+        if self.legend is not None:
+            self.legend.remove()
+            self.legend = None
+        if isinstance(values, pd.DataFrame):
+            self.legend = axes.legend(title=values.columns.name)
+        axes.set_xticklabels([str(elm) for elm in frame.index], rotation=rot)
+        axes.relim()
+        axes.autoscale_view(scalex=False)
+        axes.set_title(title)
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(ylabel)
+        return _render(self.figure)
+
+class _PieChartTemplate(object):
+    # A pie chart like utils.freq_pie. Wedges are recreated on every chart
+    def __init__(self, size):
+        self.figure, self.axes = _make_figure(size, size, (0.125, 0.11, 0.9, 0.88))
+
+    def render(self, values, title):
+        axes = self.axes
+        axes.clear()
+        wedges, _, _ = axes.pie(values.values, autopct='%.2f%%')
+        axes.legend(wedges, [str(elm) for elm in values.index], loc='best')
+        axes.set_title(title)
+        return _render(self.figure)
+
+class _HistogramTemplate(object):
+    # A histogram like pandas.Series.hist. Bars are recreated on every chart
+    def __init__(self):
+        self.figure, self.axes = _make_figure(6.4, 4.8, (0.125, 0.11, 0.9, 0.88))
+
+    def render(self, counts, edges, title, xlabel, ylabel):
+        axes = self.axes
+        axes.clear()
+        edges = np.asarray(edges, dtype=np.float64)
+        axes.hist(edges[:-1], bins=edges, weights=counts)
+        axes.grid(True)
+        axes.set_title(title)
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(ylabel)
+        return _render(self.figure)
+
+# Templates are not thread-safe, so each thread has its own
+_templates = threading.local()
+
+def _template(key, factory):
+    templates = _templates.__dict__.setdefault('templates', {})
+    if key not in templates:
+        templates[key] = factory()
+    return templates[key]
+
+def bar_chart(values, title='', xlabel='', ylabel='Frecuencia', rot=0):
+    '''Renders a bar chart with the same look as :func:`prettyresults.utils.freq_bar`.
+
+    Charts are drawn on a figure that is reused between calls, so this is much
+    faster than creating a new figure every time.
+
+    Args:
+        values (pandas.Series or pandas.DataFrame): the bar heights, with the x axis values
+            as index. DataFrames get a group of bars per row, and a legend with the columns.
+        title (str): the chart title.
+        xlabel (str): the x axis label.
+        ylabel (str): the y axis label.
+        rot (float): rotation of the x axis labels, in degrees.
+    Returns:
+        The JPEG image, as bytes. It can be passed to :meth:`ContainerResult.add_figure`.
+    '''
+    return _template('bar', _BarChartTemplate).render(values, title, xlabel, ylabel, rot)
+
+def pie_chart(values, title='', size=8.0):
+    '''Renders a pie chart with the same look as :func:`prettyresults.utils.freq_pie`.
+
+    Args:
+        values (pandas.Series): the size of each wedge, with the wedge labels as index.
+        title (str): the chart title.
+        size (float): the size of the chart, in inches.
+    Returns:
+        The JPEG image, as bytes. It can be passed to :meth:`ContainerResult.add_figure`.
+    '''
+    return _template(('pie', size), lambda: _PieChartTemplate(size)).render(values, title)
+
+def histogram_chart(counts, edges, title='', xlabel='', ylabel='Frecuencia'):
+    '''Renders a histogram with the same look as pandas.Series.hist, from its bin counts.
+
+    Args:
+        counts (array-like): the count of each bin.
+        edges (array-like): the bin edges (one more than counts).
+        title (str): the chart title.
+        xlabel (str): the x axis label.
+        ylabel (str): the y axis label.
+    Returns:
+        The JPEG image, as bytes. It can be passed to :meth:`ContainerResult.add_figure`.
+    '''
+    if len(edges) != len(counts) + 1:
+        raise ValueError('A histogram needs one more edge than counts')
+    return _template('hist', _HistogramTemplate).render(counts, edges, title, xlabel, ylabel)
@@ -1,12 +1,17 @@
-from matplotlib import pyplot as plt
 import pandas as pd
+import numpy as np
 from collections import namedtuple
-from scipy import stats
+from scipy import stats, sparse
 
-from .utils import readable_index, freq_bar
+from .utils import readable_index, process_pool
 from .results import Label
+from .accumulators import value_codes
+from .schema import VariableSchema, compile_variable
 
-ContingencyResult = namedtuple('ContingencyResult',['p', 'chi2', 'too_small_freqs', 'crosstab', 'contingency_table', 'n'])
+# mc_p and mc_error are the Monte Carlo p-value and its standard error (None if not simulated).
+# full_shape is the shape of the whole cross table, if crosstab only holds part of it (see sparse_chi2_contingency)
+ContingencyResult = namedtuple('ContingencyResult',['p', 'chi2', 'too_small_freqs', 'crosstab', 'contingency_table', 'n',
+                                                    'mc_p', 'mc_error', 'full_shape'], defaults=(None, None, None))
 KendallTauResult = namedtuple('KendallTauResult', ['p', 'tau', 'n'])
 
 def crosstab(series1, series2, var1, var2):
@@ -17,10 +22,27 @@ def crosstab(series1, series2, var1, var2):
     cross.columns.name = var2['desc']
     return cross
 
-def chi2_contingency(df, variable_meta, name1, name2):
+def chi2_contingency(df, variable_meta, name1, name2, simulate_p_value=False, num_simulations=10000,
+                     seed=0, workers=1):
+    '''Performs a chi square test of independence between two variables.
+    
+    Args:
+        df (pandas.DataFrame): the data.
+        variable_meta (dict): the variable metadata.
+        name1 (str): the first variable.
+        name2 (str): the second variable.
+        simulate_p_value (bool or 'auto'): whether to compute a Monte Carlo p-value
+            too (see :func:`monte_carlo_chi2_p`). If 'auto', it is computed only if
+            frequencies are too small for the asymptotic p-value to be reliable.
+        num_simulations (int): number of random tables for the Monte Carlo p-value.
+        seed (int): seed of the random tables.
+        workers (int): number of processes the random tables are drawn in.
+    Returns:
+        A ContingencyResult named tuple.
+    '''
     # Variable metadata
-    var1 = variable_meta[name1]
-    var2 = variable_meta[name2]
+    var1 = compile_variable(variable_meta, name1)
+    var2 = compile_variable(variable_meta, name2)
     
     # Data
     series1 = df[name1]
@@ -32,28 +54,385 @@ def chi2_contingency(df, variable_meta, name1, name2):
     # Statistical analysis
     chi2, p, _, expected = stats.chi2_contingency(cross.values)
     
+    return _simulate_if_needed(_contingency_result(cross, chi2, p, expected), simulate_p_value,
+                               num_simulations, seed, workers)
+
+def _contingency_result(cross, chi2, p, expected):
+    observed = cross.values
+    
     # Check for too-small-frequencies
     min_expected = expected.min()
-    min_actual = cross.values.min()
+    min_actual = observed.min()
     too_few = (min_expected < 5) or (min_actual < 5)
     
     # Expected/actual frequency table (contingency table)
-    expected_df = pd.DataFrame(expected, index=cross.index, columns=cross.columns)
-    totals = cross.sum(axis=1)
-    expected_percent = (expected_df*100.0).div(totals, axis='index')
-    actual_percent = (cross*100.0).div(totals, axis='index')
-    contingency_table = expected_percent.copy()
-    for column in cross:
-        for row_label in cross.index:
-            contingency_table.loc[row_label, column] = '{expf:.0f}->{actf}, {expp:.2f}%->{actp:.2f}%'.format(
-                expf=expected_df.loc[row_label, column], expp=expected_percent.loc[row_label, column],
-                actf=cross.loc[row_label, column], actp=actual_percent.loc[row_label, column])
+    contingency_table = _contingency_table(cross, expected, observed.sum(axis=1, keepdims=True))
             
     # Sample size
-    n = cross.sum().sum()
+    n = observed.sum()
             
     return ContingencyResult(p, chi2, too_few, cross, contingency_table, n)
 
+def _contingency_table(cross, expected, totals):
+    # Formats the expected -> actual frequencies. Percentages are relative to the row totals
+    observed = cross.values
+    expected_percent = expected*100.0/totals
+    actual_percent = observed*100.0/totals
+    cells = [
+        '{expf:.0f}->{actf}, {expp:.2f}%->{actp:.2f}%'.format(expf=expf, actf=actf, expp=expp, actp=actp)
+        for expf, actf, expp, actp in zip(expected.ravel(), observed.ravel(),
+                                          expected_percent.ravel(), actual_percent.ravel())
+    ]
+    return pd.DataFrame(np.array(cells, dtype=object).reshape(observed.shape),
+                        index=cross.index, columns=cross.columns)
+
+def _sparse_crosstab(series1, series2):
+    # Cross table as a CSR matrix, with the observed values of each series (in the
+    # order of pandas.crosstab) as rows and columns
+    codes1, values1 = value_codes(series1, sort=True)
+    codes2, values2 = value_codes(series2, sort=True)
+    valid = (codes1 >= 0) & (codes2 >= 0)
+    counts = sparse.coo_matrix((np.ones(valid.sum(), dtype=np.int64), (codes1[valid], codes2[valid])),
+                               shape=(len(values1), len(values2))).tocsr() # duplicates are summed
+    observed_rows = np.asarray(counts.sum(axis=1)).ravel() > 0
+    observed_cols = np.asarray(counts.sum(axis=0)).ravel() > 0
+    return counts[observed_rows][:, observed_cols], values1[observed_rows], values2[observed_cols]
+
+def _top_levels(totals, top_n, min_count):
+    # Positions of the levels with the largest totals, in their original order
+    candidates = np.argsort(-totals, kind='stable')
+    if min_count is not None:
+        candidates = candidates[totals[candidates] >= min_count]
+    return np.sort(candidates[:top_n])
+
+def sparse_chi2_contingency(df, variable_meta, name1, name2, top_n=20, min_count=None):
+    '''Like :func:`chi2_contingency`, for variables with many distinct values.
+    
+    The cross table is built as a sparse matrix of counts, and the chi square
+    statistic is computed from its nonzero cells only (as the sum of O²/E minus the
+    sample size), so memory and time depend on the number of observed value pairs
+    rather than on the size of the table. Only the most frequent values are kept in
+    the crosstab and contingency_table of the result; the statistics, n and
+    full_shape correspond to the whole table.
+    
+    Args:
+        df (pandas.DataFrame): the data.
+        variable_meta (dict): the variable metadata.
+        name1 (str): the first variable.
+        name2 (str): the second variable.
+        top_n (int or None): maximum number of values of each variable in the
+            resulting tables (all of them if None).
+        min_count (int or None): values with fewer cases are left out of the resulting tables.
+    Returns:
+        A ContingencyResult named tuple.
+    '''
+    var1 = compile_variable(variable_meta, name1)
+    var2 = compile_variable(variable_meta, name2)
+    counts, values1, values2 = _sparse_crosstab(df[name1], df[name2])
+    num_rows, num_cols = counts.shape
+    if num_rows * num_cols == 0:
+        raise ValueError('No cases with values of both {} and {}'.format(name1, name2))
+    
+    # Statistical analysis
+    n = int(counts.sum())
+    row_totals = np.asarray(counts.sum(axis=1)).ravel()
+    col_totals = np.asarray(counts.sum(axis=0)).ravel()
+    if num_rows == 2 and num_cols == 2:
+        # Yates' correction involves every cell
+        chi2, p, _, _ = stats.chi2_contingency(counts.toarray())
+    else:
+        cells = counts.tocoo()
+        cell_expected = row_totals[cells.row] * col_totals[cells.col] / n
+        chi2 = max(0.0, (cells.data**2 / cell_expected).sum() - n)
+        dof = (num_rows - 1) * (num_cols - 1)
+        p = stats.chi2.sf(chi2, dof) if dof > 0 else 1.0
+        
+    # Check for too-small-frequencies (empty cells count as small frequencies)
+    min_expected = row_totals.min() * col_totals.min() / n
+    too_few = (min_expected < 5) or counts.nnz < num_rows * num_cols or counts.data.min() < 5
+    
+    # Cross and contingency tables of the most frequent values
+    rows = _top_levels(row_totals, top_n, min_count)
+    cols = _top_levels(col_totals, top_n, min_count)
+    cross = pd.DataFrame(counts[rows][:, cols].toarray(),
+                         index=readable_index(values1[rows], var1),
+                         columns=readable_index(values2[cols], var2))
+    cross.index.name = var1['desc']
+    cross.columns.name = var2['desc']
+    expected = np.outer(row_totals[rows], col_totals[cols]) / n
+    contingency_table = _contingency_table(cross, expected, row_totals[rows][:, np.newaxis])
+    
+    return ContingencyResult(p, chi2, too_few, cross, contingency_table, n, full_shape=counts.shape)
+
+def _chi2_statistic(observed):
+    # Same statistic as scipy.stats.chi2_contingency (with Yates' correction
+    # for 2x2 tables). Returns (chi2, degrees of freedom, expected frequencies)
+    expected = np.outer(observed.sum(axis=1), observed.sum(axis=0)) / observed.sum()
+    dof = (observed.shape[0] - 1) * (observed.shape[1] - 1)
+    if dof == 0:
+        return 0.0, 0, expected
+    if dof == 1:
+        diff = expected - observed
+        observed = observed + np.minimum(0.5, np.abs(diff)) * np.sign(diff)
+    return ((observed - expected)**2 / expected).sum(), dof, expected
+
+def _simulate_if_needed(result, simulate_p_value, num_simulations, seed, workers):
+    if simulate_p_value not in (False, True, 'auto'):
+        raise ValueError('simulate_p_value must be False, True or \'auto\'')
+    if simulate_p_value is True or (simulate_p_value == 'auto' and result.too_small_freqs):
+        mc_p, mc_error = monte_carlo_chi2_p(result.crosstab.values, num_simulations, seed, workers)
+        result = result._replace(mc_p=mc_p, mc_error=mc_error)
+    return result
+
+# Random tables are drawn (and their statistics computed) in batches of this size
+_MONTE_CARLO_BATCH_SIZE = 1000
+
+def _random_tables(row_totals, col_totals, size, rng):
+    # Draws size random tables with the given margins, from their distribution under
+    # independence. Cells are drawn one by one, each from its hypergeometric distribution
+    # conditioned on the previous ones, for all tables at once
+    num_rows, num_cols = len(row_totals), len(col_totals)
+    tables = np.zeros((size, num_rows, num_cols), dtype=np.int64)
+    col_remaining = np.tile(col_totals, (size, 1))
+    for i in range(num_rows - 1):
+        row_remaining = np.full(size, row_totals[i], dtype=np.int64)
+        others = col_remaining.sum(axis=1)
+        for j in range(num_cols - 1):
+            others = others - col_remaining[:, j]
+            cell = rng.hypergeometric(col_remaining[:, j], others, row_remaining)
+            tables[:, i, j] = cell
+            row_remaining -= cell
+            col_remaining[:, j] -= cell
+        tables[:, i, -1] = row_remaining
+        col_remaining[:, -1] -= row_remaining
+    tables[:, -1] = col_remaining
+    return tables
+
+def _monte_carlo_batch(task):
+    # Returns how many of the random tables of a batch have a statistic >= the observed one
+    row_totals, col_totals, size, observed_chi2, seed_sequence = task
+    expected = np.outer(row_totals, col_totals) / row_totals.sum()
+    tables = _random_tables(row_totals, col_totals, size, np.random.default_rng(seed_sequence))
+    chi2s = ((tables - expected)**2 / expected).sum(axis=(1, 2))
+    # Tolerance for statistics equal to the observed one, up to rounding errors
+    return int((chi2s >= observed_chi2 * (1 - 64*np.finfo(float).eps)).sum())
+
+def monte_carlo_chi2_p(observed, num_simulations=10000, seed=0, workers=1):
+    '''Computes a Monte Carlo p-value of the chi square test of independence.
+    
+    Random tables with the same margins as the observed one are drawn from their
+    distribution under independence, and the p-value is the proportion of them
+    (counting the observed table) with a chi square statistic (without continuity
+    correction) at least as large as the observed one. Unlike the asymptotic p-value,
+    it is valid for small expected frequencies.
+    
+    Tables are drawn in batches, each with its own random generator spawned from seed,
+    so the result only depends on seed and num_simulations (not on workers).
+    
+    Args:
+        observed (numpy.ndarray): the observed frequencies, without empty rows or columns.
+        num_simulations (int): the number of random tables.
+        seed (int): the random seed.
+        workers (int): if > 1, batches are drawn in that many worker processes.
+    Returns:
+        A (p, error) tuple, where error is the standard error of p.
+    '''
+    observed = np.asarray(observed, dtype=np.int64)
+    row_totals = observed.sum(axis=1)
+    col_totals = observed.sum(axis=0)
+    expected = np.outer(row_totals, col_totals) / observed.sum()
+    observed_chi2 = ((observed - expected)**2 / expected).sum()
+    
+    sizes = [_MONTE_CARLO_BATCH_SIZE] * (num_simulations // _MONTE_CARLO_BATCH_SIZE)
+    if num_simulations % _MONTE_CARLO_BATCH_SIZE:
+        sizes.append(num_simulations % _MONTE_CARLO_BATCH_SIZE)
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(row_totals, col_totals, size, observed_chi2, seed_sequence)
+             for size, seed_sequence in zip(sizes, seed_sequences)]
+    if workers > 1 and len(tasks) > 1:
+        with process_pool(min(workers, len(tasks))) as pool:
+            num_extreme = sum(pool.map(_monte_carlo_batch, tasks))
+    else:
+        num_extreme = sum(map(_monte_carlo_batch, tasks))
+    p = (num_extreme + 1) / (num_simulations + 1)
+    return p, np.sqrt(p * (1 - p) / num_simulations)
+
+def chi2_all_pairs(df, variable_meta, varnames, simulate_p_value=False, num_simulations=10000, seed=0,
+                   workers=1):
+    '''Computes :func:`chi2_contingency` for every pair of variables at once.
+    
+    All the pairwise cross tables are obtained from a single sparse matrix product
+    (X.T @ X, where X is the one-hot encoding of the variable values), instead of
+    crosstabbing each pair separately. Pairs without any case with both values
+    are left out.
+    
+    Args:
+        df (pandas.DataFrame): the data.
+        variable_meta (dict): the variable metadata.
+        varnames (list of str): the variables to cross.
+        simulate_p_value (bool or 'auto'): see :func:`chi2_contingency`.
+        num_simulations (int): see :func:`chi2_contingency`.
+        seed (int): see :func:`chi2_contingency`.
+        workers (int): see :func:`chi2_contingency`.
+    Returns:
+        A dict mapping (name1, name2) tuples, for every name1 preceding name2 in varnames,
+        to the ContingencyResult of the pair.
+    '''
+    variable_meta = VariableSchema.compile(variable_meta)
+    
+    # One-hot encoding. Values are ordered as in pandas.crosstab
+    encodings = [value_codes(df[varname], sort=True) for varname in varnames]
+    offsets = np.cumsum([0] + [len(values) for _, values in encodings])
+    rows = []
+    cols = []
+    for (codes, _), offset in zip(encodings, offsets):
+        valid = np.flatnonzero(codes >= 0)
+        rows.append(valid)
+        cols.append(codes[valid] + offset)
+    rows = np.concatenate(rows)
+    one_hot = sparse.csc_matrix((np.ones(len(rows), dtype=np.int64), (rows, np.concatenate(cols))),
+                                shape=(len(df), offsets[-1]))
+    counts = (one_hot.T @ one_hot).toarray()
+    
+    # Statistics of every pair
+    pairs = []
+    for i in range(len(varnames)):
+        for j in range(i + 1, len(varnames)):
+            block = counts[offsets[i]:offsets[i+1], offsets[j]:offsets[j+1]]
+            observed_rows = block.sum(axis=1) > 0
+            observed_cols = block.sum(axis=0) > 0
+            if observed_rows.any():
+                observed = block[observed_rows][:, observed_cols]
+                pairs.append((i, j, observed_rows, observed_cols, observed) + _chi2_statistic(observed))
+    if not pairs:
+        return {}
+    chi2s = np.array([pair[5] for pair in pairs])
+    dofs = np.array([pair[6] for pair in pairs])
+    ps = np.where(dofs > 0, stats.chi2.sf(chi2s, np.maximum(dofs, 1)), 1.0)
+    
+    res = {}
+    for (i, j, observed_rows, observed_cols, observed, chi2, _, expected), p in zip(pairs, ps):
+        name1, name2 = varnames[i], varnames[j]
+        var1, var2 = variable_meta[name1], variable_meta[name2]
+        cross = pd.DataFrame(observed,
+                             index=readable_index(encodings[i][1][observed_rows], var1),
+                             columns=readable_index(encodings[j][1][observed_cols], var2))
+        cross.index.name = var1['desc']
+        cross.columns.name = var2['desc']
+        res[(name1, name2)] = _simulate_if_needed(_contingency_result(cross, chi2, p, expected),
+                                                  simulate_p_value, num_simulations, seed, workers)
+    return res
+
+# Cross tables with more cells than this are not used to compute Kendall's tau
+_MAX_KENDALL_TABLE_CELLS = 1000000
+
+def kendall_tau(df, variable_meta, name1, name2):
+    '''Computes Kendall's tau-b between two ordinal variables.
+    
+    Cases where any of the variables is NaN are left out, as in :func:`chi2_contingency`.
+    Values are ranked in category order (for categorical variables) or sorted.
+    The result (including the p-value) is the same as scipy.stats.kendalltau's, but
+    it is computed from the cross table of the value codes, in O(n + rows*columns)
+    time. Variables with too many distinct values are passed to scipy.stats.kendalltau.
+    
+    Args:
+        df (pandas.DataFrame): the data.
+        variable_meta (dict): the variable metadata (unused, kept for consistency
+            with :func:`chi2_contingency`).
+        name1 (str): the first variable.
+        name2 (str): the second variable.
+    Returns:
+        A KendallTauResult named tuple.
+    '''
+    codes1, values1 = value_codes(df[name1], sort=True)
+    codes2, values2 = value_codes(df[name2], sort=True)
+    return _kendall_tau(codes1, len(values1), codes2, len(values2))
+
+def _kendall_tau(codes1, num_values1, codes2, num_values2):
+    valid = (codes1 >= 0) & (codes2 >= 0)
+    codes1 = codes1[valid].astype(np.int64)
+    codes2 = codes2[valid].astype(np.int64)
+    if num_values1 * num_values2 > _MAX_KENDALL_TABLE_CELLS:
+        tau, p = stats.kendalltau(codes1, codes2)
+        return KendallTauResult(p, tau, len(codes1))
+    table = np.bincount(codes1 * num_values2 + codes2,
+                        minlength=num_values1 * num_values2).reshape(num_values1, num_values2)
+    return _kendall_tau_from_table(table)
+
+def _tie_stats(counts):
+    # Same tie statistics as scipy.stats.kendalltau
+    counts = counts[counts > 1]
+    return (int((counts * (counts - 1) // 2).sum()),
+            int((counts * (counts - 1.) * (counts - 2)).sum()),
+            int((counts * (counts - 1.) * (2*counts + 5)).sum()))
+
+def _kendall_tau_from_table(table):
+    n = int(table.sum())
+    tot = n * (n - 1) // 2
+    xtie, x0, x1 = _tie_stats(table.sum(axis=1))
+    ytie, y0, y1 = _tie_stats(table.sum(axis=0))
+    if xtie == tot or ytie == tot:
+        return KendallTauResult(np.nan, np.nan, n)
+    if xtie == 0 and ytie == 0:
+        # No ties: scipy may compute an exact p-value. There are at most
+        # min(rows, columns) cases, so recover them
+        rows, cols = np.nonzero(table)
+        tau, p = stats.kendalltau(rows, cols)
+        return KendallTauResult(p, tau, n)
+    
+    # Cases in the cells below and to the right of each cell (concordant pairs),
+    # and below and to the left (discordant pairs)
+    below = table[::-1].cumsum(axis=0)[::-1]
+    below_right = below[:, ::-1].cumsum(axis=1)[:, ::-1]
+    below_left = below.cumsum(axis=1)
+    concordant = int((table[:-1, :-1] * below_right[1:, 1:]).sum())
+    discordant = int((table[:-1, 1:] * below_left[1:, :-1]).sum())
+    
+    con_minus_dis = concordant - discordant
+    tau = min(1.0, max(-1.0, con_minus_dis / np.sqrt(tot - xtie) / np.sqrt(tot - ytie)))
+    m = n * (n - 1.)
+    var = ((m * (2*n + 5) - x1 - y1) / 18 +
+           (2 * xtie * ytie) / m + x0 * y0 / (9 * m * (n - 2)))
+    p = 2 * stats.norm.sf(abs(con_minus_dis) / np.sqrt(var))
+    return KendallTauResult(p, tau, n)
+
+# Value codes of kendall_tau_pairs worker processes, set by _init_kendall_worker
+_kendall_codes = None
+
+def _init_kendall_worker(codes):
+    global _kendall_codes
+    _kendall_codes = codes
+    
+def _kendall_worker(pair):
+    (codes1, num_values1), (codes2, num_values2) = _kendall_codes[pair[0]], _kendall_codes[pair[1]]
+    return _kendall_tau(codes1, num_values1, codes2, num_values2)
+
+def kendall_tau_pairs(df, variable_meta, varnames, workers=1):
+    '''Computes :func:`kendall_tau` for every pair of variables.
+    
+    Args:
+        df (pandas.DataFrame): the data.
+        variable_meta (dict): the variable metadata.
+        varnames (list of str): the variables.
+        workers (int): if > 1, pairs are distributed among that many worker processes.
+    Returns:
+        A dict mapping (name1, name2) tuples, for every name1 preceding name2 in varnames,
+        to the KendallTauResult of the pair.
+    '''
+    codes = {}
+    for varname in varnames:
+        var_codes, values = value_codes(df[varname], sort=True)
+        codes[varname] = (var_codes, len(values))
+    pairs = [(name1, name2) for i, name1 in enumerate(varnames) for name2 in varnames[i+1:]]
+    if workers > 1 and len(pairs) > 1:
+        with process_pool(min(workers, len(pairs)), _init_kendall_worker, (codes,)) as pool:
+            chunksize = max(1, len(pairs) // (4 * workers))
+            results = list(pool.map(_kendall_worker, pairs, chunksize=chunksize))
+    else:
+        _init_kendall_worker(codes)
+        results = [_kendall_worker(pair) for pair in pairs]
+    return dict(zip(pairs, results))
+
 def significative_label():
     return Label('green', 'Significativo')
 
@@ -62,39 +441,53 @@ def too_small_freqs_label():
     
 def add_chi2_results(parent_result, chi_values, significance=0.05):
     # Cross graph
-    freq_bar(chi_values.crosstab, xlabel=chi_values.crosstab.index.name)
-    parent_result.add_figure('freq_bar', 'Gráfico de frecuencias')
-    plt.close('all')
+    parent_result.add_chart('freq_bar', 'Gráfico de frecuencias', 'bar', chi_values.crosstab,
+                            xlabel=chi_values.crosstab.index.name or '')
     
     # Frequency table
-    parent_result.add_dataframe_table('freq_table', 'Tabla de frecuencias', df=chi_values.crosstab)
+    shape = chi_values.crosstab.shape
+    if chi_values.full_shape is not None and tuple(chi_values.full_shape) != shape:
+        partial_note = 'Se muestran los valores más frecuentes: {} de {} filas y {} de {} columnas'.format(
+            shape[0], chi_values.full_shape[0], shape[1], chi_values.full_shape[1])
+    else:
+        partial_note = ''
+    parent_result.add_dataframe_table('freq_table', 'Tabla de frecuencias', df=chi_values.crosstab,
+                                      post=partial_note)
     
     # Contingency table
     parent_result.add_dataframe_table(
         'contingency_table',
         'Tabla de contingencia',
         chi_values.contingency_table,
-        pre='Esperado -> Obtenido'
+        pre='Esperado -> Obtenido',
+        post=partial_note
     )
     
-    # Chi square result
-    significative = (chi_values.p < significance)
+    # Chi square result. The Monte Carlo p-value, if available, is valid
+    # even if frequencies are too small
+    simulated = chi_values.mc_p is not None
+    significative = ((chi_values.mc_p if simulated else chi_values.p) < significance)
     labels = []
     if significative:
         labels.append(significative_label())
-    if chi_values.too_small_freqs:
+    if chi_values.too_small_freqs and not simulated:
         labels.append(too_small_freqs_label())
+    rows = [
+        ('Chi cuadrado', '{:.4f}'.format(chi_values.chi2)),
+        ('Significancia', str(significance)),
+        ('p', '{:.4f}'.format(chi_values.p)),
+    ]
+    if simulated:
+        rows.append(('p (Monte Carlo)', '{:.4f} ± {:.4f}'.format(chi_values.mc_p, chi_values.mc_error)))
+    rows += [
+        ('Tamaño de muestra', str(chi_values.n)),
+        ('Comprobación: frecuencias esperadas/obtenidas por celda',
+            'FALLADO: frecuencias demasiado pequeñas' if chi_values.too_small_freqs else 'OK'),
+    ]
     parent_result.add_keyvalue_table(
         'chi_square_independence',
         'Test chi cuadrado de independencia',
-        [
-            ('Chi cuadrado', '{:.4f}'.format(chi_values.chi2)),
-            ('Significancia', str(significance)),
-            ('p', '{:.4f}'.format(chi_values.p)),
-            ('Tamaño de muestra', str(chi_values.n)),
-            ('Comprobación: frecuencias esperadas/obtenidas por celda',
-                'FALLADO: frecuencias demasiado pequeñas' if chi_values.too_small_freqs else 'OK'),
-        ],
+        rows,
         labels=labels
     )
     
@@ -109,4 +502,52 @@ def add_kendall_tau_result(parent_result, tau_values, significance=0.05):
             ('Tamaño de muestra', str(tau_values.n)),
         ],
         labels=[significative_label()] if tau_values.p < significance else []
-    )
\ No newline at end of file
+    )
+    
+def add_kendall_tau_matrix_results(parent_result, tau_values, variable_meta, varnames, significance=0.05):
+    '''Adds a heatmap and a table with Kendall's tau of every pair of variables.
+    
+    Args:
+        parent_result (ContainerResult): the container results are added to.
+        tau_values (dict): the results of :func:`kendall_tau_pairs`.
+        variable_meta (dict): the variable metadata.
+        varnames (list of str): the variables, in the order they are shown.
+        significance (float): pairs with a p-value below it are marked with an asterisk.
+    '''
+    # pyplot is slow to import, and no other function here needs it
+    from matplotlib import pyplot as plt
+    descs = [variable_meta[varname]['desc'] for varname in varnames]
+    taus = np.eye(len(varnames))
+    cells = [['' for _ in varnames] for _ in varnames]
+    for i, name1 in enumerate(varnames):
+        for j, name2 in enumerate(varnames):
+            if i != j:
+                result = tau_values[(name1, name2) if i < j else (name2, name1)]
+                taus[i, j] = result.tau
+                cells[i][j] = '{:.4f}{} (n = {})'.format(result.tau, '*' if result.p < significance else '',
+                                                         result.n)
+    
+    # Heatmap
+    size = max(5, 0.6*len(varnames) + 2)
+    fig, ax = plt.subplots(figsize=(size + 1, size))
+    image = ax.imshow(taus, cmap='coolwarm', vmin=-1, vmax=1)
+    ax.set_xticks(range(len(varnames)))
+    ax.set_xticklabels(descs, rotation=90)
+    ax.set_yticks(range(len(varnames)))
+    ax.set_yticklabels(descs)
+    for i in range(len(varnames)):
+        for j in range(len(varnames)):
+            if i != j and not np.isnan(taus[i, j]):
+                ax.text(j, i, '{:.2f}'.format(taus[i, j]), ha='center', va='center', fontsize=8)
+    fig.colorbar(image, ax=ax)
+    ax.set_title('Tau de Kendall')
+    parent_result.add_figure('kendall_tau_heatmap', 'Mapa de calor de la tau de Kendall', fig)
+    plt.close('all')
+    
+    # Table
+    parent_result.add_dataframe_table(
+        'kendall_tau_table',
+        'Tau de Kendall por parejas de variables',
+        pd.DataFrame(cells, index=pd.Index(descs), columns=descs),
+        post='* p < {}'.format(significance)
+    )
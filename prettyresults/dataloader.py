@@ -1,16 +1,54 @@
 import pandas as pd
 from pandas.api.types import CategoricalDtype
 import numpy as np
-from .utils import VarType
+from .utils import VarType, process_pool, can_send_to_workers
+from .fingerprint import fingerprint, file_fingerprint
+from .schema import VariableSchema, DERIVATION_KEYS
+from .results import Label
+from .cache import FORMAT_VERSION as CACHE_FORMAT_VERSION
 import collections
+from concurrent.futures import ThreadPoolExecutor
+import glob
+from os import path
+import time
 
 DEFAULT_NA_VALUES = (98.0, 99.0)
 
+# Key in DataFrame.attrs describing how original values are stored when
+# loading with originals='changed'
+ORIGINALS_ATTR = 'prettyresults_originals'
+
+# Key in DataFrame.attrs describing the sample, when loading a sample of the data
+SAMPLE_ATTR = 'prettyresults_sample'
+
+# Describes a sample loaded by DataLoader.load_data (see sample_info)
+SampleInfo = collections.namedtuple('SampleInfo', ['sample_size', 'population_size', 'stratify_by'])
+
 class DataLoader(object):
     def __init__(self, variables, case_id_fun):
-        self.variables = variables
+        '''
+        Args:
+            variables (dict or VariableSchema): variable metadata, mapping variable names to dicts.
+                Derived variables may declare the variables they are computed from
+                under the 'inputs' key. Computation functions created by this module's
+                helpers (e.g. :func:`logical_or`) declare them automatically.
+            case_id_fun (callable): function generating a warning identifier from a row.
+        Raises:
+            ValueError: if the metadata of a variable is not valid, a derived variable
+                depends on an unknown variable, or derived variables depend on each
+                other cyclically.
+        '''
+        self.variables = VariableSchema.compile(variables)
         self.case_id_fun = case_id_fun
+        self._schedule = _schedule_derivations(self.variables)
+        self._derivation_threads = 1
         self._warnings = []
+        self._staged_warnings = None
+        self._stage = 0
+        self._originals = 'all'
+        self._sampling = None
+        self._original_dtypes = {}
+        self._categorical_columns = set()
         
     def add_warning(self, case_id, text):
         '''Logs a warning.
@@ -28,9 +66,14 @@ class DataLoader(object):
         '''
         if isinstance(case_id, pd.Series):
             case_id = self.case_id_fun(case_id)
-        self._warnings.append((case_id, text))
+        if self._staged_warnings is not None:
+            self._staged_warnings.append((self._stage, case_id, text))
+        else:
+            self._warnings.append((case_id, text))
         
-    def load_data(self, fname, ctx, na_values=[' ']):
+    def load_data(self, fname, ctx, na_values=[' '], chunksize=None, cache=None, originals='all',
+                  schema_dtypes=False, engine=None, varnames=None, derivation_threads=1, workers=1,
+                  sample=None, stratify_by=None, sample_seed=0):
         '''Loads data from the CSV file identified by fname and pre-processes it.
 
         The variable names to load are taken from the variable metadata passed to the constructor.
@@ -44,22 +87,242 @@ class DataLoader(object):
             - Type transformations will be applied.
             - Mandatory checks will be performed. Any row with a NaN value in any mandatory
               variable will be dropped.
+              
+        If chunksize is given, the file is read and pre-processed in chunks of that many rows,
+        so the raw data and the intermediate copies only exist for one chunk at a time.
+        A first, lightweight pass over the file determines the column types, so every chunk
+        is parsed with the types a whole-file read would have inferred. The resulting dataframe
+        (including its index, dtypes and the emitted warnings) is the same as the one obtained
+        by loading the whole file at once.
+        
+        If originals is 'changed', original values are stored in a memory-lean way:
+        
+            - Int variables get no $NAME_ORIGINAL column.
+            - Other variables get a $NAME_ORIGINAL column only if pre-processing changed any
+              value (e.g. a value outside the labels became NaN). The column is stored as a
+              categorical, instead of as a copy of the raw data.
+              
+        Use :func:`original_values` to retrieve original values in this mode (it reconstructs
+        the ones that were not stored).
+        
+        If schema_dtypes is True, Category and Bool variables are parsed directly into categoricals,
+        instead of being inferred as float64 or object columns and converted afterwards. Only the
+        (few) distinct values of each column are converted to numbers, which makes parsing
+        faster and lowers peak memory usage. The loaded data is the same as without it.
+        engine is forwarded to pandas.read_csv, so engine='pyarrow' can be used
+        for multi-threaded parsing if pyarrow is installed (not compatible with chunksize).
+        
+        If varnames is given, only these variables, and the ones needed to compute them, are
+        loaded. Derived variables are computed in dependency order (see the 'inputs' key
+        in the constructor); with derivation_threads > 1, the ones that don't depend on
+        each other are computed concurrently. Warnings are emitted in the same order as
+        in a sequential computation.
+        
+        fname may also be a list of paths or a glob pattern (e.g. 'data/*.csv'), for data
+        partitioned in several files with the same columns. Each file is loaded and pre-processed
+        on its own, in up to workers parallel processes, and the results are concatenated
+        (in list order, or sorted by path for glob patterns). The row index is numbered as if
+        the files were a single one. Warnings are prefixed by the name of the file they come from.
+        Outside Linux, worker processes are spawned and the loader is pickled to send it to them
+        (see :func:`prettyresults.utils.process_pool`), so its case_id_fun and computation
+        functions must be picklable (module-level functions, not lambdas or closures).
+        Otherwise, the files are loaded one after another in the calling process.
+        
+        If sample is given, only a random sample of the rows is kept, for quick approximate
+        reports on large files. It is selected while reading (chunk by chunk, if chunksize is
+        given), before pre-processing, so only the sampled rows are kept in memory and
+        pre-processed. sample may be:
+        
+            - A float between 0 and 1: each row is kept with that probability (Bernoulli sampling).
+            - An int: a simple random sample of that many rows (the ones with the lowest random
+              priorities, which is equivalent to reservoir sampling). With stratify_by, the sample
+              is stratified by the raw values of that variable (e.g. 'AÑO'), with proportional
+              allocation. Not supported when loading multiple files.
+            
+        The sample is reproducible for a given sample_seed, and does not depend on chunksize.
+        Rows keep their position in the file as index. The returned dataframe is described by
+        :func:`sample_info`, which the analysis helpers use to report margins of error, and every
+        container of ctx gets a :func:`sampled_label`, so approximate reports are not mistaken
+        for final ones. Warnings are only emitted for the sampled rows.
+        
+        If a cache is given, the pre-processed dataframe and the emitted warnings are looked up
+        in it first, using a key computed from the contents of the input files, na_values and the
+        variable metadata (including the source code of computation functions) and case_id_fun
+        (see :meth:`cache_key`). On a miss, the data is loaded and stored in the cache.
 
         Args:
-            fname (str): path to the CSV file to load.
+            fname (str or list of str): path to the CSV file to load, glob pattern or list of paths.
             ctx (ResultTree): warnings will add a table result to the result tree.
             na_values (list of str): values to be considered as NaN.
+            chunksize (int or None): if not None, number of rows to read and pre-process at once.
+            cache (prettyresults.cache.DataCache or None): cache of pre-processed data.
+            originals (str): 'all' or 'changed'. Controls how original values are stored.
+            schema_dtypes (bool): whether to derive column types from the variable metadata.
+            engine (str or None): parser engine to use, forwarded to pandas.read_csv.
+            varnames (list of str or None): variables to load. If None, all of them are.
+            derivation_threads (int): number of threads used to compute derived variables.
+            workers (int): number of processes used to load multiple files.
+            sample (int, float or None): number or fraction of rows to sample. If None, all
+                rows are loaded.
+            stratify_by (str or None): variable to stratify the sample by (int samples only).
+            sample_seed (int): seed of the random sample.
         Returns:
             Dataframe with the loaded data.
         '''
-        csv_varnames = [varname for varname, var in self.variables.items()
-                        if all(k not in var for k in ('computation-pre', 'computation-post'))]
-        df = pd.read_csv(fname, usecols=csv_varnames, na_values=na_values)
-        self._preprocess(df)
+        start = time.perf_counter()
+        if originals not in ('all', 'changed'):
+            raise ValueError('Invalid value for originals: {}'.format(originals))
+        if engine == 'pyarrow' and chunksize is not None:
+            raise ValueError('The pyarrow engine does not support chunksize')
+        self._schedule = _schedule_derivations(self.variables, varnames)
+        self._derivation_threads = derivation_threads
+        csv_varnames = self._schedule.csv_varnames
+        fnames = _expand_fnames(fname)
+        self._sampling = _check_sampling(sample, stratify_by, sample_seed, csv_varnames, fnames)
+        read_args = { 'usecols': csv_varnames, 'na_values': na_values }
+        if schema_dtypes:
+            read_args['dtype'] = { varname: 'category' for varname in csv_varnames
+                                   if self.variables[varname]['type'] != VarType.Int }
+        if engine is not None:
+            read_args['engine'] = engine
+        self._originals = originals
+        entry = None
+        if cache is None:
+            df = self._load_all(fname, fnames, read_args, chunksize, workers)
+        else:
+            key = self._cache_key(fname, fnames, na_values, originals, varnames, self._sampling)
+            entry = cache.get(key)
+            if entry is None:
+                first_warning = len(self._warnings)
+                df = self._load_all(fname, fnames, read_args, chunksize, workers)
+                cache.put(key, df, self._warnings[first_warning:])
+            else:
+                df, warnings = entry
+                self._warnings += warnings
+        info = sample_info(df)
+        if info is not None:
+            ctx.add_container_label(sampled_label(info))
+        # Not stored apart, so warnings added afterwards are included too
         ctx.get_result('root').add_table('warnings', 'Warnings',
-                                         headings=['Caso', ''], rows=self._warnings)
+                                         headings=['Caso', ''], rows=self._warnings, store_apart=False)
+        ctx.events.emit('data_loaded', fname=fname,
+                        rows=len(df.index), columns=len(df.columns), warnings=len(self._warnings),
+                        cached=entry is not None, seconds=time.perf_counter() - start)
             
         return df
+    
+    def cache_key(self, fname, na_values=[' '], originals='all', varnames=None,
+                  sample=None, stratify_by=None, sample_seed=0):
+        '''Returns the key :meth:`load_data` looks the data up with in a cache, when
+        called with the same arguments (the ones not listed here do not change the key).
+        Allows removing the entry of some input from the cache, with
+        :meth:`prettyresults.cache.DataCache.invalidate`.
+        
+        Returns:
+            The key (str).
+        '''
+        fnames = _expand_fnames(fname)
+        csv_varnames = _schedule_derivations(self.variables, varnames).csv_varnames
+        sampling = _check_sampling(sample, stratify_by, sample_seed, csv_varnames, fnames)
+        return self._cache_key(fname, fnames, na_values, originals, varnames, sampling)
+    
+    def _cache_key(self, fname, fnames, na_values, originals, varnames, sampling):
+        if fnames is None:
+            file_key = file_fingerprint(fname)
+        else:
+            file_key = [file_fingerprint(elm) for elm in fnames]
+        # Entries written by other pandas versions may not unpickle correctly
+        return fingerprint(file_key, list(na_values), originals, varnames,
+                           self.variables, self.case_id_fun, sampling,
+                           pd.__version__, CACHE_FORMAT_VERSION)
+    
+    def _load_all(self, fname, fnames, read_args, chunksize, workers):
+        self._original_dtypes = {}
+        if fnames is None:
+            df, rows_read, rows_sampled = self._load(fname, read_args, chunksize)
+        else:
+            df, rows_read, rows_sampled = self._load_files(fnames, read_args, chunksize, workers)
+        # Done once all data is available, so the decision is the same for all files
+        if self._originals == 'changed':
+            self._drop_unchanged_originals(df)
+        if self._sampling is not None:
+            df.attrs[SAMPLE_ATTR] = { 'sample_size': rows_sampled, 'population_size': rows_read,
+                                      'stratify_by': self._sampling[1] }
+        return df
+    
+    def _load_files(self, fnames, read_args, chunksize, workers):
+        tasks = [(fname, read_args, chunksize, i) for i, fname in enumerate(fnames)]
+        if workers > 1 and len(tasks) > 1 and can_send_to_workers(self):
+            with process_pool(min(workers, len(tasks)), _init_worker, (self,)) as pool:
+                results = list(pool.map(_load_file_worker, tasks))
+        else:
+            results = [self._load_file(*task) for task in tasks]
+        
+        frames = []
+        rows_before = 0
+        rows_sampled = 0
+        for fname, (df, warnings, rows_read, file_rows_sampled, original_dtypes) in zip(fnames, results):
+            df.index = df.index + rows_before
+            rows_before += rows_read
+            rows_sampled += file_rows_sampled
+            frames.append(df)
+            source = path.basename(fname)
+            self._warnings += [('{}: {}'.format(source, case_id), text) for case_id, text in warnings]
+            for varname, dtype in original_dtypes.items():
+                self._original_dtypes[varname] = _common_dtype(
+                    self._original_dtypes.get(varname, dtype), dtype)
+        return _concat_frames(frames), rows_before, rows_sampled
+    
+    def _load_file(self, fname, read_args, chunksize, file_index):
+        # Loads a file on its own, returning its warnings and original dtypes
+        # instead of accumulating them
+        prev_warnings, self._warnings = self._warnings, []
+        prev_original_dtypes, self._original_dtypes = self._original_dtypes, {}
+        try:
+            df, rows_read, rows_sampled = self._load(fname, read_args, chunksize, file_index)
+            return df, self._warnings, rows_read, rows_sampled, self._original_dtypes
+        finally:
+            self._warnings = prev_warnings
+            self._original_dtypes = prev_original_dtypes
+    
+    def _load(self, fname, read_args, chunksize, file_index=0):
+        # Returns the pre-processed data and the number of rows read and sampled
+        self._categorical_columns = set(read_args.get('dtype', {}))
+        sampler = None if self._sampling is None else _Sampler(*self._sampling, file_index)
+        if chunksize is None:
+            df = pd.read_csv(fname, **read_args)
+            rows_read = len(df)
+            if sampler is not None:
+                sampler.add(df)
+                df = sampler.sample()
+            self._preprocess(df)
+        else:
+            read_args = dict(read_args, dtype=_infer_csv_dtypes(fname, chunksize, **read_args))
+            reader = pd.read_csv(fname, chunksize=chunksize, **read_args)
+            try:
+                if sampler is None:
+                    df, rows_read = self._preprocess_chunks(reader)
+                else:
+                    # Only the sampled rows are kept, so they are pre-processed at once
+                    for chunk in reader:
+                        sampler.add(chunk)
+                    df = sampler.sample()
+                    rows_read = sampler.rows_read
+                    self._preprocess(df)
+            finally:
+                reader.close()
+        return df, rows_read, rows_read if sampler is None else sampler.rows_sampled
+    
+    def _drop_unchanged_originals(self, df):
+        # Originals that can be reconstructed from the pre-processed values are not kept
+        info = {}
+        for varname, dtype in self._original_dtypes.items():
+            orig_varname = varname + '_ORIGINAL'
+            stored = bool((df[orig_varname].isna() != df[varname].isna()).any())
+            if not stored:
+                del df[orig_varname]
+            info[varname] = { 'stored': stored, 'dtype': str(dtype) }
+        df.attrs[ORIGINALS_ATTR] = info
         
     def _drop_na(self, df, varname):
         lost_cases = df[df[varname].isna()]
@@ -69,30 +332,80 @@ class DataLoader(object):
             df.dropna(subset=[varname], inplace=True)
             
     def _compute_derived(self, df, calculation_key):
-        for varname, var in self.variables.items():
-            fun = var.get(calculation_key)
-            if fun is not None:
-                df[varname] = fun(df, self)
+        # Each function gets its own context, collecting its warnings, so they can
+        # be emitted in variable order even if functions run concurrently
+        computed = []
+        executor = ThreadPoolExecutor(self._derivation_threads) if self._derivation_threads > 1 else None
+        try:
+            for wave in self._schedule.waves[calculation_key]:
+                contexts = [_DerivationContext(self) for _ in wave]
+                funs = [self.variables[varname][calculation_key] for varname in wave]
+                if executor is not None and len(wave) > 1:
+                    values = list(executor.map(lambda fun, context: fun(df, context), funs, contexts))
+                else:
+                    values = [fun(df, context) for fun, context in zip(funs, contexts)]
+                for varname, value, context in zip(wave, values, contexts):
+                    df[varname] = value
+                    computed.append((self._schedule.positions[varname], context.warnings))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        for _, warnings in sorted(computed, key=lambda elm: elm[0]):
+            self._stage += 1
+            for case_id, text in warnings:
+                self.add_warning(case_id, text)
+                
+    def _preprocess_chunks(self, chunks):
+        # Warnings are tagged with the pre-processing step that emitted them, so they
+        # can be put back in the order a single-pass load would have produced them
+        frames = []
+        staged_warnings = []
+        rows_read = 0
+        for chunk in chunks:
+            rows_read += len(chunk)
+            self._staged_warnings = staged_warnings
+            try:
+                self._preprocess(chunk)
+            finally:
+                self._staged_warnings = None
+            frames.append(chunk)
+        staged_warnings.sort(key=lambda warning: warning[0])
+        self._warnings += [warning[1:] for warning in staged_warnings]
+        return _concat_frames(frames), rows_read
                 
     def _preprocess(self, df):
+        self._stage = 0
+        
+        # Columns parsed as categoricals get the categories a type-inferring read would give.
+        # Computation functions expect raw values, so their inputs are decoded.
+        raw_dtypes = {}
+        for varname in self._categorical_columns:
+            df[varname], raw_dtypes[varname] = _infer_categories(df[varname])
+            if varname in self._schedule.pre_inputs or self.variables[varname]['type'] != VarType.Category:
+                df[varname] = df[varname].astype(raw_dtypes[varname])
+                
         self._compute_derived(df, 'computation-pre')
         for varname in df:
+            self._stage += 1
             vardata = self.variables[varname]
             vartype = vardata['type']
+            raw = df[varname]
+            raw_dtype = raw_dtypes.get(varname, raw.dtype)
             
             # Store the original value
-            df[varname + '_ORIGINAL'] = df[varname]
+            if self._originals == 'all':
+                df[varname + '_ORIGINAL'] = raw if raw.dtype == raw_dtype else raw.astype(raw_dtype)
+            elif vartype != VarType.Int:
+                # Chunks may infer different types (e.g. int64 if they have no NaN)
+                self._original_dtypes[varname] = _common_dtype(
+                    self._original_dtypes.get(varname, raw_dtype), raw_dtype)
+                df[varname + '_ORIGINAL'] = raw.astype('category')
     
             # Convert to adequate type
             if vartype == VarType.Category:
-                labels = vardata['labels']
-                ordered = isinstance(labels, collections.OrderedDict)
-                cat_type = CategoricalDtype(categories=labels.keys(), ordered=ordered)
-                cat_map = { key: value[0] for key, value in vardata['labels'].items() }
-                df.loc[:, varname] = df[varname].astype(cat_type)
-                df[varname].cat.rename_categories(cat_map, inplace=True)
+                df[varname] = vardata.to_labels(df[varname])
             elif vartype == VarType.Bool:
-                df.loc[~df[varname].isin((0, 1)), [varname]] = np.nan
+                df[varname] = df[varname].where(df[varname].isin((0, 1)))
                 
             # Mandatory checking
             if vardata.get('mandatory', False):
@@ -101,6 +414,307 @@ class DataLoader(object):
                 if vartype == VarType.Int:
                     df[varname] = df[varname].astype(np.int64)
         self._compute_derived(df, 'computation-post')
+        
+# Loader used by worker processes, set by _init_worker
+_worker_loader = None
+
+def _init_worker(loader):
+    global _worker_loader
+    _worker_loader = loader
+    
+def _load_file_worker(task):
+    return _worker_loader._load_file(*task)
+
+def _check_sampling(sample, stratify_by, seed, csv_varnames, fnames):
+    # Returns the (sample, stratify_by, seed) sampling arguments, or None
+    if sample is None:
+        if stratify_by is not None:
+            raise ValueError('stratify_by requires a sample')
+        return None
+    if isinstance(sample, bool) or not isinstance(sample, (int, float, np.integer, np.floating)):
+        raise ValueError('Invalid sample: {!r}'.format(sample))
+    if isinstance(sample, (float, np.floating)):
+        if not 0.0 < sample < 1.0:
+            raise ValueError('Sample fractions must be between 0 and 1: {}'.format(sample))
+        if stratify_by is not None:
+            raise ValueError('Stratified samples must have a size, not a fraction')
+        return float(sample), None, seed
+    if sample <= 0:
+        raise ValueError('Sample sizes must be positive: {}'.format(sample))
+    if fnames is not None:
+        raise ValueError('Sample sizes are not supported when loading multiple files; use a fraction')
+    if stratify_by is not None and stratify_by not in csv_varnames:
+        raise ValueError('Cannot stratify by {}: it is not a loaded variable'.format(stratify_by))
+    return int(sample), stratify_by, seed
+
+def _proportional_allocation(sizes, sample_size):
+    # Splits sample_size among strata of the given sizes proportionally,
+    # rounding by largest remainder
+    quotas = sizes * (sample_size / sizes.sum())
+    res = np.floor(quotas)
+    remainders = quotas - res
+    extra = int(sample_size - res.sum())
+    res.iloc[np.argsort(-remainders.values, kind='stable')[:extra]] += 1
+    return res
+
+class _Sampler(object):
+    # Selects a random sample of the rows of a file, fed chunk by chunk, keeping only
+    # the candidate rows in memory. Every row gets a random priority, drawn in file
+    # order (so chunking does not change them). A fraction keeps the rows with priority
+    # under it; a size keeps the size rows with the lowest priorities, in each stratum
+    def __init__(self, sample, stratify_by, seed, file_index):
+        self._sample = sample
+        self._stratify_by = stratify_by
+        self._rng = np.random.default_rng([seed, file_index])
+        self._frames = []
+        self._priorities = []
+        self._num_candidates = 0
+        self._strata_sizes = None
+        self.rows_read = 0
+        self.rows_sampled = 0
+        
+    def _strata(self, df):
+        if self._stratify_by is None:
+            return pd.Series(0, index=df.index)
+        return df[self._stratify_by]
+        
+    def add(self, chunk):
+        priorities = self._rng.random(len(chunk))
+        self.rows_read += len(chunk)
+        if isinstance(self._sample, float):
+            keep = priorities < self._sample
+            self._frames.append(chunk[keep])
+            return
+        sizes = self._strata(chunk).value_counts(dropna=False)
+        self._strata_sizes = sizes if self._strata_sizes is None else \
+                             self._strata_sizes.add(sizes, fill_value=0)
+        self._frames.append(chunk)
+        self._priorities.append(priorities)
+        self._num_candidates += len(chunk)
+        if self._num_candidates > 2 * self._sample:
+            # No stratum can get more than the sample size
+            self._keep_lowest(lambda strata: self._sample)
+            
+    def _keep_lowest(self, limits):
+        # Keeps the candidates with the lowest priorities in each stratum.
+        # limits returns the number of rows to keep for the strata of each row
+        df = _concat_frames(self._frames)
+        priorities = np.concatenate(self._priorities)
+        strata = self._strata(df)
+        ranks = pd.Series(priorities).groupby(strata.values, dropna=False).rank(method='first').values
+        keep = ranks <= np.asarray(limits(strata))
+        self._frames = [df[keep]]
+        self._priorities = [priorities[keep]]
+        self._num_candidates = int(keep.sum())
+        
+    def sample(self):
+        '''Returns the sampled rows, in file order.'''
+        if not isinstance(self._sample, float) and self._strata_sizes is not None:
+            allocation = _proportional_allocation(self._strata_sizes,
+                                                  min(self._sample, self.rows_read))
+            self._keep_lowest(lambda strata: allocation.reindex(strata.values).values)
+        df = _concat_frames(self._frames).sort_index()
+        self.rows_sampled = len(df)
+        return df
+
+def sample_info(df):
+    '''Returns the :class:`SampleInfo` of a dataframe loaded with a sample (see
+    :meth:`DataLoader.load_data`), or None if it holds all the data.
+    
+    SampleInfo fields are sample_size (rows sampled, before dropping rows with NaN mandatory
+    variables), population_size (rows read) and stratify_by (None if not stratified).
+    '''
+    info = df.attrs.get(SAMPLE_ATTR)
+    return None if info is None else SampleInfo(**info)
+
+def sampled_label(info):
+    '''Label marking the results computed from a sample.'''
+    return Label('orange', 'Muestra: {} de {} filas ({:.2%})'.format(
+        info.sample_size, info.population_size, info.sample_size/info.population_size))
+
+def _expand_fnames(fname):
+    # Returns the list of files to load, or None for a single file
+    if isinstance(fname, (list, tuple)):
+        return list(fname)
+    elif isinstance(fname, str) and any(char in fname for char in '*?['):
+        fnames = sorted(glob.glob(fname))
+        if not fnames:
+            raise FileNotFoundError('No files match {}'.format(fname))
+        return fnames
+    else:
+        return None
+
+class _DerivationContext(object):
+    # Stands for the loader while computing a derived variable
+    def __init__(self, loader):
+        self._loader = loader
+        self.warnings = []
+        
+    def add_warning(self, case_id, text):
+        if isinstance(case_id, pd.Series):
+            case_id = self._loader.case_id_fun(case_id)
+        self.warnings.append((case_id, text))
+        
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+    
+_Schedule = collections.namedtuple('_Schedule', ['csv_varnames', 'waves', 'positions', 'pre_inputs'])
+
+def _find_cycle(pending, dependencies):
+    # Every pending variable depends on another pending one, so following
+    # dependencies eventually revisits a variable
+    path = [pending[0]]
+    while True:
+        following = next(dep for dep in dependencies[path[-1]] if dep in pending)
+        if following in path:
+            return path[path.index(following):] + [following]
+        path.append(following)
+
+def _schedule_derivations(variables, varnames=None):
+    names = list(variables)
+    positions = { name: i for i, name in enumerate(names) }
+    keys = { name: var.derivation_key for name, var in variables.items() }
+    csv_names = [name for name in names if keys[name] is None]
+    
+    # Dependencies. Functions without declared inputs may use any variable
+    # available when they would have been computed sequentially.
+    dependencies = {}
+    for name, var in variables.items():
+        key = keys[name]
+        if key is None:
+            dependencies[name] = []
+            continue
+        inputs = var.inputs
+        if inputs is None:
+            inputs = csv_names + [other for other in names[:positions[name]]
+                                  if keys[other] == 'computation-pre' or keys[other] == key]
+        for input_name in inputs:
+            if input_name not in variables:
+                raise ValueError('Derived variable {} depends on unknown variable {}'.format(
+                    name, input_name))
+            if key == 'computation-pre' and keys[input_name] == 'computation-post':
+                raise ValueError('Derived variable {} (computation-pre) cannot depend on {} '
+                                 '(computation-post)'.format(name, input_name))
+        dependencies[name] = list(inputs)
+        
+    # Variables needed to compute the requested ones
+    if varnames is None:
+        required = set(names)
+    else:
+        required = set()
+        pending = list(varnames)
+        while pending:
+            name = pending.pop()
+            if name not in variables:
+                raise ValueError('Unknown variable: {}'.format(name))
+            if name not in required:
+                required.add(name)
+                pending += dependencies[name]
+    
+    # Group derived variables in waves of mutually independent variables
+    waves = {}
+    for key in DERIVATION_KEYS:
+        pending = [name for name in names if name in required and keys[name] == key]
+        done = required.difference(pending)
+        waves[key] = []
+        while pending:
+            wave = [name for name in pending if done.issuperset(dependencies[name])]
+            if not wave:
+                raise ValueError('Cyclic dependency between derived variables: {}'.format(
+                    ' -> '.join(_find_cycle(pending, dependencies))))
+            waves[key].append(wave)
+            done.update(wave)
+            pending = [name for name in pending if name not in done]
+    
+    pre_inputs = set(dep for wave in waves['computation-pre'] for name in wave
+                     for dep in dependencies[name])
+    return _Schedule([name for name in csv_names if name in required], waves, positions, pre_inputs)
+
+def original_values(df, varname, var_meta):
+    '''Returns the original (before pre-processing) values of a variable loaded by
+    :meth:`DataLoader.load_data`, as a Series with the raw dtype.
+    
+    Works with both ways of storing original values (see the originals argument
+    of :meth:`DataLoader.load_data`).
+    
+    Args:
+        df (pandas.DataFrame): the loaded data.
+        varname (str): the variable name.
+        var_meta (dict): the variable metadata.
+    Returns:
+        A pandas.Series, or None if no original values are available for the variable.
+    '''
+    orig_varname = varname + '_ORIGINAL'
+    info = df.attrs.get(ORIGINALS_ATTR, {}).get(varname)
+    if info is None:
+        return df[orig_varname] if orig_varname in df else None
+    elif info['stored']:
+        return df[orig_varname].astype(info['dtype'])
+    elif var_meta['type'] == VarType.Category:
+        # Unchanged: every value is either NaN or one of the labels, in category order
+        codes = df[varname].cat.codes.values
+        # NaN is appended so that code -1 maps to it
+        keys = np.append(np.asarray(list(var_meta['labels'].keys())), np.nan)
+        return pd.Series(keys[codes], index=df.index, name=orig_varname).astype(info['dtype'])
+    else:
+        return df[varname].rename(orig_varname)
+        
+def _infer_categories(series):
+    # read_csv parses categories as strings. Convert them, and compute the dtype
+    # the column would have had if parsed without a dtype.
+    categories = series.cat.categories
+    has_nan = bool((series.cat.codes.values == -1).any())
+    try:
+        inferred = pd.to_numeric(categories)
+    except (ValueError, TypeError):
+        return series, pd.Series(np.asarray(categories, dtype=object)).infer_objects().dtype
+    dtype = np.dtype(np.float64) if has_nan else inferred.dtype
+    if inferred.is_unique:
+        return series.cat.rename_categories(inferred), dtype
+    else: # different spellings of the same number, like 1 and 1.0
+        values = pd.Series(inferred.values, dtype=np.float64).reindex(series.cat.codes.values)
+        return pd.Series(pd.Categorical(values.values), index=series.index, name=series.name), dtype
+    
+def _common_dtype(dtype1, dtype2):
+    if dtype1 == dtype2:
+        return dtype1
+    elif all(dtype.kind in 'iuf' for dtype in (dtype1, dtype2)):
+        return np.result_type(dtype1, dtype2)
+    else:
+        return np.dtype(object)
+    
+def _infer_csv_dtypes(fname, chunksize, usecols, dtype=None, **kwargs):
+    # Columns with a known dtype don't need to be inspected
+    known_dtypes = dict(dtype or {})
+    usecols = [column for column in usecols if column not in known_dtypes]
+    if not usecols:
+        return known_dtypes
+    
+    # File-like objects are rewound so they can be read again afterwards
+    start = fname.tell() if hasattr(fname, 'tell') else None
+    dtypes = {}
+    reader = pd.read_csv(fname, chunksize=chunksize, usecols=usecols, **kwargs)
+    try:
+        for chunk in reader:
+            for column, dtype in chunk.dtypes.items():
+                dtypes[column] = _common_dtype(dtypes.get(column, dtype), dtype)
+    finally:
+        reader.close()
+    if start is not None:
+        fname.seek(start)
+    dtypes.update(known_dtypes)
+    return dtypes
+    
+def _concat_frames(frames):
+    # Categorical columns whose categories were inferred from the data may differ
+    # between frames; unify them so pd.concat keeps the categorical dtype
+    for column in frames[0]:
+        dtypes = [frame[column].dtype for frame in frames]
+        if isinstance(dtypes[0], CategoricalDtype) and any(dtype != dtypes[0] for dtype in dtypes):
+            categories = pd.unique(np.concatenate([dtype.categories.values for dtype in dtypes]))
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames)
                     
 def _combine_variables_row(row, varname1, varname2, on_conflict, na_values, loader):
     v1 = row[varname1]
@@ -137,6 +751,7 @@ def combine_variables(varname1, varname2, on_conflict=np.nan, na_values=DEFAULT_
     def res(df, loader):
         return df.apply(lambda row: _combine_variables_row(
             row, varname1, varname2, on_conflict, na_values, loader), axis=1)
+    res.inputs = (varname1, varname2)
     return res
 
 def combine_variables_bool(varname1, varname2, na_values=DEFAULT_NA_VALUES):
@@ -154,6 +769,7 @@ def _logical_op(true_combinator, false_combinator, *varnames):
         result_series[true_values] = 1.0
         result_series[false_values] = 0.0
         return result_series
+    res.inputs = varnames
     return res
 
 def logical_or(*varnames):
@@ -166,4 +782,5 @@ def multibool_to_enum(variables, na_values=DEFAULT_NA_VALUES):
     def res(df, loader):
         return df.apply(lambda row: _multibool_to_enum_row(
             row, variables, na_values, loader), axis=1)
+    res.inputs = tuple(variables)
     return res
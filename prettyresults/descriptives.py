@@ -1,9 +1,14 @@
-from matplotlib import pyplot as plt
 import pandas as pd
 import numpy as np
 from scipy import stats
+import collections
 
-from .utils import VarType, readable_index, freq_bar, freq_pie, format_float
+from .utils import VarType, readable_index, format_float, process_pool
+from .dataloader import original_values, sample_info, ORIGINALS_ATTR, SAMPLE_ATTR
+from .results import add_parallel_results
+from .schema import VariableSchema
+from .accumulators import (FrequencyAccumulator, HistogramAccumulator, MeanVarianceAccumulator,
+                           year_codes)
 
 # For simplicity, mean CI is included here too
 def mean_confidence_interval(data, confidence=0.95):
@@ -15,66 +20,218 @@ def mean_confidence_interval(data, confidence=0.95):
     interval_length = t_value * sem
     return (sample_mean, sample_mean-interval_length, sample_mean+interval_length, n)
 
+def grouped_mean_confidence_intervals(df, varnames, by, confidence=0.95):
+    '''Computes mean confidence intervals for several variables and groups at once.
+    
+    Equivalent to calling mean_confidence_interval for every variable and group, but
+    computed from a single groupby aggregation.
+    
+    Args:
+        df (pandas.DataFrame): the data.
+        varnames (list of str): the variables to compute intervals for.
+        by (str or list of str): the grouping variable(s), forwarded to DataFrame.groupby.
+        confidence (float): the confidence level.
+    Returns:
+        A pandas.DataFrame indexed by (variable, group), with columns total (group size),
+        n (non-NaN values), mean, sem, lower and upper.
+    '''
+    grouped = df.groupby(by, observed=True)
+    aggregates = grouped[list(varnames)].agg(['count', 'mean', 'std'])
+    sizes = grouped.size()
+    res = pd.concat({
+        varname: pd.DataFrame({
+            'total': sizes,
+            'n': aggregates[varname]['count'],
+            'mean': aggregates[varname]['mean'],
+            'sem': aggregates[varname]['std'] / np.sqrt(aggregates[varname]['count']),
+        }) for varname in varnames
+    }, names=['variable'])
+    interval_length = stats.t.ppf((1.0+confidence)/2, res['n']-1) * res['sem']
+    res['lower'] = res['mean'] - interval_length
+    res['upper'] = res['mean'] + interval_length
+    return res
+
 def format_mean_ci_raw(lower, upper, decimals=2):
     return '{} ≤ μ ≤ {}'.format(format_float(lower, decimals), format_float(upper, decimals))
 
 def format_mean_ci(result, decimals=2):
     return format_mean_ci_raw(result[1], result[2], decimals)
 
+def frequency_counts(series, per_year_codes):
+    '''Computes the frequency table and the per-year cross table of a variable
+    in a single pass over its codes.
+    
+    The result is equivalent to calling series.value_counts(), series.isna().sum() and
+    pandas.crosstab(per_year_series, series), but a single numpy.bincount is performed
+    over a combined (year, value) key (see :class:`FrequencyAccumulator`).
+    
+    Args:
+        series (pandas.Series): the variable values.
+        per_year_codes (tuple): the per-year series, encoded by :func:`year_codes`.
+            Encode it once and reuse it for all variables.
+    Returns:
+        A FrequencyCounts named tuple.
+    '''
+    accumulator = FrequencyAccumulator()
+    accumulator.update_codes(series, per_year_codes)
+    return accumulator.counts()
+
 # Utilities to add results
-def add_mean_ci_result(parent_result, series, confidence=0.95,
-                       result_id='mean_ci', result_name='Intervalo de confianza para la media'):
-    mean, lower, upper, n = mean_confidence_interval(series.values, confidence)
-    total_cases = len(series)
+_MEAN_CI_FIELDS = ['Tamaño de muestra total', 'Casos perdidos', 'Tamaño de muestra efectivo',
+                   'Confianza', 'Valor estimado para la media', 'Intervalo de confianza']
+
+def _mean_ci_values(mean, lower, upper, n, total_cases, confidence):
+    # Values for each of _MEAN_CI_FIELDS
     lost_cases = total_cases - n
     lost_cases_percent = lost_cases/total_cases*100.0
-    parent_result.add_keyvalue_table(
-        result_id,
-        result_name,
-        [
-            ['Tamaño de muestra total', str(total_cases)],
-            ['Casos perdidos', '{} ({:.2f}%)'.format(lost_cases, lost_cases_percent)],
-            ['Tamaño de muestra efectivo', str(n)],
-            ['Confianza', str(confidence)],
-            ['Valor estimado para la media', '{:.2f}'.format(mean)],
-            ['Intervalo de confianza', format_mean_ci_raw(lower, upper)]
-        ]
-    )
+    return [
+        str(total_cases),
+        '{} ({:.2f}%)'.format(lost_cases, lost_cases_percent),
+        str(n),
+        str(confidence),
+        '{:.2f}'.format(mean),
+        format_mean_ci_raw(lower, upper)
+    ]
+
+def _finite_population_correction(sample):
+    # Shrinks standard errors by the fraction of the population that was sampled
+    return np.sqrt(1.0 - sample.sample_size/sample.population_size)
+
+def _sample_note(sample):
+    return 'Estimación a partir de una muestra de {} de {} filas'.format(sample.sample_size,
+                                                                       sample.population_size)
+
+def add_mean_ci_result(parent_result, series, confidence=0.95,
+                       result_id='mean_ci', result_name='Intervalo de confianza para la media', sample=None):
+    '''Adds a table with the confidence interval for the mean of series.
+    
+    If sample (a :class:`prettyresults.dataloader.SampleInfo`) is given, the data is a
+    sample, and the table includes the margin of error of the estimated mean (with the
+    finite population correction; conservative for stratified samples).
+    '''
+    mean, lower, upper, n = mean_confidence_interval(series.values, confidence)
+    _add_mean_ci_result(parent_result, (mean, lower, upper, n), len(series), confidence,
+                        result_id, result_name, sample)
+    
+def add_mean_ci_result_from_accumulator(parent_result, accumulator, confidence=0.95,
+                                        result_id='mean_ci', result_name='Intervalo de confianza para la media'):
+    '''Like add_mean_ci_result, but taking a :class:`MeanVarianceAccumulator`.'''
+    _add_mean_ci_result(parent_result, accumulator.confidence_interval(confidence), accumulator.total,
+                        confidence, result_id, result_name)
+    
+def _add_mean_ci_result(parent_result, interval, total_cases, confidence, result_id, result_name,
+                        sample=None):
+    mean, lower, upper, n = interval
+    rows = [list(elm) for elm in zip(_MEAN_CI_FIELDS, _mean_ci_values(mean, lower, upper, n,
+                                                                      total_cases, confidence))]
+    if sample is not None:
+        margin = (upper - lower) / 2 * _finite_population_correction(sample)
+        rows.append(['Margen de error (muestreo)', '±{:.2f}'.format(margin)])
+    parent_result.add_keyvalue_table(result_id, result_name, rows,
+                                     post=_sample_note(sample) if sample is not None else '')
+    
+def add_grouped_mean_ci_results(parent_result, df, variable_meta, varnames, by, confidence=0.95):
+    '''Adds a table per variable with the mean confidence interval of each group.
+    
+    Intervals are computed with :func:`grouped_mean_confidence_intervals`. Each table has
+    the ID of the variable and a row per group, with the same fields as add_mean_ci_result.
+    
+    Args:
+        parent_result (ContainerResult): the container tables are added to.
+        df (pandas.DataFrame): the data.
+        variable_meta (dict): the variable metadata. Groups are shown with their labels
+            if the grouping variables have metadata.
+        varnames (list of str): the variables to compute intervals for.
+        by (str or list of str): the grouping variable(s).
+        confidence (float): the confidence level.
+    '''
+    variable_meta = VariableSchema.compile(variable_meta)
+    by_list = [by] if isinstance(by, str) else list(by)
+    intervals = grouped_mean_confidence_intervals(df, varnames, by_list, confidence)
+    by_descs = [variable_meta[name]['desc'] if name in variable_meta else name for name in by_list]
+    for varname in varnames:
+        var_intervals = intervals.loc[varname]
+        group_labels = [var_intervals.index.get_level_values(i) for i in range(len(by_list))]
+        group_labels = [readable_index(labels, variable_meta[name]) if name in variable_meta else labels
+                        for labels, name in zip(group_labels, by_list)]
+        rows = []
+        for i, (total, n, mean, _, lower, upper) in enumerate(var_intervals.itertuples(index=False)):
+            values = _mean_ci_values(mean, lower, upper, int(n), int(total), confidence)
+            group = ', '.join(str(labels[i]) for labels in group_labels)
+            rows.append([group] + [value for field, value in zip(_MEAN_CI_FIELDS, values)
+                                   if field != 'Confianza'])
+        headings = [' / '.join(by_descs)] + [field for field in _MEAN_CI_FIELDS if field != 'Confianza']
+        parent_result.add_table(
+            varname,
+            '{}: intervalo de confianza para la media por {}'.format(
+                variable_meta[varname]['desc'], ', '.join(by_descs)),
+            headings,
+            rows,
+            pre='Confianza: {}'.format(confidence)
+        )
 
 def add_histogram_result(parent_result, series, var_meta):
-    series.hist(bins=var_meta.get('bins'))
-    plt.xlabel(var_meta['desc'])
-    plt.ylabel('Frecuencia')
-    plt.title(var_meta['desc'])
-    parent_result.add_figure('hist', 'Histograma')
-    plt.close('all')
+    values = pd.to_numeric(series).dropna()
+    bins = var_meta.get('bins')
+    _add_histogram_chart(parent_result, np.histogram(values, 10 if bins is None else bins), var_meta)
+    
+def add_histogram_result_from_accumulator(parent_result, accumulator, var_meta):
+    '''Like add_histogram_result, but taking a :class:`HistogramAccumulator`.'''
+    x, bins, weights = accumulator.hist_args()
+    _add_histogram_chart(parent_result, np.histogram(x, bins, weights=weights), var_meta)
+    
+def _add_histogram_chart(parent_result, histogram, var_meta):
+    parent_result.add_chart('hist', 'Histograma', 'histogram', histogram,
+                            title=var_meta['desc'], xlabel=var_meta['desc'])
 
     
-def add_frequency_results(parent_result, series, var_meta, *, calculate_value_counts=True, bar_plot=True, pie_plot=False):
+def add_frequency_results(parent_result, series, var_meta, *, calculate_value_counts=True, bar_plot=True, pie_plot=False,
+                          sample=None):
+    '''Adds the frequency table of a variable, and its bar and pie charts.
+    
+    If sample (a :class:`prettyresults.dataloader.SampleInfo`) is given, the data is a
+    sample, and the table includes the margin of error of each percentage, at 95%
+    confidence (with the finite population correction; conservative for stratified samples).
+    '''
     if calculate_value_counts:
         value_counts = series.value_counts()
+        sample_size = len(series.index)
+        num_nans = series.isna().sum()
     else:
         value_counts = series.copy()
-        
+        sample_size = None
+        num_nans = None
+    _add_frequency_results(parent_result, value_counts, var_meta, sample_size, num_nans,
+                           bar_plot=bar_plot, pie_plot=pie_plot, sample=sample)
+    
+def add_frequency_results_from_counts(parent_result, counts, var_meta, *, bar_plot=True, pie_plot=False,
+                                      sample=None):
+    '''Like add_frequency_results, but taking counts computed by :func:`frequency_counts`.'''
+    _add_frequency_results(parent_result, counts.value_counts.copy(), var_meta,
+                           counts.sample_size, counts.num_nans, bar_plot=bar_plot, pie_plot=pie_plot,
+                           sample=sample)
+    
+def _add_frequency_results(parent_result, value_counts, var_meta, sample_size, num_nans, *, bar_plot, pie_plot,
+                           sample=None):
+    # sample_size and num_nans are None if value_counts were provided by the user
+    
     # Pretty value counts
     value_counts.index = readable_index(value_counts.index, var_meta)
     value_counts.index.name = var_meta['desc']
     
     # Bar plot
     if bar_plot:
-        freq_bar(value_counts, title=var_meta['desc'])
-        parent_result.add_figure('freq_bar', 'Gráfico de frecuencias')
+        parent_result.add_chart('freq_bar', 'Gráfico de frecuencias', 'bar', value_counts,
+                                title=var_meta['desc'])
         
     # Pie plot
     if pie_plot:
-        freq_pie(value_counts, title=var_meta['desc'])
-        parent_result.add_figure('freq_pie', 'Gráfico de frecuencias (diagrama de sectores)')
+        parent_result.add_chart('freq_pie', 'Gráfico de frecuencias (diagrama de sectores)', 'pie',
+                                value_counts, title=var_meta['desc'])
     
     # Table
     effective_sample_size = value_counts.sum()
-    if calculate_value_counts:
-        sample_size = len(series.index)
-        num_nans = series.isna().sum()
+    if sample_size is not None:
         nans_percent = 100.0*num_nans/sample_size
         table_post = 'N = {}, perdidos = {} ({:.2f}%)'.format(sample_size, num_nans, nans_percent)
     else:
@@ -85,6 +242,12 @@ def add_frequency_results(parent_result, series, var_meta, *, calculate_value_co
         'Frecuencia': value_counts,
         'Porcentaje': value_counts.map(lambda v: '{:.2f}%'.format(100.0*v/effective_sample_size))
     })
+    if sample is not None:
+        proportions = value_counts / effective_sample_size
+        margins = (100.0 * stats.norm.ppf(0.975) * _finite_population_correction(sample) *
+                   np.sqrt(proportions * (1.0 - proportions) / effective_sample_size))
+        df_value_counts['Margen de error'] = margins.map(lambda v: '±{:.2f}%'.format(v))
+        table_post = '{}. {}'.format(table_post, _sample_note(sample))
     parent_result.add_dataframe_table(
         'freq_table',
         'Tabla de frecuencias',
@@ -92,41 +255,194 @@ def add_frequency_results(parent_result, series, var_meta, *, calculate_value_co
         post=table_post
     )
     
-    plt.close('all')
-    
 def add_per_year_frequency_result(parent_result, series, per_year_series, var_meta):
+    _add_per_year_frequency_result(parent_result, pd.crosstab(per_year_series, series), var_meta)
+    
+def _add_per_year_frequency_result(parent_result, cross_year, var_meta):
     desc = var_meta['desc']
-    cross_year = pd.crosstab(per_year_series, series)
     cross_year.columns = readable_index(cross_year.columns, var_meta)
     cross_year.columns.name = desc
-    freq_bar(cross_year, '{} por año'.format(desc), ylabel='Frecuencia')
-    parent_result.add_figure('freq_bar_by_year', 'Gráfico de frecuencias por año')
-    plt.close('all')
+    parent_result.add_chart('freq_bar_by_year', 'Gráfico de frecuencias por año', 'bar', cross_year,
+                            title='{} por año'.format(desc))
+    
+def _add_frequency_descriptives(parent_result, series, per_year_series, var_meta, per_year_codes, sample=None):
+    if per_year_codes is None:
+        add_frequency_results(parent_result, series, var_meta, sample=sample) # table & bar plot
+        add_per_year_frequency_result(parent_result, series, per_year_series, var_meta)
+    else:
+        _add_frequency_descriptives_from_counts(parent_result, frequency_counts(series, per_year_codes), var_meta,
+                                                sample)
+        
+def _add_frequency_descriptives_from_counts(parent_result, counts, var_meta, sample=None):
+    add_frequency_results_from_counts(parent_result, counts, var_meta, sample=sample)
+    _add_per_year_frequency_result(parent_result, counts.cross_year.copy(), var_meta)
     
 # Apply a default set of single variable analysis to all variables
-def _descriptive(parent_result, df, varname, var_meta, year_name='AÑO'):
-    result = parent_result.add_container(varname, '{} ({})'.format(var_meta['desc'], varname))
+def _descriptive(parent_result, df, varname, var_meta, year_name='AÑO', per_year_codes=None, memoize=False):
+    name = '{} ({})'.format(var_meta['desc'], varname)
+    if memoize:
+        return parent_result.add_memoized_container(varname, name, _add_descriptive_results,
+                                                    _descriptive_inputs(df, varname, year_name),
+                                                    varname, var_meta, year_name, per_year_codes)
+    container = parent_result.add_container(varname, name)
+    _add_descriptive_results(container, df, varname, var_meta, year_name, per_year_codes)
+    return container
+        
+def _descriptive_inputs(df, varname, year_name):
+    # The columns (and originals metadata) the results of a variable depend on
+    columns = [varname, year_name, varname + '_ORIGINAL']
+    res = df[[column for column in dict.fromkeys(columns) if column in df]]
+    originals = df.attrs.get(ORIGINALS_ATTR, {})
+    res.attrs = { ORIGINALS_ATTR: { varname: originals[varname] } } if varname in originals else {}
+    if SAMPLE_ATTR in df.attrs:
+        res.attrs[SAMPLE_ATTR] = df.attrs[SAMPLE_ATTR]
+    return res
     
+def _add_descriptive_results(result, df, varname, var_meta, year_name, per_year_codes):
+    sample = sample_info(df)
     if var_meta['type'] == VarType.Int:
         add_histogram_result(result, df[varname], var_meta)
-        add_mean_ci_result(result, df[varname])
+        add_mean_ci_result(result, df[varname], sample=sample)
     else:
-        add_frequency_results(result, df[varname], var_meta) # table & bar plot
-        add_per_year_frequency_result(result, df[varname], df[year_name], var_meta)
+        _add_frequency_descriptives(result, df[varname], df[year_name], var_meta, per_year_codes, sample)
         
         # Original counts (if they exist)
-        orig_varname = varname + '_ORIGINAL'
-        if orig_varname in df:
+        orig_series = original_values(df, varname, var_meta)
+        if orig_series is not None:
             orig_result = result.add_container('orig', 'Datos originales')
-            add_frequency_results(orig_result, df[orig_varname], var_meta)
-            add_per_year_frequency_result(orig_result, df[orig_varname], df[year_name], var_meta)
+            _add_frequency_descriptives(orig_result, orig_series, df[year_name], var_meta, per_year_codes,
+                                        sample)
 
     
-def descriptives(parent_result, df, variable_meta, varnames=None, year_name='AÑO'):
+def _descriptive_task(parent_result, varname, df, variable_meta, year_name, per_year_codes, memoize):
+    # Task of add_parallel_results
+    return _descriptive(parent_result, df, varname, variable_meta[varname], year_name, per_year_codes, memoize)
+    
+def descriptives(parent_result, df, variable_meta, varnames=None, year_name='AÑO', batched=False, workers=1,
+                 memoize=False):
+    '''Adds a default set of descriptive results for each variable, under the
+    container result named as the variable 'category'.
+    
+    If batched is True, the frequency table and the per-year cross table of each
+    non-Int variable are computed with :func:`frequency_counts`, in a single pass over
+    the variable codes, instead of several pandas operations. Results are the same.
+    
+    If workers > 1, variables are analyzed (and their figures rendered) in that many
+    worker processes. Results are added in the same order as with a single process.
+    
+    If memoize is True, the container of each variable is memoized (see
+    :meth:`ContainerResult.add_memoized_container`) by the variable and year columns
+    and the variable metadata, so the results of unchanged variables are reused from
+    previous runs.
+    
+    Derived variables are analyzed as the rest: the functions that compute them are
+    not needed (nor sent to worker processes, as they may not be picklable).
+    '''
+    variable_meta = VariableSchema.compile(variable_meta).without_derivations()
     if varnames is None:
         varnames = variable_meta.keys()
+    per_year_codes = year_codes(df[year_name]) if batched else None
+    tasks = [(parent_result.get_child(variable_meta[varname]['category']), varname)
+             for varname in varnames if variable_meta[varname].get('descriptive', True)]
+    if workers > 1 and len(tasks) > 1:
+        add_parallel_results(tasks, _descriptive_task, (df, variable_meta, year_name, per_year_codes, memoize),
+                             workers)
+    else:
+        for result, varname in tasks:
+            _descriptive(result, df, varname, variable_meta[varname], year_name, per_year_codes, memoize)
+
+# Streaming descriptives
+def _make_accumulators(var_meta):
+    if var_meta['type'] == VarType.Int:
+        return (MeanVarianceAccumulator(),
+                HistogramAccumulator(var_meta.get('bins'), var_meta.get('range')))
+    else:
+        return (FrequencyAccumulator(), FrequencyAccumulator()) # values and original values
+
+def _accumulate_chunk(chunk, variable_meta, varnames, year_name):
+    # Returns the accumulators of each variable, fed with a chunk
+    per_year_codes = year_codes(chunk[year_name])
+    res = {}
+    for varname in varnames:
+        var_meta = variable_meta[varname]
+        accumulators = _make_accumulators(var_meta)
+        if var_meta['type'] == VarType.Int:
+            for accumulator in accumulators:
+                accumulator.update(chunk[varname])
+        else:
+            accumulators[0].update_codes(chunk[varname], per_year_codes)
+            orig_series = original_values(chunk, varname, var_meta)
+            if orig_series is not None:
+                accumulators[1].update_codes(orig_series, per_year_codes)
+        res[varname] = accumulators
+    return res
+
+# State of streaming descriptives worker processes, set by _init_accumulate_worker
+_worker_state = None
+
+def _accumulate_worker(chunk):
+    return _accumulate_chunk(chunk, *_worker_state)
+
+def _init_accumulate_worker(variable_meta, varnames, year_name):
+    global _worker_state
+    _worker_state = (variable_meta, varnames, year_name)
+    
+def _accumulate_parallel(chunks, workers, initargs):
+    # Yields the accumulators of each chunk, in order. At most 2 chunks per worker are
+    # pending at any time, so chunks are not read faster than they are processed.
+    with process_pool(workers, _init_accumulate_worker, initargs) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.submit(_accumulate_worker, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def streaming_descriptives(parent_result, chunks, variable_meta, varnames=None, year_name='AÑO', workers=1):
+    '''Like :func:`descriptives`, but computed from an iterable of dataframes, so the
+    whole data never needs to be in memory.
+    
+    Each chunk is summarized by mergeable accumulators (see the accumulators module),
+    which are combined in order. Results are the same as those of :func:`descriptives`
+    over the concatenated chunks, except for histograms of variables with a 'range' in
+    their metadata, which use fixed bins over that range instead of the data range.
+    
+    Args:
+        parent_result (ContainerResult): the container results are added to.
+        chunks (iterable of pandas.DataFrame): the data, e.g. as returned by
+            pandas.read_csv with a chunksize, or parts of a dataframe loaded by
+            :meth:`DataLoader.load_data`.
+        variable_meta (dict): the variable metadata.
+        varnames (list of str): the variables to analyze (all of them by default).
+        year_name (str): the name of the year variable.
+        workers (int): if > 1, chunks are summarized in that many worker processes.
+    '''
+    variable_meta = VariableSchema.compile(variable_meta).without_derivations()
+    if varnames is None:
+        varnames = variable_meta.keys()
+    varnames = [varname for varname in varnames if variable_meta[varname].get('descriptive', True)]
+    if workers > 1:
+        partials = _accumulate_parallel(chunks, workers, (variable_meta, varnames, year_name))
+    else:
+        partials = (_accumulate_chunk(chunk, variable_meta, varnames, year_name) for chunk in chunks)
+    totals = {varname: _make_accumulators(variable_meta[varname]) for varname in varnames}
+    for partial in partials:
+        for varname, accumulators in partial.items():
+            for total, accumulator in zip(totals[varname], accumulators):
+                total.merge(accumulator)
+    
     for varname in varnames:
-        category = variable_meta[varname]['category']
-        result = parent_result.get_child(category)
-        if variable_meta[varname].get('descriptive', True):
-            _descriptive(result, df, varname, variable_meta[varname], year_name)
\ No newline at end of file
+        var_meta = variable_meta[varname]
+        category_result = parent_result.get_child(var_meta['category'])
+        result = category_result.add_container(varname, '{} ({})'.format(var_meta['desc'], varname))
+        if var_meta['type'] == VarType.Int:
+            mean_variance, histogram = totals[varname]
+            add_histogram_result_from_accumulator(result, histogram, var_meta)
+            add_mean_ci_result_from_accumulator(result, mean_variance)
+        else:
+            values, orig_values = totals[varname]
+            _add_frequency_descriptives_from_counts(result, values.counts(), var_meta)
+            if orig_values.table is not None:
+                orig_result = result.add_container('orig', 'Datos originales')
+                _add_frequency_descriptives_from_counts(orig_result, orig_values.counts(), var_meta)
@@ -0,0 +1,171 @@
+import json
+import sys
+import threading
+import time
+from collections import namedtuple
+
+# An event emitted by an EventEmitter. time is the Unix time it was emitted at,
+# and data a dict with the event fields
+Event = namedtuple('Event', ('name', 'time', 'data'))
+
+# Events emitted by prettyresults, and their fields:
+#   result_added: id, type, count (results added so far)
+#   figure_rendered: id, seconds (spent rendering and writing it), cached (Word charts only)
+#   data_loaded: fname, rows, columns, warnings, cached, seconds
+#   web_file_written: path (relative to the web directory), bytes, count, total
+#   word_result_written: id, count, total
+EVENT_NAMES = ('result_added', 'figure_rendered', 'data_loaded', 'web_file_written', 'word_result_written')
+
+class EventEmitter(object):
+    '''
+    Calls the registered listeners when events are emitted.
+
+    Listeners are callables taking an :class:`Event`. Emitting an event nobody listens
+    to costs a function call, so events can be left on in production.
+    '''
+    def __init__(self):
+        self._listeners = {}
+
+    def on(self, name, listener):
+        '''Registers a listener.
+
+        Args:
+            name (str): the event name (one of EVENT_NAMES), or '*' for all events.
+            listener (callable): function called with each :class:`Event`.
+        Returns:
+            The listener, so it can be used as a decorator.
+        '''
+        if name != '*' and name not in EVENT_NAMES:
+            raise ValueError('Unknown event: {}'.format(name))
+        self._listeners.setdefault(name, []).append(listener)
+        return listener
+
+    def off(self, name, listener):
+        '''Unregisters a listener registered with :meth:`on`.'''
+        listeners = self._listeners[name]
+        listeners.remove(listener)
+        if not listeners:
+            del self._listeners[name]
+
+    def listening(self, name):
+        '''Whether there are listeners for an event. Allows skipping the work of
+        computing event fields (e.g. timings) when nobody uses them.'''
+        return name in self._listeners or '*' in self._listeners
+
+    def emit(self, name, **data):
+        '''Calls the listeners of an event, with the given fields.'''
+        if not self._listeners:
+            return
+        listeners = self._listeners.get(name, []) + self._listeners.get('*', [])
+        if listeners:
+            event = Event(name, time.time(), data)
+            for listener in listeners:
+                listener(event)
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+class ProgressPrinter(object):
+    '''
+    Event listener that prints the progress of long runs, with a progress bar and
+    the estimated remaining time when the total is known (writing web and Word files).
+
+    To avoid flooding the output, progress is printed at most every interval seconds
+    (plus whenever a task finishes).
+
+    Example::
+
+        ctx.events.on('*', ProgressPrinter())
+    '''
+    _DESCRIPTIONS = {
+        'result_added': 'Resultados añadidos',
+        'figure_rendered': 'Figuras generadas',
+        'web_file_written': 'Ficheros web escritos',
+        'word_result_written': 'Resultados escritos en Word',
+    }
+
+    def __init__(self, stream=None, interval=1.0, width=30):
+        '''
+        Args:
+            stream (file-like or None): where progress is printed (sys.stderr if None).
+            interval (float): minimum number of seconds between progress lines.
+            width (int): width of the progress bars, in characters.
+        '''
+        self.stream = sys.stderr if stream is None else stream
+        self.interval = interval
+        self.width = width
+        self._last_print = None
+        self._counts = {}
+        self._starts = {}
+
+    def __call__(self, event):
+        if event.name == 'data_loaded':
+            self._print('Datos cargados: {} filas, {} columnas en {:.1f} s{}'.format(
+                event.data['rows'], event.data['columns'], event.data['seconds'],
+                ' (caché)' if event.data['cached'] else ''))
+            return
+        count = event.data.get('count', self._counts.get(event.name, 0) + 1)
+        if count <= self._counts.get(event.name, 0):
+            self._starts.pop(event.name, None) # the task started again
+        self._counts[event.name] = count
+        start = self._starts.setdefault(event.name, event.time)
+        total = event.data.get('total')
+        finished = total is not None and count >= total
+        now = time.monotonic()
+        if not finished and self._last_print is not None and now - self._last_print < self.interval:
+            return
+        description = self._DESCRIPTIONS.get(event.name, event.name)
+        if total:
+            filled = int(self.width * count / total)
+            line = '{}: [{}{}] {}/{} ({:.0%})'.format(description, '#' * filled, '.' * (self.width - filled),
+                                                     count, total, count / total)
+            if not finished:
+                remaining = (event.time - start) * (total - count) / count
+                line += ', quedan {}'.format(_format_seconds(remaining))
+        else:
+            line = '{}: {}'.format(description, count)
+        self._print(line)
+
+    def _print(self, line):
+        self._last_print = time.monotonic()
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+class JsonLinesLogger(object):
+    '''
+    Event listener that writes every event as a line of JSON, with the event name
+    and time plus its fields.
+
+    Example::
+
+        with JsonLinesLogger('events.jsonl') as logger:
+            ctx.events.on('*', logger)
+            ...
+    '''
+    def __init__(self, fname):
+        '''
+        Args:
+            fname (str or file-like): path of the file to append to, or an open text file.
+        '''
+        self._owns_file = isinstance(fname, str)
+        self._file = open(fname, 'at', encoding='utf-8') if self._owns_file else fname
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(dict({ 'event': event.name, 'time': event.time }, **event.data),
+                          ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,135 @@
+import enum
+import functools
+import hashlib
+from collections.abc import Mapping
+import sys
+import types
+
+# Files are hashed in blocks of this size, to avoid reading them into memory at once
+_FILE_BLOCK_SIZE = 1024 * 1024
+
+def _update_state(hasher, obj):
+    # Objects are hashed by their class and their attributes (plus their
+    # contents, for subclasses of containers, like collections.Counter)
+    _update(hasher, type(obj).__qualname__)
+    if isinstance(obj, (Mapping, list, tuple)):
+        _update(hasher, obj)
+    _update(hasher, getattr(obj, '__dict__', repr(obj)))
+
+def _update_callable(hasher, fun):
+    if isinstance(fun, functools.partial):
+        _update(hasher, fun.func)
+        _update(hasher, fun.args)
+        _update(hasher, fun.keywords)
+        return
+    if isinstance(fun, types.MethodType):
+        # Bound method: its behavior depends on the object it is bound to, too
+        _update(hasher, fun.__func__)
+        _update_state(hasher, fun.__self__)
+        return
+    code = getattr(fun, '__code__', None)
+    if code is None:
+        # Callable object: its behavior is given by its class and its state
+        _update_state(hasher, fun)
+        return
+    import inspect
+    try:
+        _update(hasher, inspect.getsource(fun))
+    except (OSError, TypeError):
+        _update(hasher, code.co_code)
+        _update(hasher, code.co_consts)
+    # Closures created by factories like combine_variables share their source,
+    # but not the values they were created with
+    _update(hasher, fun.__defaults__)
+    for cell in fun.__closure__ or ():
+        try:
+            contents = cell.cell_contents
+        except ValueError: # empty cell
+            contents = None
+        _update(hasher, contents)
+
+def _is_instance(obj, module_name, class_names):
+    # numpy and pandas objects can only exist if their module was imported,
+    # so there is no need to import it just to check types
+    module = sys.modules.get(module_name)
+    return module is not None and isinstance(obj, tuple(getattr(module, name) for name in class_names))
+
+def _update_pandas(hasher, obj):
+    pd = sys.modules['pandas']
+    # Values (and index) are hashed row by row by pandas; dtypes (which include
+    # category order), names and attrs are hashed separately
+    if isinstance(obj, pd.DataFrame):
+        _update(hasher, [str(dtype) for dtype in obj.dtypes])
+        _update(hasher, list(obj.columns))
+    else:
+        _update(hasher, (str(obj.dtype), obj.name))
+    if not isinstance(obj, pd.Index):
+        _update(hasher, obj.attrs)
+    hasher.update(pd.util.hash_pandas_object(obj, index=not isinstance(obj, pd.Index)).values.tobytes())
+
+def _update(hasher, obj):
+    hasher.update(type(obj).__name__.encode())
+    if isinstance(obj, bytes):
+        hasher.update(obj)
+    elif isinstance(obj, str):
+        hasher.update(obj.encode('utf-8'))
+    elif isinstance(obj, enum.Enum):
+        hasher.update(repr(obj).encode('utf-8'))
+    elif isinstance(obj, Mapping):
+        # Insertion order is meaningful (e.g. category order in labels)
+        for key, value in obj.items():
+            _update(hasher, key)
+            _update(hasher, value)
+    elif _is_instance(obj, 'pandas', ('Series', 'DataFrame', 'Index')):
+        _update_pandas(hasher, obj)
+    elif _is_instance(obj, 'numpy', ('ndarray',)):
+        _update(hasher, (str(obj.dtype), obj.shape))
+        if obj.dtype == object:
+            _update(hasher, obj.tolist())
+        else:
+            hasher.update(sys.modules['numpy'].ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(str(len(obj)).encode())
+        for elm in obj:
+            _update(hasher, elm)
+    elif callable(obj):
+        _update_callable(hasher, obj)
+    else:
+        hasher.update(repr(obj).encode('utf-8'))
+    hasher.update(b';')
+
+def fingerprint(*objs):
+    '''Computes a stable hex digest identifying the passed objects.
+
+    Dicts, lists and tuples are hashed recursively. pandas objects and numpy arrays
+    are hashed by their contents and dtypes. Functions are hashed by their
+    source code, default arguments and closure contents, so two derived variable
+    computations built by the same factory with different arguments get different
+    fingerprints. functools.partial objects are hashed by their function and arguments,
+    and bound methods by their function and the attributes of their object. Global
+    variables referenced by functions are not taken into account.
+    '''
+    hasher = hashlib.blake2b(digest_size=20)
+    for obj in objs:
+        _update(hasher, obj)
+    return hasher.hexdigest()
+
+def file_fingerprint(fname):
+    '''Computes a hex digest of the contents of a file.
+
+    Args:
+        fname (str or file-like): path to the file, or an open file object. File objects
+            are read from their current position and rewound afterwards.
+    '''
+    hasher = hashlib.blake2b(digest_size=20)
+    if hasattr(fname, 'read'):
+        start = fname.tell()
+        empty = fname.read(0) # '' or b'', depending on the file mode
+        for block in iter(lambda: fname.read(_FILE_BLOCK_SIZE), empty):
+            hasher.update(block.encode('utf-8') if isinstance(block, str) else block)
+        fname.seek(start)
+    else:
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(_FILE_BLOCK_SIZE), b''):
+                hasher.update(block)
+    return hasher.hexdigest()
@@ -1,11 +1,10 @@
-import webbrowser
 from os import path
 import os
+import json
 import shutil
 import tempfile
 
-from .results import ResultManager
-from .word import WordGenerator
+from .results import ResultManager, DEFAULT_MAX_TABLE_CELLS
 
 class ResultTree(object):
     '''
@@ -16,7 +15,7 @@ class ResultTree(object):
     A ResultTree is also associated to a results directory, where temporary files will
     be written to.
     '''
-    def __init__(self, results_directory=None, container_results=[]):
+    def __init__(self, results_directory=None, container_results=[], max_table_cells=DEFAULT_MAX_TABLE_CELLS):
         '''
         Initializes the result tree and creates the root result (a container
         result with ID 'root'.
@@ -33,6 +32,10 @@ class ResultTree(object):
                 Element 0 is the container unqualified ID, element 1 is the container
                 display name, and element 2 is a list of child containers to be created, with the
                 same described format (so the structure can be arbitrarily nested).
+                
+            max_table_cells (int): Tables with more cells than this have their rows
+                stored in separate files in the results directory, keeping only a preview
+                in the result data (see :class:`prettyresults.results.TableResult`).
         '''
         if results_directory is None:
             self._temp_dir = tempfile.TemporaryDirectory()
@@ -40,7 +43,7 @@ class ResultTree(object):
         else:
             os.makedirs(results_directory, exist_ok=True)
         self._results_directory = results_directory
-        self._result_manager = ResultManager(results_directory, container_results)
+        self._result_manager = ResultManager(results_directory, container_results, max_table_cells)
 
     def get_result(self, result_id):
         '''Returns a result object identified by result_id. Raises KeyError if not found.
@@ -51,11 +54,35 @@ class ResultTree(object):
             Result object.
         '''
         return self._result_manager[result_id]
+
+    def add_container_label(self, label):
+        '''Adds a label to every container result added in this run, including the ones
+        added afterwards. Results kept from previous runs are not labeled, and the label
+        is not carried over to the containers of later runs.
+        :meth:`prettyresults.DataLoader.load_data` uses it to mark the results computed
+        from a sample.
+
+        Args:
+            label (prettyresults.results.Label): the label.
+        '''
+        self._result_manager.add_container_label(label)
+    
+    @property
+    def events(self):
+        '''
+        The :class:`prettyresults.events.EventEmitter` of this tree, to follow the
+        progress of long runs. Register listeners with its on() method, e.g.
+        :code:`ctx.events.on('*', ProgressPrinter())`. See
+        :data:`prettyresults.events.EVENT_NAMES` for the emitted events.
+        Read-only.
+        '''
+        return self._result_manager.events
     
     def dump_results(self):
         self._result_manager.dump()
             
-    def generate_web(self, web_directory, *, open_browser=False, overwrite=False):
+    def generate_web(self, web_directory, *, open_browser=False, overwrite=False,
+                     static_hosting=False, workers=1):
         '''Generates the web page.
         
         The webpage will be created under web_directory and will contain every result
@@ -65,10 +92,18 @@ class ResultTree(object):
         the directory will be RECURSIVELY REMOVED. If remove_if_exists is False and the
         directory exists, an exception of type FileExistsError will be raised.
         
+        With static_hosting=True, the output is prepared to be served by a static file
+        server: result data is written as compact JSON, scripts, stylesheets and
+        result files get content-hashed names (listed in manifest.json), so they can
+        be cached indefinitely, and text files get precompressed .gz siblings (and .br
+        ones, if the brotli package is installed). index.html can still be opened directly.
+        
         Args:
             web_directory (str): Path where the web page will be placed under.
             open_browser (bool): If True, the resulting page will be open in a new web browser tab.
             overwrite (bool): If True, the directory will be removed if already exists.
+            static_hosting (bool): If True, prepare the output for static hosting (see above).
+            workers (int): Number of files to compress in parallel, for static_hosting.
         '''
         # Create the directory
         if not overwrite and path.exists(web_directory):
@@ -78,24 +113,83 @@ class ResultTree(object):
         shutil.copytree(path.join(project_dir, 'web'), web_directory)
         os.makedirs(web_directory, exist_ok=True)
         
-        # Generate result_data.js
-        with open(path.join(web_directory, 'result_data.js'), 'wt') as f:
-            f.write('var ANALYSIS_RESULTS = ')
-            self._result_manager.dump_result_data(f)
-            
         # Copy additional files
         web_result_directory = path.join(web_directory, 'results')
         os.makedirs(web_result_directory, exist_ok=True)
-        for fname in os.listdir(self._results_directory):
-            full_path = path.join(self._results_directory, fname)
-            if path.isfile(full_path):
-                shutil.copy2(full_path, path.join(web_directory, 'results', fname))
+        result_file_names = {}
+        if static_hosting:
+            from .static_hosting import (hashed_name, hash_assets, rename_result_files,
+                                         write_manifest, compress_files)
+        events = self.events
+        fnames = [fname for fname in os.listdir(self._results_directory)
+                  if path.isfile(path.join(self._results_directory, fname))]
+        num_files = len(fnames) + 1 # plus result_data.js
+        for i, fname in enumerate(fnames):
+            shutil.copy2(path.join(self._results_directory, fname), path.join(web_result_directory, fname))
+            if static_hosting:
+                result_file_names[fname] = hashed_name(path.join(web_result_directory, fname))
+            if events.listening('web_file_written'):
+                written_fname = result_file_names.get(fname, fname)
+                events.emit('web_file_written', path='results/' + written_fname,
+                            bytes=os.path.getsize(path.join(web_result_directory, written_fname)),
+                            count=i + 1, total=num_files)
+        
+        # Generate result_data.js
+        result_data = self._result_manager.result_data()
+        if static_hosting:
+            result_data['results'] = [rename_result_files(obj, result_file_names)
+                                      for obj in result_data['results']]
+        with open(path.join(web_directory, 'result_data.js'), 'wt') as f:
+            f.write('var ANALYSIS_RESULTS = ')
+            if static_hosting:
+                json.dump(result_data, f, separators=(',', ':'))
+            else:
+                json.dump(result_data, f, indent=4)
+            data_size = f.tell()
+        events.emit('web_file_written', path='result_data.js', bytes=data_size, count=num_files, total=num_files)
+        
+        # Hashed names and compression
+        if static_hosting:
+            hashed_names = hash_assets(web_directory)
+            hashed_names.update({ 'results/' + fname: 'results/' + hashed_fname
+                                  for fname, hashed_fname in result_file_names.items() })
+            write_manifest(web_directory, hashed_names)
+            compress_files(web_directory, workers)
             
         # Open the browser
         if open_browser:
+            import webbrowser
             webbrowser.open('file:///{}/index.html'.format(web_directory), new=2)
             
-    def generate_word(self, output_file, result_ids=None):
+    def serve(self, port=8000, *, open_browser=False):
+        '''Starts a local web server that shows the results, as an alternative to
+        :meth:`generate_web` during development.
+        
+        The web page is served directly from the results directory, without copying
+        anything, and open pages are updated as results are added. The server runs in a
+        background thread, and only accepts connections from the local machine.
+        
+        Example::
+        
+            server = ctx.serve()
+            descriptives.descriptives(ctx.get_result('root'), df, variables)
+            server.close()
+        
+        Args:
+            port (int): The port to listen on (0 picks a free one).
+            open_browser (bool): If True, the web page will be open in a new web browser tab.
+        Returns:
+            The running :class:`prettyresults.server.ResultServer`. Call its close()
+            method (or use it as a context manager) to stop it.
+        '''
+        from .server import ResultServer
+        server = ResultServer(self._result_manager, self._results_directory, port)
+        if open_browser:
+            import webbrowser
+            webbrowser.open(server.url, new=2)
+        return server
+            
+    def generate_word(self, output_file, result_ids=None, max_table_rows=None):
         '''Generates a Microsoft Word (.docx) file with the results known to the analysis context.
 
         Args:
@@ -106,7 +200,10 @@ class ResultTree(object):
                 to be included in the output document. If the specified results have
                 children, these will be recursively be included, too.
                 If set to None, all results will be included.
+            max_table_rows (int or None): Tables with more rows are truncated to this
+                number of rows, with a note. If None, all rows are included (the rows
+                of large tables are read from their files one by one).
         '''
-        
-        WordGenerator(self._result_manager.results,
-                      self._results_directory).generate(output_file, result_ids)
+        from .word import WordGenerator # python-docx is only needed here
+        WordGenerator(self._result_manager.results, self._results_directory,
+                      max_table_rows, self.events).generate(output_file, result_ids)
@@ -1,11 +1,30 @@
+import csv
 import json
+import math
+import os
 from os import path
-from matplotlib import pyplot as plt
 from collections import namedtuple
+import time
 import weakref
 
+from .fingerprint import fingerprint
+from .events import EventEmitter
+
+# matplotlib, numpy and pandas are imported by the methods that need them, so
+# loading and generating results does not pay for them
+
 Label = namedtuple('Label', ('color', 'text'))
 
+# Tables with more cells than this have their rows stored in separate files
+# (see TableResult), unless ResultTree is configured otherwise
+DEFAULT_MAX_TABLE_CELLS = 100000
+
+# Rows of large tables kept in the result data, as a preview
+TABLE_PREVIEW_ROWS = 50
+
+# Rows per page file of large tables, loaded by the web page on demand
+TABLE_PAGE_ROWS = 1000
+
     
 class BaseResult(object):
     '''
@@ -40,6 +59,10 @@ class BaseResult(object):
     def dump(self):
         pass
     
+    def files(self):
+        '''The names of the files this result stores in the results directory.'''
+        return []
+    
     @property
     def result_type(self):
         return self.__class__.__name__
@@ -66,6 +89,14 @@ class ContainerResult(BaseResult):
     Attributes:
         name (str): Human-readable display name for the result.
     '''
+    def __init__(self, *args, fingerprint=None, **kwargs):
+        # fingerprint identifies the inputs of memoized containers
+        # (see add_memoized_container)
+        super().__init__(*args, **kwargs)
+        if fingerprint is not None:
+            self.data = {
+                'fingerprint': fingerprint
+            }
     
     def add_container(self, id_, name, **kwargs):
         '''
@@ -90,18 +121,53 @@ class ContainerResult(BaseResult):
                        this container result and must not contain the dot '.' character.
                        See :ref:`this topic <result_ids>` for more info.
             name (str): Human-friendly display name for the result to be created.
-            fig (matplotlib.pyplot.figure or 'current'): The matplotlib figure with
+            fig (matplotlib.pyplot.figure, 'current' or bytes): The matplotlib figure with
                 the figure of interest. If the string 'current' is passed (this is the default),
                 the current figure will be used (as returned by matplotlib.pyplot.gcf()).
                 The figure is immediately saved to a temporary file, and thus can be closed
-                safely after this function returns.
+                safely after this function returns. A JPEG image already rendered
+                (e.g. by :mod:`prettyresults.charts`) may be passed as bytes, too.
         Returns:
             The newly created :class:`FigureResult` object.
         '''
         if fig == 'current':
+            from matplotlib import pyplot as plt
             fig = plt.gcf()
         return self._create_and_add(FigureResult, id_, name, fig, **kwargs)
     
+    def add_chart(self, id_, name, kind, values, title='', xlabel='', ylabel='Frecuencia', **kwargs):
+        '''
+        Creates a new chart result from its data and adds it as a child of this container.
+        
+        Unlike figures, charts are not rendered when they are added: the web page draws
+        them from their data, and they are rendered as images only when generating
+        Word documents.
+        
+        Args:
+            id_ (str): Unqualified ID of the result to be added. Must be unique within
+                       this container result and must not contain the dot '.' character.
+                       See :ref:`this topic <result_ids>` for more info.
+            name (str): Human-friendly display name for the result to be created.
+            kind (str): 'bar', 'pie' or 'histogram'.
+            values: For bar and pie charts, a pandas Series with the bar heights (or wedge
+                sizes), with the x axis values as index. Bar charts also accept a DataFrame,
+                which gets a group of bars per row and a legend with the columns.
+                For histograms, a (counts, edges) tuple, as returned by numpy.histogram.
+            title (str): The chart title.
+            xlabel (str): The x axis label.
+            ylabel (str): The y axis label.
+        Returns:
+            The newly created :class:`ChartResult` object.
+        '''
+        if kind == 'histogram':
+            counts, edges = values
+            content = { 'series': [{ 'name': '', 'values': ChartResult.json_values(counts) }],
+                        'edges': ChartResult.json_values(edges) }
+        else:
+            content = ChartResult.content_from_values(values)
+        return self._create_and_add(ChartResult, id_, name, kind, title=title, xlabel=xlabel,
+                                    ylabel=ylabel, **content, **kwargs)
+    
     def add_table(self, id_, name, headings, rows, pre='', post='', **kwargs):
         '''
         Creates a new table result and adds it as a child of this container.
@@ -117,6 +183,9 @@ class ContainerResult(BaseResult):
                 Each row must have the same number of elements as the passed heaings.
             pre (str): A text string to be placed before the table, optional.
             post (str): A text string to be placed after the table, optional.
+            store_apart (bool): If False, the rows are never stored in a separate file
+                (see :class:`TableResult`), so rows appended to the passed list later
+                are kept, too.
             
         Returns:
             The newly created :class:`TableResult` object.
@@ -171,6 +240,65 @@ class ContainerResult(BaseResult):
         return self._create_and_add(TableResult, id_, name, headings,
                                     values, pre, post, **kwargs)
     
+    def add_memoized_container(self, id_, name, fun, *args, force=False, **kwargs):
+        '''
+        Creates a new container result and fills it by calling
+        :code:`fun(container, *args, **kwargs)`, unless the results of an identical
+        call are available from a previous run.
+        
+        The call is identified by a fingerprint of fun and its arguments (pandas objects
+        are hashed by their contents, so pass only the columns fun needs). If the results
+        directory holds a container with this ID and fingerprint, and all its descendants
+        are available, it is reused and fun is not called. Otherwise, the results of
+        the previous run under this container are discarded and fun is called.
+        
+        Only the source code of fun itself is hashed, not that of the functions it calls:
+        after changing a helper fun uses, pass force=True (or remove the results directory)
+        to recompute the results. Upgrading prettyresults invalidates all memoized results.
+        
+        Example::
+        
+            parent.add_memoized_container('chi2', 'Chi cuadrado', fill_chi2,
+                                          df[['A', 'B']], significance=0.01)
+        
+        Args:
+            id_ (str): Unqualified ID of the result to be added. Must be unique within
+                       this container result and must not contain the dot '.' character.
+                       See :ref:`this topic <result_ids>` for more info.
+            name (str): Human-friendly display name for the result to be created.
+            fun (callable): The function that adds the results to the container.
+            force (bool): If True, fun is always called.
+        Returns:
+            The newly created :class:`ContainerResult` object.
+        '''
+        qualified_id = self._make_qualified_id(id_)
+        from . import __version__
+        key = fingerprint(__version__, fun, args, kwargs)
+        old_result = self.manager.results.get(qualified_id)
+        if not force and self._is_memoized(old_result, key):
+            return self._create_and_add(ContainerResult, id_, name, fingerprint=key)
+        if old_result is not None:
+            self.manager.remove_subtree(qualified_id)
+        container = self._create_and_add(ContainerResult, id_, name)
+        fun(container, *args, **kwargs)
+        # Set once fun has succeeded, so failed calls are not reused
+        container.data = { 'fingerprint': key }
+        return container
+    
+    def _is_memoized(self, result, key):
+        if not isinstance(result, ContainerResult) or result.data.get('fingerprint') != key:
+            return False
+        subtree = self.manager.serialize_subtree(result.id)
+        available = { json_obj['id'] for json_obj in subtree }
+        for json_obj in subtree:
+            if any(child_id not in available for child_id in json_obj['children']):
+                return False
+            descendant = self.manager.results[json_obj['id']]
+            if not all(path.exists(path.join(self.manager.result_directory_path, fname))
+                       for fname in descendant.files()):
+                return False
+        return True
+    
     def get_child(self, id_):
         return self.manager[self.id + '.' + id_]
     
@@ -183,6 +311,22 @@ class ContainerResult(BaseResult):
         if child.id not in self.children:
             self.children.append(child.id)
         self.manager.add(child)
+        
+    def add_serialized(self, json_objs):
+        '''
+        Adds a result subtree serialized by :meth:`ResultManager.serialize_subtree`
+        (e.g. in a worker process), whose root is a child of this container. It replaces
+        any previous subtree with the same root.
+        
+        Args:
+            json_objs (list): the serialized results, parents first.
+        '''
+        if json_objs[0]['id'] in self.manager.results:
+            self.manager.remove_subtree(json_objs[0]['id'])
+        if json_objs[0]['id'] not in self.children:
+            self.children.append(json_objs[0]['id'])
+        for json_obj in json_objs:
+            self.manager.add_serialized(json_obj)
     
     def _create_and_add(self, result_class, id_, name, *args, **kwargs):
         child = result_class(
@@ -205,7 +349,7 @@ class FigureResult(BaseResult):
     '''
     def __init__(self, fig=None, filename=None, **kwargs):
         # pass in fig=None to cause no figure to be saved. Used with
-        # figures loaded from previous runs
+        # figures loaded from previous runs. fig may also be a rendered JPEG image (bytes)
         super().__init__(**kwargs)
         if filename is None:
             filename = self.id + '.jpg'
@@ -217,36 +361,206 @@ class FigureResult(BaseResult):
     @property
     def full_path(self):
         return path.join(self.manager.result_directory_path, self.filename)
+    
+    def files(self):
+        return [self.filename]
 
     def dump(self):
-        if self.unsaved_fig is not None:
+        if self.unsaved_fig is None:
+            return
+        start = time.perf_counter()
+        if isinstance(self.unsaved_fig, bytes):
+            with open(self.full_path, 'wb') as f:
+                f.write(self.unsaved_fig)
+        else:
             self.unsaved_fig.savefig(self.full_path, bbox_inches='tight')
-            self.unsaved_fig = None
+        self.unsaved_fig = None
+        self.manager.events.emit('figure_rendered', id=self.id, seconds=time.perf_counter() - start)
+
+
+class ChartResult(BaseResult):
+    '''
+    A chart result, stored as the data it plots instead of as an image.
+    
+    Attributes:
+        name (str): Human-readable display name for the result.
+        kind (str): 'bar', 'pie' or 'histogram'. Read-only.
+        categories (list of str or None): The x axis values (bar charts) or wedge
+            labels (pie charts). Read-only.
+        series (list of dict): The plotted series, as dicts with 'name' and 'values'
+            (bar heights, wedge sizes or bin counts). Read-only.
+        legend_title (str or None): The legend title, or None if there is no legend. Read-only.
+        edges (list of float or None): The bin edges of histograms. Read-only.
+        title (str): The chart title. Read-only.
+        xlabel (str): The x axis label. Read-only.
+        ylabel (str): The y axis label. Read-only.
+    '''
+    KINDS = ('bar', 'pie', 'histogram')
+    
+    def __init__(self, kind, categories=None, series=(), legend_title=None, edges=None,
+                 title='', xlabel='', ylabel='', **kwargs):
+        super().__init__(**kwargs)
+        if kind not in self.KINDS:
+            raise ValueError('Invalid chart kind: {}'.format(kind))
+        self.data = {
+            'kind': kind,
+            'categories': categories,
+            'series': list(series),
+            'legend_title': legend_title,
+            'edges': edges,
+            'title': title,
+            'xlabel': xlabel,
+            'ylabel': ylabel
+        }
+    
+    def render(self):
+        '''Renders the chart with :mod:`prettyresults.charts`, and returns the JPEG image as bytes.'''
+        import numpy as np
+        import pandas as pd
+        from . import charts
+        def series_values(series):
+            return np.array([np.nan if value is None else value for value in series['values']], dtype=np.float64)
+        if self.kind == 'histogram':
+            return charts.histogram_chart(series_values(self.series[0]), self.edges,
+                                          self.title, self.xlabel, self.ylabel)
+        index = pd.Index(self.categories, name=self.xlabel or None)
+        if self.legend_title is None:
+            values = pd.Series(series_values(self.series[0]), index=index).fillna(0)
+        else:
+            values = pd.DataFrame({ i: series_values(series) for i, series in enumerate(self.series) },
+                                  index=index).fillna(0)
+            values.columns = pd.Index([series['name'] for series in self.series],
+                                      name=self.legend_title or None)
+        if self.kind == 'pie':
+            return charts.pie_chart(values, self.title)
+        return charts.bar_chart(values, self.title, self.xlabel, self.ylabel)
+    
+    @staticmethod
+    def json_values(values):
+        # Plain numbers for JSON: integers are kept as such, and NaN and infinities
+        # (which json.dump would write as invalid JSON) become None
+        import numpy as np
+        return [None if not math.isfinite(value) else int(value) if value.is_integer() else value
+                for value in np.asarray(values, dtype=np.float64).tolist()]
+    
+    @staticmethod
+    def content_from_values(values):
+        import pandas as pd
+        categories = [str(elm) for elm in values.index]
+        if isinstance(values, pd.DataFrame):
+            return {
+                'categories': categories,
+                'series': [{ 'name': str(column), 'values': ChartResult.json_values(values.iloc[:, i]) }
+                           for i, column in enumerate(values.columns)],
+                'legend_title': values.columns.name if values.columns.name is not None else ''
+            }
+        return {
+            'categories': categories,
+            'series': [{ 'name': str(values.name) if values.name is not None else '',
+                         'values': ChartResult.json_values(values) }]
+        }
 
         
 class TableResult(BaseResult):
     '''
     A table result.
     
+    Tables with more cells than the ResultTree max_table_cells have their rows
+    stored apart, in a CSV file (filename) and in pages for the web page, when they
+    are added. Only the first rows are kept in rows, as a preview; use :meth:`iter_rows`
+    to read all of them. Rows cannot be added to these tables afterwards. Files left
+    by a previous run of the same table are removed if no longer used.
+    
     Attributes:
         name (str): Human-readable display name for the result.        
         headings (list of str): The table headings. Read-only.
-        rows (list of list of str): A bi-dimensional list describing the table cells. Read-only.
+        rows (list of list of str): A bi-dimensional list describing the table cells
+            (only the first rows, for large tables). Read-only.
         pre (str): A text string to be placed before the table. Read-only.
         post (str): A text string to be placed after the table. Read-only.
+        filename (str or None): The CSV file with all the rows, in the results directory,
+            or None if the rows are not stored apart. Read-only.
+        row_count (int): The total number of rows. Read-only.
     '''
-    def __init__(self, headings, rows, pre='', post='', **kwargs):
+    def __init__(self, headings, rows, pre='', post='', filename=None, row_count=None,
+                 page_rows=None, pages=None, store_apart=True, **kwargs):
+        # Tables loaded from previous runs pass filename, row_count, page_rows and
+        # pages if their rows are stored apart. Otherwise, large tables are stored
+        # apart when they are dumped, unless store_apart is False
         super().__init__(**kwargs)
+        self._store_apart = store_apart
+        self._previous_files = []
         self.data = {
             'headings': headings,
             'rows': rows,
             'pre': pre,
             'post': post
         }
+        if filename is not None:
+            self.data.update(filename=filename, row_count=row_count, page_rows=page_rows, pages=pages)
+        
+    @property
+    def filename(self):
+        return self.data.get('filename')
+        
+    @property
+    def row_count(self):
+        return self.data['row_count'] if self.filename is not None else len(self.rows)
         
     def add_row(self, item):
+        if self.filename is not None:
+            raise ValueError('Cannot add rows to a table stored in a separate file: {}'.format(self.id))
         self.data['rows'].append(item)
         
+    def iter_rows(self):
+        '''Iterates over all the table rows, reading them from the CSV file for large tables.'''
+        if self.filename is None:
+            yield from self.rows
+        else:
+            with open(path.join(self.manager.result_directory_path, self.filename),
+                      'rt', newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                next(reader) # headings
+                yield from reader
+        
+    def files(self):
+        return [] if self.filename is None else [self.filename] + self.pages
+    
+    def merge(self, old_result):
+        super().merge(old_result)
+        # Removed by dump if this run does not overwrite them
+        self._previous_files = old_result.files()
+        
+    def dump(self):
+        rows = self.rows
+        if (self.filename is None and self._store_apart and
+                len(rows) * len(self.headings) > self.manager.max_table_cells):
+            self._store_rows_apart(rows)
+        for fname in set(self._previous_files).difference(self.files()):
+            try:
+                os.remove(path.join(self.manager.result_directory_path, fname))
+            except FileNotFoundError:
+                pass
+        self._previous_files = []
+        
+    def _store_rows_apart(self, rows):
+        directory = self.manager.result_directory_path
+        filename = self.id + '.csv'
+        with open(path.join(directory, filename), 'wt', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.headings)
+            writer.writerows(rows)
+        # Pages are scripts, so the web page can load them when opened from disk, too
+        pages = []
+        for start in range(0, len(rows), TABLE_PAGE_ROWS):
+            pages.append('{}.rows-{}.js'.format(self.id, len(pages)))
+            page_rows = [[str(cell) for cell in row] for row in rows[start:start+TABLE_PAGE_ROWS]]
+            with open(path.join(directory, pages[-1]), 'wt', encoding='utf-8') as f:
+                f.write('prettyresultsTablePage({}, {}, {});\n'.format(
+                    json.dumps(self.id), len(pages) - 1, json.dumps(page_rows)))
+        self.data.update(rows=[list(row) for row in rows[:TABLE_PREVIEW_ROWS]], filename=filename,
+                         row_count=len(rows), page_rows=TABLE_PAGE_ROWS, pages=pages)
+        
     @staticmethod
     def content_from_dataframe(df):
         rows_heading = df.index.name if df.index.name is not None else ''
@@ -267,10 +581,15 @@ class TableResult(BaseResult):
 
 class ResultManager(object):
     RESULT_TYPE_MAP = { result.__name__: result for result in
-                        (ContainerResult, FigureResult, TableResult) }
+                        (ContainerResult, FigureResult, ChartResult, TableResult) }
     
-    def __init__(self, result_directory, containers):
+    def __init__(self, result_directory, containers, max_table_cells=DEFAULT_MAX_TABLE_CELLS):
         self._result_directory = result_directory
+        self.max_table_cells = max_table_cells
+        self.events = EventEmitter()
+        self._num_added = 0
+        self._container_labels = []
+        self._added_ids = set() # results added in this run, as opposed to loaded from a previous one
         self._results = self._load_result_directory()
         self._root = ContainerResult(weakref.proxy(self), 'root', 'Root result')
         self.add(self._root)
@@ -295,19 +614,85 @@ class ResultManager(object):
         
         return res
     
-    def dump_result_data(self, fobj):
-        results_array = [{
+    @staticmethod
+    def _result_to_json(result):
+        return {
             'id': result.id,
             'name': result.name,
             'type': result.result_type,
             'data': result.data,
             'labels': result.labels,
             'children': result.children
-        } for result in self._results.values()]
-        json.dump({
+        }
+    
+    def serialize(self, result_id):
+        '''Serializes a single result as a JSON-compatible object.'''
+        return self._result_to_json(self._results[result_id])
+    
+    def serialize_subtree(self, result_id):
+        '''Serializes a result and all its descendants, parents first, as a list of
+        JSON-compatible objects. Used to transfer results created in worker processes.'''
+        res = []
+        pending = [result_id]
+        while pending:
+            result = self._results.get(pending.pop(0))
+            if result is not None:
+                res.append(self._result_to_json(result))
+                pending += result.children
+        return res
+    
+    def add_serialized(self, json_obj):
+        '''Adds a result serialized by :meth:`serialize_subtree`. The result is expected
+        to be already merged with any result from previous runs.'''
+        result = self._result_from_json(json_obj)
+        self._add_container_labels(result)
+        self._results[result.id] = result
+        self._added_ids.add(result.id)
+        self._notify(result)
+    
+    def _notify(self, result):
+        # result_added is emitted once the result has been stored (and its files written)
+        self._num_added += 1
+        self.events.emit('result_added', id=result.id, type=result.result_type, count=self._num_added)
+    
+    def add_container_label(self, label):
+        '''Adds a label to the container results added in this run, including the ones
+        added afterwards. Results loaded from previous runs are left as they are.'''
+        self._container_labels.append(label)
+        for result_id in list(self._added_ids):
+            result = self._results.get(result_id)
+            if result is not None:
+                self._add_container_labels(result)
+    
+    def _add_container_labels(self, result):
+        if not isinstance(result, ContainerResult):
+            return
+        # Labels loaded from JSON are lists. A new list is built, because the
+        # default labels list is shared
+        labels = [tuple(label) for label in result.labels]
+        missing = [label for label in self._container_labels if tuple(label) not in labels]
+        if missing:
+            result.labels = result.labels + missing
+    
+    def remove_subtree(self, result_id):
+        '''Removes a result and all its descendants. The result is not removed from
+        the children of its parent.'''
+        for json_obj in self.serialize_subtree(result_id):
+            del self._results[json_obj['id']]
+    
+    def result_data(self, **extra):
+        '''Returns the JSON-compatible object written by :meth:`dump_result_data`,
+        plus any extra keys.'''
+        # Results may be added from another thread while serving them (see
+        # prettyresults.server), so iterate over a copy
+        results_array = [self._result_to_json(result) for result in list(self._results.values())]
+        return dict({
             'results': results_array,
             'root_result': 'root'
-        }, fobj, indent=4)
+        }, **extra)
+    
+    def dump_result_data(self, fobj, **extra):
+        json.dump(self.result_data(**extra), fobj, indent=4)
         
     @property
     def results(self):
@@ -329,8 +714,11 @@ class ResultManager(object):
         old_result = self._results.get(result.id)
         if old_result is not None:
             result.merge(old_result)
+        self._add_container_labels(result)
         result.dump()
         self._results[result.id] = result
+        self._added_ids.add(result.id)
+        self._notify(result)
   
     def dump(self):
         with open(self.json_path, 'wt') as f:
@@ -342,4 +730,44 @@ class ResultManager(object):
     def _create_containers(self, parent, container_specs):
         for spec in container_specs:
             cont = parent.add_container(spec[0], spec[1])
-            self._create_containers(cont, spec[2])
\ No newline at end of file
+            self._create_containers(cont, spec[2])
+# State of the worker processes of add_parallel_results, set by _init_worker
+_worker_state = None
+
+def _init_worker(results_directory, max_table_cells, fun, shared_args):
+    global _worker_state
+    _worker_state = (ResultManager(results_directory, [], max_table_cells), fun, shared_args)
+
+def _result_worker(task):
+    # Adds the results of a task under a placeholder of its parent (figures are
+    # written to the results directory) and returns them serialized
+    manager, fun, shared_args = _worker_state
+    parent_id, arg = task
+    parent_result = manager.results.get(parent_id)
+    if parent_result is None:
+        parent_result = ContainerResult(manager=manager, id_=parent_id, name='')
+        manager.add(parent_result)
+    result = fun(parent_result, arg, *shared_args)
+    return manager.serialize_subtree(result.id)
+
+def add_parallel_results(tasks, fun, shared_args, workers):
+    '''Adds results in worker processes (see :func:`prettyresults.utils.process_pool`).
+    
+    For each (parent_result, arg) task, :code:`fun(parent_result, arg, *shared_args)`
+    is called in a worker process. It must add a child result to parent_result and
+    return it. The child and its descendants are then added to parent_result in the
+    calling process, in task order, so results are the same as with a single process.
+    
+    Args:
+        tasks (list of tuples): (ContainerResult, argument) pairs.
+        fun (callable): the function that adds the results of a task.
+        shared_args (tuple): arguments common to all tasks, sent once to each worker.
+        workers (int): the number of worker processes.
+    '''
+    from .utils import process_pool
+    manager = tasks[0][0].manager
+    initargs = (manager.result_directory_path, manager.max_table_cells, fun, shared_args)
+    with process_pool(min(workers, len(tasks)), _init_worker, initargs) as pool:
+        serialized = pool.map(_result_worker, [(parent_result.id, arg) for parent_result, arg in tasks])
+        for (parent_result, _), json_objs in zip(tasks, serialized):
+            parent_result.add_serialized(json_objs)
@@ -0,0 +1,142 @@
+import collections
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+from .utils import VarType
+
+DERIVATION_KEYS = ('computation-pre', 'computation-post')
+
+class CompiledVariable(dict):
+    '''
+    The metadata dict of a variable, validated, plus data precomputed from it.
+
+    It can be used anywhere the original dict is (it holds the same keys). The
+    precomputed data is a snapshot: changes to the dict after compiling it are not
+    reflected in the attributes.
+
+    Attributes:
+        name (str): the variable name.
+        label_dict (dict or None): maps raw values and short labels to long labels
+            (None for variables without labels).
+        categorical_dtype (CategoricalDtype or None): for Category variables, the dtype
+            of the raw values (the label keys).
+        label_dtype (CategoricalDtype or None): for Category variables, the dtype of the
+            loaded values (the short labels).
+        derivation_key (str or None): 'computation-pre' or 'computation-post' for
+            derived variables, None otherwise.
+        inputs (list of str or None): the declared inputs of derived variables.
+    '''
+    def __init__(self, name, meta):
+        super().__init__(meta)
+        self.name = name
+        vartype = meta.get('type')
+        if not isinstance(vartype, VarType):
+            raise ValueError('Variable {} has an invalid type: {!r}'.format(name, vartype))
+
+        # Labels
+        self.categorical_dtype = None
+        self.label_dtype = None
+        if vartype == VarType.Category:
+            labels = meta.get('labels')
+            if not isinstance(labels, Mapping) or not all(
+                    isinstance(value, (tuple, list)) and len(value) == 2 for value in labels.values()):
+                raise ValueError('Category variable {} must have labels mapping values '
+                                 'to (short label, long label) pairs'.format(name))
+            ordered = isinstance(labels, collections.OrderedDict)
+            self.categorical_dtype = CategoricalDtype(categories=labels.keys(), ordered=ordered)
+            self.label_dtype = CategoricalDtype(categories=[value[0] for value in labels.values()],
+                                                ordered=ordered)
+            self.label_dict = { value[0]: value[1] for value in labels.values() }
+            self.label_dict.update({ key: value[1] for key, value in labels.items() })
+        elif vartype == VarType.Bool:
+            self.label_dict = { 0.0: 'No', 1.0: 'Sí' }
+        else:
+            self.label_dict = None
+        if self.label_dict is not None:
+            self._label_keys = pd.Index(list(self.label_dict.keys()), dtype=object)
+            self._label_values = np.array(list(self.label_dict.values()), dtype=object)
+
+        # Derivation
+        self.derivation_key = next((key for key in DERIVATION_KEYS if key in meta), None)
+        self.inputs = None
+        if self.derivation_key is not None:
+            fun = meta[self.derivation_key]
+            if not callable(fun):
+                raise ValueError('The {} of variable {} is not callable'.format(self.derivation_key, name))
+            inputs = meta.get('inputs', getattr(fun, 'inputs', None))
+            self.inputs = None if inputs is None else list(inputs)
+
+    def readable_index(self, index):
+        '''Replaces the values of index with their long labels (values without
+        a label are kept). Equivalent to :func:`prettyresults.utils.readable_index`.'''
+        if self.label_dict is None:
+            return index
+        if isinstance(index, pd.CategoricalIndex):
+            # Relabel the categories only
+            categories = self.readable_index(index.categories)
+            if categories.is_unique:
+                return index.rename_categories(categories)
+            return index.map(lambda x: self.label_dict.get(x, x))
+        positions = self._label_keys.get_indexer(index)
+        labeled = positions >= 0
+        if labeled.all():
+            values = self._label_values.take(positions)
+        else:
+            values = np.asarray(index, dtype=object).copy()
+            values[labeled] = self._label_values.take(positions[labeled])
+        return pd.Index(values, name=index.name)
+
+    def to_labels(self, series):
+        '''Converts the raw values of a Category variable to its short labels, as a
+        categorical series. Values without a label become NaN.'''
+        codes = self.categorical_dtype.categories.get_indexer(series)
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=self.label_dtype),
+                         index=series.index, name=series.name)
+
+class VariableSchema(Mapping):
+    '''
+    Variable metadata, validated and compiled once.
+
+    Maps variable names to :class:`CompiledVariable` objects, and can be used
+    anywhere a variable metadata dict is accepted. DataLoader, descriptives and crosses
+    compile the metadata they are passed; compiling it beforehand with
+    :meth:`compile` avoids repeating the work in every call.
+    '''
+    def __init__(self, variables):
+        '''
+        Args:
+            variables (dict): variable metadata, mapping variable names to dicts.
+        Raises:
+            ValueError: if the metadata of a variable is not valid.
+        '''
+        self._variables = { name: meta if isinstance(meta, CompiledVariable) else CompiledVariable(name, meta)
+                            for name, meta in variables.items() }
+
+    @classmethod
+    def compile(cls, variables):
+        '''Returns variables as a VariableSchema, compiling it only if it is not one already.'''
+        return variables if isinstance(variables, cls) else cls(variables)
+
+    def without_derivations(self):
+        '''Returns a copy of the schema without the functions of derived variables (their
+        'computation-pre' and 'computation-post' keys). The copy can be pickled, e.g. to
+        send it to worker processes, as long as the rest of the metadata can.'''
+        return VariableSchema({ name: { key: value for key, value in meta.items() if key not in DERIVATION_KEYS }
+                                for name, meta in self._variables.items() })
+
+    def __getitem__(self, name):
+        return self._variables[name]
+
+    def __iter__(self):
+        return iter(self._variables)
+
+    def __len__(self):
+        return len(self._variables)
+
+def compile_variable(variables, name):
+    '''Returns the compiled metadata of a variable, compiling only that variable if
+    variables is not a VariableSchema.'''
+    meta = variables[name]
+    return meta if isinstance(meta, CompiledVariable) else CompiledVariable(name, meta)
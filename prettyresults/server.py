@@ -0,0 +1,260 @@
+import collections
+import hashlib
+import http.server
+import io
+import json
+import mimetypes
+import os
+from os import path
+import posixpath
+import re
+import threading
+from urllib.parse import urlsplit, unquote, parse_qs
+
+# Seconds between keep-alive comments sent over idle event streams
+_KEEPALIVE_INTERVAL = 15.0
+
+# Number of result updates remembered to bring reconnecting pages up to date.
+# Pages that missed more updates receive all results again
+_HISTORY_SIZE = 10000
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+class ResultServer(object):
+    '''
+    A local web server to preview results while they are being computed
+    (see :meth:`prettyresults.ResultTree.serve`).
+
+    The web page is served directly from the result tree and its results directory,
+    so nothing is copied. Open pages are updated as results are added, through
+    server-sent events. The server only accepts connections from the local machine,
+    and runs in a background thread until :meth:`close` is called.
+    '''
+    def __init__(self, manager, results_directory, port=8000):
+        self._manager = manager
+        self._results_directory = results_directory
+        self._web_directory = path.join(path.dirname(path.realpath(__file__)), 'web')
+        self._condition = threading.Condition()
+        self._sequence = 0
+        self._history = collections.deque(maxlen=_HISTORY_SIZE) # (sequence, result ID)
+        self._closed = False
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), _RequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.result_server = self
+        manager.events.on('result_added', self._on_result_added)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        '''The URL of the web page. Type: str. Read-only.'''
+        host, port = self._httpd.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def close(self):
+        '''Stops the server, closing any open event streams.'''
+        if self._closed:
+            return
+        self._manager.events.off('result_added', self._on_result_added)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _on_result_added(self, event):
+        with self._condition:
+            self._sequence += 1
+            self._history.append((self._sequence, event.data['id']))
+            self._condition.notify_all()
+
+    def result_data(self):
+        # result_data.js, plus the sequence number of the last update it includes,
+        # from which the page requests further updates. The sequence is read
+        # before the results, so updates made meanwhile are sent again, not lost
+        with self._condition:
+            sequence = self._sequence
+        f = io.StringIO()
+        f.write('var ANALYSIS_RESULTS = ')
+        self._manager.dump_result_data(f, sequence=sequence)
+        return f.getvalue().encode('utf-8')
+
+    def wait_for_updates(self, since, timeout):
+        '''Waits until there are updates after the since sequence number.
+
+        Returns:
+            None if the server was closed, or a (sequence, result IDs) tuple,
+            with the sequence number of the last update. The tuple is (since, [])
+            if there are no updates before the timeout.
+        '''
+        with self._condition:
+            if since > self._sequence:
+                since = -1 # the page comes from a previous server
+            self._condition.wait_for(lambda: self._sequence > since or self._closed, timeout)
+            if self._closed:
+                return None
+            if self._sequence == since:
+                return since, []
+            if not self._history or self._history[0][0] > since + 1:
+                # Some updates are not in the history anymore: send everything
+                return self._sequence, list(self._manager.results)
+            return self._sequence, list(dict.fromkeys(
+                result_id for sequence, result_id in self._history if sequence > since))
+
+    def serialize_updates(self, sequence, result_ids):
+        # Each updated result goes with its parent, whose children may have changed.
+        # version lets the page reload figures that were overwritten
+        res = {}
+        for result_id in result_ids:
+            for update_id in (result_id.rpartition('.')[0], result_id):
+                if update_id and update_id in self._manager.results:
+                    res[update_id] = dict(self._manager.serialize(update_id), version=sequence)
+        return json.dumps(list(res.values())).encode('utf-8')
+
+    def file_path(self, url_path):
+        # Maps an URL path (already normalized) to a file of the web page or the results directory
+        if url_path.startswith('/results/'):
+            base_directory, url_path = self._results_directory, url_path[len('/results/'):]
+        else:
+            base_directory = self._web_directory
+        return path.join(base_directory, *[part for part in url_path.split('/') if part])
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def _handle(self, send_body):
+        server = self.server.result_server
+        url = urlsplit(self.path)
+        url_path = posixpath.normpath(unquote(url.path)) # removes any '..'
+        if url_path in ('/', '/index.html'):
+            self._send_file(server.file_path('/index.html'), send_body)
+        elif url_path == '/result_data.js':
+            body = server.result_data()
+            self._send_body(body, 'application/javascript; charset=utf-8',
+                            '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest()), send_body)
+        elif url_path == '/events':
+            since = parse_qs(url.query).get('since', ['-1'])[0]
+            since = self.headers.get('Last-Event-ID', since)
+            self._send_events(server, int(since) if since.lstrip('-').isdigit() else -1)
+        else:
+            self._send_file(server.file_path(url_path), send_body)
+
+    def _not_modified(self, etag):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is None:
+            return False
+        return if_none_match.strip() == '*' or etag in [elm.strip() for elm in if_none_match.split(',')]
+
+    def _send_file(self, full_path, send_body):
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            stat = None
+        if stat is None or not path.isfile(full_path):
+            self.send_error(404)
+            return
+        etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        if self._not_modified(etag):
+            self._send_not_modified(etag)
+            return
+        byte_range = self._byte_range(stat.st_size, etag)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(stat.st_size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        with open(full_path, 'rb') as f:
+            if byte_range is None:
+                self._send_body(f.read(), content_type, etag, send_body)
+                return
+            start, end = byte_range
+            f.seek(start)
+            body = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, stat.st_size))
+        self._send_headers(content_type, etag, len(body))
+        if send_body:
+            self.wfile.write(body)
+
+    def _byte_range(self, size, etag):
+        # Returns the (start, end) of the requested range (both included), None to
+        # send the whole file, or False if the range cannot be satisfied
+        header = self.headers.get('Range')
+        if header is None or self.headers.get('If-Range', etag) != etag:
+            return None
+        match = _RANGE_RE.fullmatch(header.strip())
+        if match is None or match.groups() == ('', ''):
+            return None # unsupported (e.g. multiple ranges): ignored, as allowed by the RFC
+        start, end = match.groups()
+        if start == '':
+            start, end = max(size - int(end), 0), size - 1 # suffix range
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        if start > end:
+            return False
+        return start, end
+
+    def _send_headers(self, content_type, etag, length):
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        # Revalidate every time: results change while serving
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+    def _send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+    def _send_body(self, body, content_type, etag, send_body):
+        if self._not_modified(etag):
+            self._send_not_modified(etag)
+            return
+        self.send_response(200)
+        self._send_headers(content_type, etag, len(body))
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_events(self, server, since):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                updates = server.wait_for_updates(since, _KEEPALIVE_INTERVAL)
+                if updates is None:
+                    return
+                sequence, result_ids = updates
+                if result_ids:
+                    data = server.serialize_updates(sequence, result_ids)
+                    self.wfile.write(b'id: ' + str(sequence).encode() + b'\ndata: ' + data + b'\n\n')
+                else:
+                    self.wfile.write(b': keep-alive\n\n')
+                self.wfile.flush()
+                since = sequence
+        except (BrokenPipeError, ConnectionResetError):
+            pass # the page was closed
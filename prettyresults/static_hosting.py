@@ -0,0 +1,87 @@
+import concurrent.futures
+import gzip
+import json
+import os
+from os import path
+import re
+
+from .fingerprint import file_fingerprint
+
+try:
+    import brotli
+except ImportError: # optional: .br files are only written if it is installed
+    brotli = None
+
+# Files that get precompressed siblings
+COMPRESSED_EXTENSIONS = ('.html', '.js', '.css', '.json', '.svg', '.txt')
+
+MANIFEST_FILENAME = 'manifest.json'
+
+# Number of hex digits of the content hash included in file names
+_HASH_LENGTH = 12
+
+def hashed_name(full_path):
+    '''Renames a file to include a hash of its contents before its extension
+    (e.g. app.js to app.0123456789ab.js), and returns the new file name.'''
+    directory, fname = path.split(full_path)
+    stem, extension = path.splitext(fname)
+    res = '{}.{}{}'.format(stem, file_fingerprint(full_path)[:_HASH_LENGTH], extension)
+    os.replace(full_path, path.join(directory, res))
+    return res
+
+def rename_result_files(result_obj, names):
+    '''Returns a copy of a serialized result, with the files it references
+    (figure files, or the files of large tables) renamed as given by names.'''
+    data = dict(result_obj['data'])
+    if data.get('filename') is not None:
+        data['filename'] = names.get(data['filename'], data['filename'])
+    if data.get('pages') is not None:
+        data['pages'] = [names.get(page, page) for page in data['pages']]
+    return dict(result_obj, data=data)
+
+def hash_assets(web_directory, index_fname='index.html'):
+    '''Gives content-hashed names to the scripts and stylesheets directly under
+    web_directory, and updates the references to them in the index page.
+
+    Returns:
+        A dict mapping the original names to the hashed ones.
+    '''
+    res = {}
+    for fname in sorted(os.listdir(web_directory)):
+        if fname.endswith(('.js', '.css')) and path.isfile(path.join(web_directory, fname)):
+            res[fname] = hashed_name(path.join(web_directory, fname))
+    index_path = path.join(web_directory, index_fname)
+    with open(index_path, 'rt', encoding='utf-8') as f:
+        index = f.read()
+    index = re.sub(r'((?:src|href)=")([^"]*)(")',
+                   lambda match: match.group(1) + res.get(match.group(2), match.group(2)) + match.group(3),
+                   index)
+    with open(index_path, 'wt', encoding='utf-8') as f:
+        f.write(index)
+    return res
+
+def write_manifest(web_directory, hashed_names):
+    '''Writes manifest.json, mapping the original file paths (relative to web_directory)
+    to the hashed ones, so the server can give them long-lived cache headers.'''
+    with open(path.join(web_directory, MANIFEST_FILENAME), 'wt') as f:
+        json.dump(hashed_names, f, indent=1, sort_keys=True)
+
+def _compress(full_path):
+    with open(full_path, 'rb') as f:
+        data = f.read()
+    # mtime=0 makes the output reproducible
+    with open(full_path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(full_path + '.br', 'wb') as f:
+            f.write(brotli.compress(data))
+
+def compress_files(web_directory, workers=1):
+    '''Writes .gz (and .br, if the brotli package is installed) siblings of the
+    text files under web_directory, compressing up to workers files in parallel.'''
+    paths = [path.join(directory, fname)
+             for directory, _, fnames in os.walk(web_directory)
+             for fname in fnames if fname.endswith(COMPRESSED_EXTENSIONS)]
+    # zlib and brotli release the GIL while compressing, so threads are enough
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_compress, paths))
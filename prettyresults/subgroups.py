@@ -0,0 +1,128 @@
+import re
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+
+from .results import add_parallel_results
+from .schema import compile_variable
+from .accumulators import value_codes
+
+# A segment of the data: key is the value of the by column (a tuple, for several
+# columns), id and name those of its container, and positions the row positions
+Segment = namedtuple('Segment', ['key', 'id', 'name', 'positions'])
+
+def segment_positions(df, by):
+    '''Partitions the rows of df by the values of one or more columns, in a single pass.
+
+    Equivalent to the indices of df.groupby(by, sort=True, observed=True), but
+    computed from integer codes, so subsetting the data for every segment does
+    not require scanning it again.
+
+    Args:
+        df (pandas.DataFrame): the data.
+        by (str or list of str): the columns defining the segments.
+    Returns:
+        A list of (key, positions) tuples, sorted by key (categories keep their order).
+        key is the column value (a tuple, if by is a list), and positions an array with
+        the positions of its rows, in order. Rows with NaN in any of the by columns are
+        not included in any segment.
+    '''
+    columns = [by] if isinstance(by, str) else list(by)
+    encoded = [value_codes(df[column], sort=True) for column in columns]
+    valid = np.ones(len(df.index), dtype=bool)
+    for codes, _ in encoded:
+        valid &= codes >= 0
+    rows = np.flatnonzero(valid)
+    shape = [max(len(values), 1) for _, values in encoded]
+    group_codes = np.ravel_multi_index([codes[valid] for codes, _ in encoded], shape)
+    order = np.argsort(group_codes, kind='stable')
+    sorted_codes = group_codes[order]
+    boundaries = np.flatnonzero(np.diff(sorted_codes)) + 1
+    res = []
+    for start, positions in zip(np.concatenate([[0], boundaries]), np.split(rows[order], boundaries)):
+        if len(positions) == 0:
+            continue
+        indices = np.unravel_index(sorted_codes[start], shape)
+        key = tuple(values[i] for (_, values), i in zip(encoded, indices))
+        res.append((key[0] if isinstance(by, str) else key, positions))
+    return res
+
+def _segment_id(key):
+    parts = key if isinstance(key, tuple) else (key,)
+    return '-'.join(re.sub(r'[^0-9A-Za-z_-]', '_', str(part)) for part in parts)
+
+def _segment_name(key, by, variable_meta):
+    parts = key if isinstance(key, tuple) else (key,)
+    columns = [by] if isinstance(by, str) else list(by)
+    labels = []
+    for column, part in zip(columns, parts):
+        if variable_meta is not None and column in variable_meta:
+            part = compile_variable(variable_meta, column).readable_index(pd.Index([part]))[0]
+        labels.append(str(part))
+    return ', '.join(labels)
+
+def segments(df, by, variable_meta=None, min_size=1):
+    '''Like :func:`segment_positions`, but returning :class:`Segment` named tuples, with
+    the ID and name of their containers. Names use the long labels of variable_meta,
+    if given. Segments with less than min_size rows are left out.'''
+    res = []
+    used_ids = set()
+    for key, positions in segment_positions(df, by):
+        if len(positions) < min_size:
+            continue
+        segment_id = base_id = _segment_id(key)
+        suffix = 2
+        while segment_id in used_ids:
+            segment_id = '{}_{}'.format(base_id, suffix)
+            suffix += 1
+        used_ids.add(segment_id)
+        res.append(Segment(key, segment_id, _segment_name(key, by, variable_meta), positions))
+    return res
+
+def _add_segment_results(parent_result, segment, df, fun, args, kwargs):
+    container = parent_result.add_container(segment.id, segment.name)
+    fun(container, df.take(segment.positions), *args, **kwargs)
+    return container
+
+def subgroup_results(parent_result, df, by, fun, args=(), kwargs=None, variable_meta=None, min_size=1, workers=1):
+    '''Runs an analysis for each segment of the data, adding its results under a
+    container per segment.
+
+    The data is partitioned once (see :func:`segment_positions`), instead of being
+    filtered with a mask for every segment. For each segment,
+    :code:`fun(container, segment_df, *args, **kwargs)` is called, where container is
+    a new child of parent_result, with the segment ID (built from its value) and name.
+
+    Example::
+
+        def analysis(container, segment_df):
+            container.add_container('ingresos', 'Ingresos')
+            descriptives.descriptives(container, segment_df, variables, ['INGRESOS'])
+
+        by_region = root.add_container('by_region', 'Por región')
+        subgroup_results(by_region, df, 'REGION', analysis, variable_meta=variables, workers=4)
+
+    Args:
+        parent_result (ContainerResult): the container where segment containers are added.
+        df (pandas.DataFrame): the data.
+        by (str or list of str): the columns defining the segments.
+        fun (callable): the analysis function.
+        args (tuple): additional positional arguments for fun.
+        kwargs (dict or None): keyword arguments for fun.
+        variable_meta (dict or None): variable metadata, used to name segments with
+            the long labels of the by variables.
+        min_size (int): segments with less rows than this are skipped.
+        workers (int): if > 1, segments are analyzed in that many worker processes.
+            Results are added in the same order as with a single process.
+    Returns:
+        The list of :class:`Segment` tuples that were analyzed.
+    '''
+    segment_list = segments(df, by, variable_meta, min_size)
+    kwargs = {} if kwargs is None else kwargs
+    if workers > 1 and len(segment_list) > 1:
+        add_parallel_results([(parent_result, segment) for segment in segment_list],
+                             _add_segment_results, (df, fun, args, kwargs), workers)
+    else:
+        for segment in segment_list:
+            _add_segment_results(parent_result, segment, df, fun, args, kwargs)
+    return segment_list
@@ -1,5 +1,5 @@
 import enum
-from matplotlib import pyplot as plt
+import sys
 
 class VarType(enum.Enum):
     Int = 1
@@ -16,6 +16,36 @@ def _get_label_dict(variable):
     else:
         return None
     
+def process_pool(workers, initializer=None, initargs=()):
+    '''Creates a concurrent.futures.ProcessPoolExecutor with the given number of workers.
+    
+    On Linux, worker processes are forked, so initargs are inherited instead of pickled.
+    This allows passing objects referencing lambdas or closures (like variable metadata
+    with computation functions). Other platforms use the 'spawn' start method, as forking
+    is unsafe there (e.g. on macOS, with system frameworks using threads), so initargs
+    must be picklable.
+    '''
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(_start_method()),
+                               initializer=initializer, initargs=initargs)
+
+def _start_method():
+    # See process_pool
+    return 'fork' if sys.platform.startswith('linux') else 'spawn'
+
+def can_send_to_workers(obj):
+    '''Returns whether obj can be passed to the worker processes of :func:`process_pool`
+    (in initargs): always on Linux, and only if it can be pickled on other platforms.'''
+    if _start_method() == 'fork':
+        return True
+    import pickle
+    try:
+        pickle.dumps(obj)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
 def format_float(value, decimals=2):
     return ('{:.' + str(decimals) + 'f}').format(value)
 
@@ -23,6 +53,8 @@ def format_percentage(value):
     return format_float(value) + '%'
     
 def readable_index(index, variable):
+    if hasattr(variable, 'readable_index'): # compiled (see schema.CompiledVariable)
+        return variable.readable_index(index)
     label_dict = _get_label_dict(variable)
     if label_dict is None:
         return index
@@ -35,6 +67,7 @@ def make_index_readable(obj, variable):
     
 # Plots
 def freq_bar(value_counts, title='', xlabel='', ylabel='Frecuencia', rot=0, x_value_labels_dict=None, **kwargs):
+    from matplotlib import pyplot as plt
     plt.figure(figsize=(8,5))
     ax = value_counts.plot.bar(title=title, rot=rot, **kwargs)
     plt.xlabel(xlabel)
@@ -50,6 +83,7 @@ def freq_bar(value_counts, title='', xlabel='', ylabel='Frecuencia', rot=0, x_va
                     fontsize=8, fontweight='bold', ha='center', va='bottom')
 
 def freq_pie(value_counts, size=8.0, **kwargs):
+    from matplotlib import pyplot as plt
     plt.figure(figsize=(size, size)) # Prevent distortion
     ax = value_counts.plot.pie(legend=True, use_index=False,
                                labels=None, autopct='%.2f%%',
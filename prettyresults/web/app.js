@@ -1,16 +1,252 @@
 
 RESULT_FA_GLYPHICONS_OPEN = {
     'FigureResult': 'fa-bar-chart',
+    'ChartResult': 'fa-bar-chart',
     'TableResult': 'fa-table',
     'ContainerResult': 'fa-folder-open',
 }
 
 RESULT_FA_GLYPHICONS_CLOSED = {
     'FigureResult': 'fa-bar-chart',
+    'ChartResult': 'fa-bar-chart',
     'TableResult': 'fa-table',
     'ContainerResult': 'fa-folder',
 }
 
+// Chart results are drawn as SVG from their data, with the look of the
+// images rendered for Word documents (matplotlib's default colors and layout)
+CHART_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+CHART_WIDTH = 800
+CHART_HEIGHT = 500
+CHART_MARGIN = { left: 70, right: 20, top: 40, bottom: 70 }
+SVG_NS = 'http://www.w3.org/2000/svg'
+
+function svgElement(parent, name, attrs, text) {
+    var elm = document.createElementNS(SVG_NS, name)
+    angular.forEach(attrs, function(value, key) {
+        elm.setAttribute(key, value)
+    })
+    if (text !== undefined) {
+        elm.textContent = text
+    }
+    parent.appendChild(elm)
+    return elm
+}
+
+function formatNumber(value) {
+    return String(parseFloat(value.toPrecision(6)))
+}
+
+// Evenly spaced round tick values from min to max. If extend is true, the last
+// tick is the first one at or above max, so it can be used as the axis limit
+function niceTicks(min, max, count, extend) {
+    if (!(max > min)) {
+        max = min + 1
+    }
+    var rawStep = (max - min) / count
+    var magnitude = Math.pow(10, Math.floor(Math.log(rawStep) / Math.LN10))
+    var step = 10 * magnitude
+    angular.forEach([5, 2.5, 2, 1], function(multiple) {
+        if (multiple * magnitude >= rawStep) {
+            step = multiple * magnitude
+        }
+    })
+    var last = extend ? Math.ceil(max / step) : Math.floor(max / step + 1e-9)
+    var ticks = []
+    for (var i = Math.ceil(min / step - 1e-9); i <= last; i++) {
+        ticks.push(parseFloat((i * step).toPrecision(12)))
+    }
+    return ticks
+}
+
+function chartValue(value) {
+    return value === null ? 0 : value
+}
+
+// Draws the y axis (ticks, labels and grid lines) and returns the y scale
+function drawYAxis(svg, plot, maxValue, grid) {
+    var ticks = niceTicks(0, maxValue * 1.05, 5, true)
+    var yMax = ticks[ticks.length - 1]
+    var y = function(value) {
+        return plot.bottom - (value / yMax) * (plot.bottom - plot.top)
+    }
+    angular.forEach(ticks, function(tick) {
+        svgElement(svg, 'line', { x1: plot.left - 4, x2: plot.left, y1: y(tick), y2: y(tick), stroke: 'black' })
+        svgElement(svg, 'text', { x: plot.left - 7, y: y(tick) + 4, 'text-anchor': 'end', 'font-size': 12 },
+                   formatNumber(tick))
+        if (grid) {
+            svgElement(svg, 'line', { x1: plot.left, x2: plot.right, y1: y(tick), y2: y(tick), stroke: '#b0b0b0' })
+        }
+    })
+    return y
+}
+
+function drawLegend(svg, plot, title, names, colors) {
+    var width = 20 + 7 * Math.max.apply(null, [(title || '').length].concat(names.map(function(name) {
+        return name.length + 4
+    })))
+    var top = plot.top + 8
+    var height = names.length * 18 + (title ? 20 : 6)
+    var left = plot.right - width - 8
+    svgElement(svg, 'rect', { x: left, y: top, width: width, height: height, fill: 'white',
+                              stroke: '#cccccc', rx: 3, 'fill-opacity': 0.8 })
+    var y = top + 4
+    if (title) {
+        svgElement(svg, 'text', { x: left + width / 2, y: y + 12, 'text-anchor': 'middle', 'font-size': 12 }, title)
+        y += 16
+    }
+    angular.forEach(names, function(name, i) {
+        svgElement(svg, 'rect', { x: left + 8, y: y + 4, width: 20, height: 9, fill: colors[i % colors.length] })
+        svgElement(svg, 'text', { x: left + 34, y: y + 13, 'font-size': 12 }, name)
+        y += 18
+    })
+}
+
+function drawBarChart(svg, chart, plot) {
+    var numGroups = chart.categories.length
+    var numSeries = chart.series.length
+    var maxValue = 1
+    angular.forEach(chart.series, function(series) {
+        angular.forEach(series.values, function(value) {
+            maxValue = Math.max(maxValue, chartValue(value))
+        })
+    })
+    var y = drawYAxis(svg, plot, maxValue, false)
+    var band = (plot.right - plot.left) / numGroups
+    var barWidth = band * 0.5 / numSeries
+    angular.forEach(chart.series, function(series, i) {
+        angular.forEach(series.values, function(value, j) {
+            var x = plot.left + band * (j + 0.5) + (i - (numSeries - 1) / 2) * barWidth
+            value = chartValue(value)
+            svgElement(svg, 'rect', { x: x - barWidth / 2, y: y(value), width: barWidth,
+                                      height: plot.bottom - y(value), fill: CHART_COLORS[i % CHART_COLORS.length] })
+            svgElement(svg, 'text', { x: x, y: y(value) - 3, 'text-anchor': 'middle', 'font-size': 10,
+                                      'font-weight': 'bold' }, formatNumber(Math.round(value)))
+        })
+    })
+    var rotate = numGroups > 8
+    angular.forEach(chart.categories, function(category, j) {
+        var x = plot.left + band * (j + 0.5)
+        svgElement(svg, 'line', { x1: x, x2: x, y1: plot.bottom, y2: plot.bottom + 4, stroke: 'black' })
+        svgElement(svg, 'text', { x: x, y: plot.bottom + 18, 'font-size': 12,
+                                  'text-anchor': rotate ? 'end' : 'middle',
+                                  transform: rotate ? 'rotate(-45 ' + x + ' ' + (plot.bottom + 18) + ')' : '' },
+                   category)
+    })
+    if (chart.legend_title !== null) {
+        drawLegend(svg, plot, chart.legend_title, chart.series.map(function(series) {
+            return series.name
+        }), CHART_COLORS)
+    }
+}
+
+function drawHistogram(svg, chart, plot) {
+    var counts = chart.series[0].values.map(chartValue)
+    var edges = chart.edges
+    var xMin = edges[0]
+    var xMax = edges[edges.length - 1] > xMin ? edges[edges.length - 1] : xMin + 1
+    var x = function(value) {
+        return plot.left + (value - xMin) / (xMax - xMin) * (plot.right - plot.left)
+    }
+    var y = drawYAxis(svg, plot, Math.max.apply(null, [1].concat(counts)), true)
+    angular.forEach(niceTicks(xMin, xMax, 6, false), function(tick) {
+        svgElement(svg, 'line', { x1: x(tick), x2: x(tick), y1: plot.top, y2: plot.bottom, stroke: '#b0b0b0' })
+        svgElement(svg, 'line', { x1: x(tick), x2: x(tick), y1: plot.bottom, y2: plot.bottom + 4, stroke: 'black' })
+        svgElement(svg, 'text', { x: x(tick), y: plot.bottom + 18, 'text-anchor': 'middle', 'font-size': 12 },
+                   formatNumber(tick))
+    })
+    angular.forEach(counts, function(count, i) {
+        svgElement(svg, 'rect', { x: x(edges[i]), y: y(count), width: x(edges[i + 1]) - x(edges[i]),
+                                  height: plot.bottom - y(count), fill: CHART_COLORS[0] })
+    })
+}
+
+function drawPieChart(svg, chart, plot) {
+    var values = chart.series[0].values.map(chartValue)
+    var total = values.reduce(function(a, b) { return a + b }, 0)
+    var cx = (plot.left + plot.right) / 2
+    var cy = (plot.top + plot.bottom) / 2
+    var r = Math.min(plot.right - plot.left, plot.bottom - plot.top) / 2
+    // Wedges start at 3 o'clock and go counterclockwise, like matplotlib's
+    var angle = 0
+    angular.forEach(values, function(value, i) {
+        if (!(total > 0) || value <= 0) {
+            return
+        }
+        var fraction = value / total
+        var end = angle + 2 * Math.PI * fraction
+        var color = CHART_COLORS[i % CHART_COLORS.length]
+        if (fraction >= 1) {
+            svgElement(svg, 'circle', { cx: cx, cy: cy, r: r, fill: color })
+        } else {
+            svgElement(svg, 'path', { fill: color, d: [
+                'M', cx, cy,
+                'L', cx + r * Math.cos(angle), cy - r * Math.sin(angle),
+                'A', r, r, 0, end - angle > Math.PI ? 1 : 0, 0, cx + r * Math.cos(end), cy - r * Math.sin(end),
+                'Z'
+            ].join(' ') })
+        }
+        var middle = (angle + end) / 2
+        svgElement(svg, 'text', { x: cx + 0.6 * r * Math.cos(middle), y: cy - 0.6 * r * Math.sin(middle) + 4,
+                                  'text-anchor': 'middle', 'font-size': 12 }, (100 * fraction).toFixed(2) + '%')
+        angle = end
+    })
+    drawLegend(svg, plot, '', chart.categories, CHART_COLORS)
+}
+
+function drawChart(chart) {
+    var svg = document.createElementNS(SVG_NS, 'svg')
+    svg.setAttribute('viewBox', '0 0 ' + CHART_WIDTH + ' ' + CHART_HEIGHT)
+    svg.setAttribute('width', CHART_WIDTH)
+    svg.setAttribute('font-family', 'sans-serif')
+    var plot = { left: CHART_MARGIN.left, right: CHART_WIDTH - CHART_MARGIN.right,
+                 top: CHART_MARGIN.top, bottom: CHART_HEIGHT - CHART_MARGIN.bottom }
+    svgElement(svg, 'text', { x: (plot.left + plot.right) / 2, y: plot.top - 14, 'text-anchor': 'middle',
+                              'font-size': 14 }, chart.title)
+    if (chart.kind == 'pie') {
+        drawPieChart(svg, chart, plot)
+        return svg
+    }
+    if (chart.kind == 'histogram') {
+        drawHistogram(svg, chart, plot)
+    } else {
+        drawBarChart(svg, chart, plot)
+    }
+    svgElement(svg, 'rect', { x: plot.left, y: plot.top, width: plot.right - plot.left,
+                              height: plot.bottom - plot.top, fill: 'none', stroke: 'black' })
+    svgElement(svg, 'text', { x: (plot.left + plot.right) / 2, y: CHART_HEIGHT - 12, 'text-anchor': 'middle',
+                              'font-size': 13 }, chart.xlabel)
+    var yLabelX = 18
+    var yLabelY = (plot.top + plot.bottom) / 2
+    svgElement(svg, 'text', { x: yLabelX, y: yLabelY, 'text-anchor': 'middle', 'font-size': 13,
+                              transform: 'rotate(-90 ' + yLabelX + ' ' + yLabelY + ')' }, chart.ylabel)
+    return svg
+}
+
+// Rows of large tables are stored in page files (see TableResult), which are
+// scripts calling prettyresultsTablePage, so they load from disk, too
+TABLE_PAGE_CALLBACKS = {}
+
+function prettyresultsTablePage(resultId, page, rows) {
+    var key = resultId + '/' + page
+    var callback = TABLE_PAGE_CALLBACKS[key]
+    delete TABLE_PAGE_CALLBACKS[key]
+    if (callback) {
+        callback(rows)
+    }
+}
+
+function loadTablePage(result, page, callback) {
+    TABLE_PAGE_CALLBACKS[result.id + '/' + page] = callback
+    var script = document.createElement('script')
+    script.src = 'results/' + result.data.pages[page] + (result.version ? '?v=' + result.version : '')
+    script.onload = script.onerror = function() {
+        document.head.removeChild(script)
+    }
+    document.head.appendChild(script)
+}
+
 angular.module('app', ['ngSanitize'])
 .filter('faGlyphiconOpen', function() {
     return function(input) {
@@ -27,10 +263,43 @@ angular.module('app', ['ngSanitize'])
     angular.forEach(ANALYSIS_RESULTS.results, function(elm) {
         $scope.results[elm.id] = elm
     })
-    rootResult = $scope.results[ANALYSIS_RESULTS.root_result]
-    $scope.rootResults = rootResult.children.map(function(id) {
-        return $scope.results[id]
-    })
+    var updateRootResults = function() {
+        rootResult = $scope.results[ANALYSIS_RESULTS.root_result]
+        $scope.rootResults = rootResult.children.map(function(id) {
+            return $scope.results[id]
+        })
+    }
+    updateRootResults()
+    // Pages served by ResultTree.serve() are updated as results are added
+    if (ANALYSIS_RESULTS.sequence !== undefined && window.EventSource) {
+        var events = new EventSource('events?since=' + ANALYSIS_RESULTS.sequence)
+        events.onmessage = function(event) {
+            $scope.$apply(function() {
+                angular.forEach(JSON.parse(event.data), function(elm) {
+                    if ($scope.results[elm.id]) {
+                        angular.extend($scope.results[elm.id], elm)
+                    } else {
+                        $scope.results[elm.id] = elm
+                    }
+                })
+                updateRootResults()
+            })
+        }
+    }
+})
+.directive('chart', function() {
+    return {
+        restrict: 'E',
+        scope: {
+            chart: '=chartData'
+        },
+        link: function(scope, element) {
+            scope.$watch('chart', function(chart) {
+                element.empty()
+                element[0].appendChild(drawChart(chart))
+            })
+        }
+    }
 })
 .directive('result', function() {
     return {
@@ -50,6 +319,23 @@ angular.module('app', ['ngSanitize'])
         	$scope.close = function() {
         		$scope.subVisible = false;
         	}
+        	// Large tables show a preview, and then pages of rows loaded on demand
+        	$scope.tablePage = -1;
+        	$scope.pageRows = null;
+        	$scope.tableRows = function() {
+        		return $scope.pageRows || $scope.result.data.rows;
+        	}
+        	$scope.firstTableRow = function() {
+        		return $scope.tablePage < 0 ? 1 : $scope.tablePage * $scope.result.data.page_rows + 1;
+        	}
+        	$scope.showTablePage = function(page) {
+        		loadTablePage($scope.result, page, function(rows) {
+        			$scope.$apply(function() {
+        				$scope.tablePage = page;
+        				$scope.pageRows = rows;
+        			})
+        		})
+        	}
         }]
     }
 })
@@ -1,10 +1,24 @@
+import itertools
+import os
+from os import path
+import re
+import time
 import docx
 
-from .results import ContainerResult, FigureResult, TableResult
+from .results import ContainerResult, FigureResult, ChartResult, TableResult
+from .fingerprint import fingerprint
+from .events import EventEmitter
+
+# Subdirectory of the results directory where chart images are cached
+CHART_CACHE_DIRECTORY = 'chart_images'
 
 class WordGenerator(object):
-    def __init__(self, results, results_dir):
+    def __init__(self, results, results_dir, max_table_rows=None, events=None):
         self.results_dir = results_dir
+        self.max_table_rows = max_table_rows
+        self.events = EventEmitter() if events is None else events
+        self._total = None
+        self._num_written = 0
         self.results = results
         self.doc = docx.Document()
         self._written_ids = set()
@@ -12,6 +26,8 @@ class WordGenerator(object):
     def generate(self, output_file, result_ids=None):
         if result_ids is None:
             result_ids = self.results['root'].children
+        if self.events.listening('word_result_written'):
+            self._total = self._count_results(result_ids)
         for result_id in result_ids:
             self._generate(result_id, 0)
         self.doc.save(output_file)
@@ -27,6 +43,8 @@ class WordGenerator(object):
                 self._generate(child_id, heading_level+1)
         elif isinstance(result, FigureResult):
             self.doc.add_picture(result.full_path, width=docx.shared.Inches(6.0))
+        elif isinstance(result, ChartResult):
+            self.doc.add_picture(self._chart_image(result), width=docx.shared.Inches(6.0))
         elif isinstance(result, TableResult):
             if result.pre != '':
                 self.doc.add_paragraph(result.pre)
@@ -35,11 +53,58 @@ class WordGenerator(object):
             header_cells = table.rows[0].cells
             for header_cell, heading in zip(header_cells, result.headings):
                 header_cell.text = heading
-            for row in result.rows:
+            # Rows of large tables are streamed from their file
+            rows = result.iter_rows()
+            truncated = self.max_table_rows is not None and result.row_count > self.max_table_rows
+            if truncated:
+                rows = itertools.islice(rows, self.max_table_rows)
+            for row in rows:
                 row_cells = table.add_row().cells
                 for row_cell, cell_text in zip(row_cells, row):
                     row_cell.text = cell_text
+            if truncated:
+                note = 'Tabla truncada: se muestran {} de {} filas.'.format(self.max_table_rows, result.row_count)
+                if result.filename is not None:
+                    note += ' La tabla completa está en el fichero {}.'.format(result.filename)
+                self.doc.add_paragraph(note)
             if result.post != '':
                 self.doc.add_paragraph(result.post)
         else:
             raise NotImplementedError('Result type: ' + result.result_type)
+        self._num_written += 1
+        self.events.emit('word_result_written', id=result_id, count=self._num_written, total=self._total)
+    
+    def _count_results(self, result_ids):
+        # Number of results that generate will write
+        seen = set()
+        pending = list(result_ids)
+        while pending:
+            result_id = pending.pop()
+            if result_id not in seen:
+                seen.add(result_id)
+                result = self.results[result_id]
+                if isinstance(result, ContainerResult):
+                    pending += result.children
+        return len(seen)
+
+    def _chart_image(self, result):
+        # Charts are rendered on demand. Images are cached by the chart data, so they
+        # are rendered again only when the chart changes
+        cache_dir = path.join(self.results_dir, CHART_CACHE_DIRECTORY)
+        fname = '{}.{}.jpg'.format(result.id, fingerprint(result.data)[:16])
+        full_path = path.join(cache_dir, fname)
+        if path.exists(full_path):
+            self.events.emit('figure_rendered', id=result.id, seconds=0.0, cached=True)
+            return full_path
+        start = time.perf_counter()
+        os.makedirs(cache_dir, exist_ok=True)
+        stale = re.compile(re.escape(result.id) + r'\.[0-9a-f]{16}\.jpg')
+        for old_fname in os.listdir(cache_dir):
+            if stale.fullmatch(old_fname):
+                os.remove(path.join(cache_dir, old_fname))
+        temp_path = full_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(result.render())
+        os.replace(temp_path, full_path)
+        self.events.emit('figure_rendered', id=result.id, seconds=time.perf_counter() - start, cached=False)
+        return full_path
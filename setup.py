@@ -25,13 +25,16 @@ setuptools.setup(
     package_data={'': get_web_package_data()},
     include_package_data=True,
     install_requires=[
-        'matplotlib>=2.1.1',
-        'numpy>=1.13.3',
-        'pandas>=0.24.1',
+        'matplotlib>=3.4',
+        'numpy>=1.17',
+        'pandas>=1.1',
         'python-docx>=0.8.10',
         'scipy>=0.19.1',
         'Pillow>=5.1.0',
     ],
+    extras_require={
+        'brotli': ['brotli'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3 :: Only",
         "License :: OSI Approved :: MIT License",
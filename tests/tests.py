@@ -1,7 +1,72 @@
-from prettyresults import dataloader
+from prettyresults import dataloader, descriptives, accumulators, crosses, charts, subgroups, ResultTree, VarType, VariableSchema
+from prettyresults.events import ProgressPrinter, JsonLinesLogger
+from prettyresults.utils import readable_index
+from prettyresults.results import FigureResult, ChartResult, TableResult
+from prettyresults.cache import DataCache
+from prettyresults.fingerprint import fingerprint
+import collections
+import functools
+import gzip
+import http.client
+import io
+import json
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+import unittest.mock
 import pandas as pd
 import numpy as np
+from scipy import stats
+
+CSV_DATA = '''A,B,C,D,AÑO
+1,1,5,1,2019
+2,0,,0,2019
+3,7,4,1,2020
+1,,3,0,2020
+9,1,2,1,2020
+2,0,7,0,2021
+3,1,1,1,2021
+'''
+
+def make_variables():
+    return {
+        'A': {
+            'type': VarType.Category,
+            'desc': 'Variable A',
+            'category': 'cat',
+            'labels': collections.OrderedDict([
+                (1.0, ('a1', 'A uno')),
+                (2.0, ('a2', 'A dos')),
+                (3.0, ('a3', 'A tres')),
+            ])
+        },
+        'B': { 'type': VarType.Bool, 'desc': 'Variable B', 'category': 'cat' },
+        'C': { 'type': VarType.Int, 'desc': 'Variable C', 'category': 'cat', 'mandatory': True },
+        'D': { 'type': VarType.Bool, 'desc': 'Variable D', 'category': 'cat' },
+        'AÑO': { 'type': VarType.Int, 'desc': 'Año', 'category': 'cat' },
+        'BD': {
+            'type': VarType.Bool,
+            'desc': 'B or D',
+            'category': 'cat',
+            'computation-pre': dataloader.combine_variables('B', 'D')
+        },
+    }
+
+def load(variables=None, **kwargs):
+    loader = dataloader.DataLoader(variables or make_variables(), lambda row: str(row.name))
+    ctx = ResultTree()
+    df = loader.load_data(io.StringIO(CSV_DATA), ctx, **kwargs)
+    return df, ctx.get_result('root.warnings').rows
+
+class _BoundCaseId(object):
+    def __init__(self, prefix):
+        self.prefix = prefix
+        
+    def case_id(self, row):
+        return '{} {}'.format(self.prefix, row.name)
 
 class DataLoaderTests(unittest.TestCase):
     def test_logical_and(self):
@@ -74,6 +139,763 @@ class DataLoaderTests(unittest.TestCase):
         res = dataloader.logical_and('a', 'b', 'c')(df, None)
         np.testing.assert_array_equal(res.values, pd.Series(expected).values)
         
+    def test_load_data(self):
+        df, warnings = load()
+        self.assertEqual(list(df.index), [0, 2, 3, 4, 5, 6])
+        self.assertEqual(list(df['A'].astype(object).fillna('')), ['a1', 'a3', 'a1', '', 'a2', 'a3'])
+        self.assertEqual(df['C'].dtype, np.int64)
+        self.assertEqual(list(df['A_ORIGINAL']), [1, 3, 1, 9, 2, 3])
+        self.assertEqual([w[0] for w in warnings], ['2', '1'])
+        
+    def test_load_data_chunked(self):
+        expected_df, expected_warnings = load()
+        for chunksize in (1, 2, 3, 100):
+            df, warnings = load(chunksize=chunksize)
+            pd.testing.assert_frame_equal(df, expected_df)
+            self.assertEqual(warnings, expected_warnings)
+            
+    def test_load_data_lean_originals(self):
+        expected_df, _ = load()
+        for chunksize in (None, 2):
+            df, _ = load(originals='changed', chunksize=chunksize)
+            # A has a value outside its labels, B has a non-boolean value
+            self.assertEqual([c for c in df if c.endswith('_ORIGINAL')], ['A_ORIGINAL', 'B_ORIGINAL'])
+            variables = make_variables()
+            for varname in ('A', 'B', 'D', 'BD'):
+                pd.testing.assert_series_equal(
+                    dataloader.original_values(df, varname, variables[varname]),
+                    expected_df[varname + '_ORIGINAL'])
+            
+    def test_load_data_schema_dtypes(self):
+        no_derived = make_variables()
+        del no_derived['BD']
+        for variables, originals in itertools.product((None, no_derived), ('all', 'changed')):
+            expected_df, expected_warnings = load(variables, originals=originals)
+            for chunksize in (None, 2):
+                df, warnings = load(variables, originals=originals,
+                                    chunksize=chunksize, schema_dtypes=True)
+                pd.testing.assert_frame_equal(df, expected_df)
+                self.assertEqual(warnings, expected_warnings)
+            
+    def test_load_data_varnames(self):
+        variables = make_variables()
+        variables['NOT_BD'] = {
+            'type': VarType.Bool,
+            'desc': 'not B or D',
+            'category': 'cat',
+            'computation-post': lambda df, loader: 1.0 - df['BD'],
+            'inputs': ['BD'],
+        }
+        expected_df, expected_warnings = load(variables)
+        df, warnings = load(variables, varnames=['NOT_BD', 'C'], derivation_threads=4)
+        self.assertEqual(set(df), {'B', 'C', 'D', 'BD', 'NOT_BD', 'B_ORIGINAL',
+                                   'C_ORIGINAL', 'D_ORIGINAL', 'BD_ORIGINAL'})
+        pd.testing.assert_frame_equal(df, expected_df[df.columns])
+        self.assertEqual(warnings, expected_warnings)
+        
+    def test_derivation_dependency_errors(self):
+        variables = make_variables()
+        variables['X'] = { 'type': VarType.Bool, 'computation-pre': dataloader.logical_or('B', 'Y') }
+        variables['Y'] = { 'type': VarType.Bool, 'computation-pre': dataloader.logical_or('X', 'D') }
+        with self.assertRaisesRegex(ValueError, 'X -> Y -> X'):
+            dataloader.DataLoader(variables, str)
+        variables['Y']['computation-pre'] = dataloader.logical_or('B', 'Z')
+        with self.assertRaisesRegex(ValueError, 'unknown variable Z'):
+            dataloader.DataLoader(variables, str)
+            
+    def test_load_data_multiple_files(self):
+        expected_df, expected_warnings = load()
+        lines = CSV_DATA.splitlines(keepends=True)
+        with tempfile.TemporaryDirectory() as data_dir:
+            for i, part_lines in enumerate((lines[1:3], lines[3:])):
+                with open(os.path.join(data_dir, 'part{}.csv'.format(i)), 'wt') as f:
+                    f.writelines([lines[0]] + part_lines)
+            # Under spawn, the loader (with lambdas) can't be pickled and files are loaded serially
+            for workers, platform in ((1, 'linux'), (2, 'linux'), (2, 'darwin')):
+                loader = dataloader.DataLoader(make_variables(), lambda row: str(row.name))
+                ctx = ResultTree()
+                with unittest.mock.patch('sys.platform', platform):
+                    df = loader.load_data(os.path.join(data_dir, 'part*.csv'), ctx, workers=workers,
+                                          schema_dtypes=True, originals='changed')
+                pd.testing.assert_frame_equal(df, load(originals='changed')[0])
+                self.assertEqual(ctx.get_result('root.warnings').rows,
+                                 [('part0.csv: 1', 'C perdida'),
+                                  ('part1.csv: 0', 'Valores contradictorios: B=7.0 vs. D=1.0')])
+            
+    def test_load_data_cache(self):
+        expected_df, expected_warnings = load()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = DataCache(cache_dir)
+            load(cache=cache)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            df, warnings = load(cache=cache)
+            pd.testing.assert_frame_equal(df, expected_df)
+            self.assertEqual(warnings, expected_warnings)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            
+            # A different derivation is a different entry
+            variables = make_variables()
+            variables['BD']['computation-pre'] = dataloader.combine_variables('D', 'B')
+            load(variables, cache=cache)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            
+            # Entries can be removed by their inputs
+            loader = dataloader.DataLoader(variables, lambda row: str(row.name))
+            loader.load_data(io.StringIO(CSV_DATA), ResultTree(), cache=cache, originals='changed')
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+            cache.invalidate(loader.cache_key(io.StringIO(CSV_DATA), originals='changed'))
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            
+            cache.invalidate()
+            self.assertEqual(os.listdir(cache_dir), [])
+            
+    def test_cache_eviction(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = DataCache(cache_dir, max_size=1)
+            cache.put('a', pd.DataFrame({'x': [1]}), [])
+            cache.put('b', pd.DataFrame({'x': [2]}), [])
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('b')[0]['x'][0], 2)
+            
+    def test_cache_unreadable_entry(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = DataCache(cache_dir)
+            # A pickle referencing an attribute pandas does not have (as after an upgrade)
+            with open(os.path.join(cache_dir, 'a.pkl'), 'wb') as f:
+                f.write(b'cpandas\nNoSuchAttribute\n.')
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(os.listdir(cache_dir), [])
+            
+    def test_fingerprint_closures(self):
+        self.assertEqual(fingerprint(dataloader.logical_or('a', 'b')),
+                         fingerprint(dataloader.logical_or('a', 'b')))
+        self.assertNotEqual(fingerprint(dataloader.logical_or('a', 'b')),
+                            fingerprint(dataloader.logical_or('a', 'c')))
+        # Partials and bound methods are hashed with their arguments and object
+        self.assertEqual(fingerprint(functools.partial(dataloader.logical_or, 'a')),
+                         fingerprint(functools.partial(dataloader.logical_or, 'a')))
+        self.assertNotEqual(fingerprint(functools.partial(dataloader.logical_or, 'a')),
+                            fingerprint(functools.partial(dataloader.logical_or, 'b')))
+        self.assertNotEqual(fingerprint(collections.Counter(a=1).most_common),
+                            fingerprint(collections.Counter(a=2).most_common))
+        self.assertNotEqual(fingerprint(_BoundCaseId('caso').case_id),
+                            fingerprint(_BoundCaseId('fila').case_id))
+
+    def test_load_data_sample(self):
+        rng = np.random.default_rng(0)
+        data = pd.DataFrame({
+            'AÑO': rng.choice([2019, 2020, 2021], 2000, p=[0.5, 0.3, 0.2]),
+            'C': rng.integers(0, 50, 2000),
+        })
+        variables = {
+            'AÑO': { 'type': VarType.Int, 'desc': 'Año', 'category': 'cat' },
+            'C': { 'type': VarType.Int, 'desc': 'Variable C', 'category': 'cat' },
+        }
+        loader = dataloader.DataLoader(variables, lambda row: str(row.name))
+        with tempfile.TemporaryDirectory() as directory:
+            fname = os.path.join(directory, 'data.csv')
+            data.to_csv(fname, index=False)
+            for sample, stratify_by in ((0.1, None), (300, None), (300, 'AÑO')):
+                ctx = ResultTree(container_results=[('cat', 'Category', [])])
+                df = loader.load_data(fname, ctx, sample=sample, stratify_by=stratify_by)
+                pd.testing.assert_frame_equal(df[['AÑO', 'C']], data.loc[df.index])
+                chunked = loader.load_data(fname, ResultTree(), chunksize=170, sample=sample,
+                                           stratify_by=stratify_by)
+                pd.testing.assert_frame_equal(chunked, df)
+                info = dataloader.sample_info(df)
+                self.assertEqual(info, (len(df.index), 2000, stratify_by))
+                if stratify_by is not None:
+                    expected = data['AÑO'].value_counts() * 300 / 2000
+                    pd.testing.assert_series_equal(df['AÑO'].value_counts(), expected.round().astype(int))
+                    
+                descriptives.descriptives(ctx.get_result('root'), df, variables)
+                for id_, result in ctx._result_manager.results.items():
+                    if result.result_type == 'ContainerResult':
+                        self.assertEqual(result.labels, [dataloader.sampled_label(info)])
+                self.assertEqual(ctx.get_result('root.cat.C.mean_ci').rows[-1][0], 'Margen de error (muestreo)')
+                descriptives.add_frequency_results(ctx.get_result('root'), df['AÑO'], variables['AÑO'],
+                                                   bar_plot=False, sample=info)
+                self.assertEqual(ctx.get_result('root.freq_table').headings[-1], 'Margen de error')
+            self.assertIsNone(dataloader.sample_info(loader.load_data(fname, ResultTree())))
+            with self.assertRaises(ValueError):
+                loader.load_data(fname, ResultTree(), sample=0.1, stratify_by='AÑO')
+            with self.assertRaises(ValueError):
+                loader.load_data([fname, fname], ResultTree(), sample=100)
+            
+            # A full run after a sampled one, in the same results directory, has no sample labels
+            results_dir = os.path.join(directory, 'results')
+            ctx = ResultTree(results_dir)
+            ctx.get_result('root').add_container('old', 'De una ejecución anterior')
+            ctx.dump_results()
+            for sample in (300, None):
+                ctx = ResultTree(results_dir, container_results=[('cat', 'Category', [])])
+                df = loader.load_data(fname, ctx, sample=sample)
+                descriptives.descriptives(ctx.get_result('root'), df, variables)
+                self.assertEqual(ctx.get_result('root.old').labels, [])
+                ctx.dump_results()
+            containers = [result for result in ResultTree(results_dir)._result_manager.results.values()
+                          if result.result_type == 'ContainerResult']
+            self.assertEqual([result.labels for result in containers], [[]] * len(containers))
+
+        
+
+class SchemaTests(unittest.TestCase):
+    def test_readable_index(self):
+        variables = make_variables()
+        schema = VariableSchema(variables)
+        indexes = [
+            pd.Index([1.0, 2.0, np.nan, 7.0]),
+            pd.Index(['a1', 'a3', 'zz'], name='A'),
+            pd.CategoricalIndex(['a2', 'a1'], categories=['a1', 'a2', 'a3'], ordered=True),
+            pd.Index([0, 1, 2]),
+        ]
+        for varname in ('A', 'B', 'C'):
+            for index in indexes:
+                pd.testing.assert_index_equal(readable_index(index, schema[varname]),
+                                              readable_index(index, variables[varname]))
+                
+    def test_validation(self):
+        variables = make_variables()
+        variables['E'] = { 'type': VarType.Category, 'labels': { 1: 'uno' } }
+        with self.assertRaises(ValueError):
+            VariableSchema(variables)
+        with self.assertRaises(ValueError):
+            dataloader.DataLoader({ 'X': { 'type': 'int' } }, str)
+        schema = VariableSchema(make_variables())
+        self.assertIs(VariableSchema.compile(schema), schema)
+        self.assertEqual(schema['BD'].inputs, ['B', 'D'])
+        pd.testing.assert_frame_equal(load(schema)[0], load()[0])
+
+# Calls to _fill_sums (a global, so it does not change the function fingerprint)
+_fill_sums_calls = []
+
+def _fill_sums(container, df, title):
+    _fill_sums_calls.append(title)
+    container.add_series_table('sums', title, df.sum())
+
+class ResultTests(unittest.TestCase):
+    def test_memoized_container(self):
+        calls = _fill_sums_calls
+        calls.clear()
+        df = pd.DataFrame({ 'x': [1, 2, 3], 'y': [4.0, 5.0, np.nan] })
+        with tempfile.TemporaryDirectory() as directory:
+            def run(df, title='Sumas', force=False):
+                ctx = ResultTree(directory)
+                ctx.get_result('root').add_memoized_container('m', 'M', _fill_sums, df, title, force=force)
+                ctx.dump_results()
+                return [[str(cell) for cell in row] for row in ctx.get_result('root.m.sums').rows]
+            
+            rows = run(df)
+            self.assertEqual(run(df), rows)
+            self.assertEqual(len(calls), 1)
+            run(df, force=True)
+            run(df, title='Totales')
+            run(df.assign(y=[4.0, 5.0, 6.0]))
+            self.assertEqual(len(calls), 4)
+            # Changes in dtypes are detected too
+            run(df.astype({ 'x': float }))
+            self.assertEqual(len(calls), 5)
+            # So does a new prettyresults version
+            with unittest.mock.patch('prettyresults.__version__', '0.0.0'):
+                run(df.astype({ 'x': float }))
+            self.assertEqual(len(calls), 6)
+            
+    def test_chart_figures(self):
+        counts = pd.Series([30, 20, 5], index=['a', 'b', 'c'])
+        cross = pd.DataFrame([[3, 4], [6, 2]], index=[2019, 2020], columns=pd.Index(['No', 'Sí'], name='B'))
+        image = charts.bar_chart(counts, title='A')
+        self.assertTrue(image.startswith(b'\xff\xd8')) # JPEG
+        # Templates are reused, but previous charts do not leak into the next ones
+        charts.bar_chart(cross, title='B')
+        charts.pie_chart(counts)
+        self.assertEqual(charts.bar_chart(counts, title='A'), image)
+        # Bars reused for data of the same shape get the new series names
+        colors = pd.DataFrame([[1, 5], [7, 2]], index=[2019, 2020], columns=pd.Index(['rojo', 'verde'], name='C'))
+        expected = charts.bar_chart(colors, title='C')
+        charts.bar_chart(counts)
+        charts.bar_chart(cross, title='C')
+        self.assertEqual(charts.bar_chart(colors, title='C'), expected)
+        
+        ctx = ResultTree()
+        figure = ctx.get_result('root').add_figure('bar', 'Barras', image)
+        with open(figure.full_path, 'rb') as f:
+            self.assertEqual(f.read(), image)
+            
+    def test_chart_results(self):
+        cross = pd.DataFrame([[3, 4], [6, np.nan]], index=[2019, 2020], columns=pd.Index(['No', 'Sí'], name='B'))
+        with tempfile.TemporaryDirectory() as directory:
+            ctx = ResultTree(directory)
+            root = ctx.get_result('root')
+            bar = root.add_chart('bar', 'Barras', 'bar', cross, title='B por año')
+            self.assertEqual(bar.categories, ['2019', '2020'])
+            self.assertEqual(bar.series, [{ 'name': 'No', 'values': [3, 6] },
+                                          { 'name': 'Sí', 'values': [4, None] }])
+            self.assertEqual(bar.legend_title, 'B')
+            self.assertEqual(ChartResult.json_values([np.inf, -np.inf, 1.5]), [None, None, 1.5])
+            root.add_chart('hist', 'Histograma', 'histogram', np.histogram([1.0, 2.5, 2.0, 4.0], 3))
+            with self.assertRaises(ValueError):
+                root.add_chart('line', 'Líneas', 'line', cross)
+            self.assertEqual(os.listdir(directory), []) # nothing is rendered
+            ctx.dump_results()
+            
+            # Charts are rendered for Word documents only, and cached
+            ctx = ResultTree(directory)
+            self.assertEqual(ctx.get_result('root.bar').data, bar.data)
+            ctx.generate_word(os.path.join(directory, 'out.docx'))
+            cache_dir = os.path.join(directory, 'chart_images')
+            images = sorted(os.listdir(cache_dir))
+            self.assertEqual(len(images), 2)
+            mtimes = [os.stat(os.path.join(cache_dir, fname)).st_mtime_ns for fname in images]
+            ctx.generate_word(os.path.join(directory, 'out.docx'))
+            self.assertEqual([os.stat(os.path.join(cache_dir, fname)).st_mtime_ns for fname in images], mtimes)
+            # Changed charts replace their cached image
+            ctx.get_result('root').add_chart('bar', 'Barras', 'pie', cross['No'])
+            ctx.generate_word(os.path.join(directory, 'out.docx'))
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            self.assertNotEqual(sorted(os.listdir(cache_dir)), images)
+            
+    def test_serve(self):
+        ctx = ResultTree()
+        root = ctx.get_result('root')
+        image = charts.pie_chart(pd.Series([3, 1], index=['a', 'b']))
+        root.add_figure('pie', 'Sectores', image)
+        with ctx.serve(port=0) as server:
+            host, port = server.url[len('http://'):].rstrip('/').split(':')
+            conn = http.client.HTTPConnection(host, int(port), timeout=10)
+            def get(url, **headers):
+                conn.request('GET', url, headers=headers)
+                response = conn.getresponse()
+                return response, response.read()
+            
+            response, body = get('/')
+            self.assertEqual(response.status, 200)
+            response, body = get('/result_data.js')
+            data = json.loads(body.decode('utf-8')[len('var ANALYSIS_RESULTS = '):])
+            self.assertEqual(data['results'][1]['id'], 'root.pie')
+            
+            # Figures are served from the results directory, with ETag and range support
+            response, body = get('/results/root.pie.jpg')
+            self.assertEqual(body, image)
+            etag = response.getheader('ETag')
+            self.assertEqual(get('/results/root.pie.jpg', **{ 'If-None-Match': etag })[0].status, 304)
+            response, body = get('/results/root.pie.jpg', Range='bytes=2-5')
+            self.assertEqual((response.status, body), (206, image[2:6]))
+            self.assertEqual(get('/results/../data.json')[0].status, 404)
+            
+            # Results added later are pushed to open pages
+            events = http.client.HTTPConnection(host, int(port), timeout=10)
+            events.request('GET', '/events?since={}'.format(data['sequence']))
+            stream = events.getresponse()
+            root.add_table('t', 'Tabla', ['x'], [['1']])
+            lines = [stream.fp.readline() for _ in range(3)]
+            self.assertTrue(lines[0].startswith(b'id: '))
+            updates = json.loads(lines[1][len(b'data: '):])
+            self.assertEqual([update['id'] for update in updates], ['root', 'root.t'])
+            self.assertIn('root.t', updates[0]['children'])
+            events.close()
+            conn.close()
+            
+    def test_static_hosting(self):
+        ctx = ResultTree()
+        root = ctx.get_result('root')
+        image = charts.pie_chart(pd.Series([3, 1], index=['a', 'b']))
+        root.add_figure('pie', 'Sectores', image)
+        root.add_table('t', 'Tabla', ['x'], [['1']])
+        with tempfile.TemporaryDirectory() as directory:
+            web_directory = os.path.join(directory, 'web')
+            ctx.generate_web(web_directory, static_hosting=True, workers=2)
+            with open(os.path.join(web_directory, 'manifest.json')) as f:
+                manifest = json.load(f)
+            with open(os.path.join(web_directory, 'index.html')) as f:
+                index = f.read()
+            for fname in ('app.js', 'result_data.js'):
+                self.assertNotIn('"{}"'.format(fname), index)
+                self.assertIn('"{}"'.format(manifest[fname]), index)
+                self.assertFalse(os.path.exists(os.path.join(web_directory, fname)))
+            
+            # Compact data, with hashed figure names
+            with open(os.path.join(web_directory, manifest['result_data.js']), 'rb') as f:
+                data_js = f.read()
+            self.assertNotIn(b'\n', data_js)
+            data = json.loads(data_js.decode('utf-8')[len('var ANALYSIS_RESULTS = '):])
+            figure = next(obj for obj in data['results'] if obj['id'] == 'root.pie')
+            self.assertEqual('results/' + figure['data']['filename'], manifest['results/root.pie.jpg'])
+            self.assertEqual(root.get_child('pie').filename, 'root.pie.jpg')
+            with open(os.path.join(web_directory, manifest['results/root.pie.jpg']), 'rb') as f:
+                self.assertEqual(f.read(), image)
+            
+            # Precompressed text files
+            with gzip.open(os.path.join(web_directory, manifest['result_data.js'] + '.gz'), 'rb') as f:
+                self.assertEqual(f.read(), data_js)
+            self.assertTrue(os.path.exists(os.path.join(web_directory, 'index.html.gz')))
+            self.assertFalse(os.path.exists(os.path.join(web_directory, manifest['results/root.pie.jpg'] + '.gz')))
+            
+    def test_large_tables(self):
+        rows = [[str(i), 'fila "{}", con comas'.format(i)] for i in range(2500)]
+        with tempfile.TemporaryDirectory() as directory:
+            ctx = ResultTree(directory, max_table_cells=1000)
+            root = ctx.get_result('root')
+            small = root.add_table('small', 'Pequeña', ['n', 'texto'], rows[:10])
+            table = root.add_table('large', 'Grande', ['n', 'texto'], rows)
+            self.assertEqual(small.files(), [])
+            self.assertEqual(table.files(), ['root.large.csv', 'root.large.rows-0.js',
+                                             'root.large.rows-1.js', 'root.large.rows-2.js'])
+            self.assertEqual(len(table.rows), 50)
+            self.assertEqual(table.row_count, 2500)
+            with self.assertRaises(ValueError):
+                table.add_row(['x', 'y'])
+            with open(os.path.join(directory, 'root.large.rows-2.js')) as f:
+                page = f.read()
+            self.assertTrue(page.startswith('prettyresultsTablePage("root.large", 2, '))
+            self.assertEqual(json.loads(page[page.index('['):page.rindex(')')]), rows[2000:])
+            ctx.dump_results()
+            
+            # All the rows are read back from the CSV file
+            ctx = ResultTree(directory, max_table_cells=1000)
+            table = ctx.get_result('root.large')
+            self.assertEqual(list(table.iter_rows()), rows)
+            ctx.generate_word(os.path.join(directory, 'out.docx'), max_table_rows=100)
+            docx = __import__('docx').Document(os.path.join(directory, 'out.docx'))
+            self.assertEqual([len(table.rows) for table in docx.tables], [11, 101])
+            self.assertIn('100 de 2500 filas', '\n'.join(paragraph.text for paragraph in docx.paragraphs))
+            
+            # Files of a table that shrinks on a rerun are removed
+            ctx = ResultTree(directory, max_table_cells=1000)
+            ctx.get_result('root').add_table('large', 'Grande', ['n', 'texto'], rows[:1200])
+            self.assertEqual(sorted(fname for fname in os.listdir(directory) if fname.startswith('root.large')),
+                             ['root.large.csv', 'root.large.rows-0.js', 'root.large.rows-1.js'])
+            ctx.get_result('root').add_table('large', 'Grande', ['n', 'texto'], rows[:10])
+            self.assertEqual([fname for fname in os.listdir(directory) if fname.startswith('root.large')], [])
+            
+            # Tables not stored apart keep growing
+            warnings = []
+            table = ctx.get_result('root').add_table('warnings', 'Warnings', ['Caso', ''], warnings,
+                                                     store_apart=False)
+            warnings += rows
+            self.assertEqual((table.filename, table.row_count), (None, 2500))
+            
+    def test_events(self):
+        ctx = ResultTree(container_results=[('cat', 'Category', [])])
+        events = []
+        ctx.events.on('*', events.append)
+        df, _ = load()
+        loader = dataloader.DataLoader(make_variables(), lambda row: str(row.name))
+        loader.load_data(io.StringIO(CSV_DATA), ctx)
+        descriptives.descriptives(ctx.get_result('root'), df, make_variables(), varnames=['A'])
+        ctx.get_result('root').add_figure('pie', 'Sectores', charts.pie_chart(pd.Series([1, 2])))
+        with tempfile.TemporaryDirectory() as directory:
+            ctx.generate_web(os.path.join(directory, 'web'))
+            ctx.generate_word(os.path.join(directory, 'out.docx'))
+        names = [event.name for event in events]
+        self.assertEqual(names[0], 'result_added')
+        self.assertIn('data_loaded', names)
+        loaded = events[names.index('data_loaded')].data
+        self.assertEqual((loaded['rows'], loaded['cached']), (len(df.index), False))
+        added = [event.data['count'] for event in events if event.name == 'result_added']
+        self.assertEqual(added, list(range(added[0], added[0] + len(added))))
+        web = [event.data for event in events if event.name == 'web_file_written']
+        self.assertEqual([data['count'] for data in web], list(range(1, web[0]['total'] + 1)))
+        self.assertEqual(web[-1]['path'], 'result_data.js')
+        word = [event.data for event in events if event.name == 'word_result_written']
+        self.assertEqual([data['count'] for data in word], list(range(1, word[0]['total'] + 1)))
+        # The pie figure, plus the charts of A, rasterized for Word
+        num_charts = sum(isinstance(result, ChartResult) for result in ctx._result_manager.results.values())
+        self.assertEqual(names.count('figure_rendered'), num_charts + 1)
+        
+        # Built-in listeners
+        ctx.events.off('*', events.append)
+        progress, log = io.StringIO(), io.StringIO()
+        ctx.events.on('word_result_written', ProgressPrinter(progress, interval=3600))
+        ctx.events.on('*', JsonLinesLogger(log))
+        with tempfile.TemporaryDirectory() as directory:
+            ctx.generate_word(os.path.join(directory, 'out.docx'))
+        lines = progress.getvalue().splitlines()
+        self.assertEqual(len(lines), 2) # throttled: the first and the last one
+        self.assertTrue(lines[-1].endswith('{0}/{0} (100%)'.format(word[0]['total'])))
+        logged = [json.loads(line) for line in log.getvalue().splitlines()]
+        self.assertEqual(logged[0]['event'], 'figure_rendered')
+        self.assertTrue(logged[0]['cached'])
+        with self.assertRaises(ValueError):
+            ctx.events.on('unknown', print)
+            
+    def test_memoized_descriptives(self):
+        df, _ = load()
+        expected = table_data(run_descriptives(df))
+        with tempfile.TemporaryDirectory() as directory:
+            for workers in (1, 1, 2):
+                ctx = ResultTree(directory, container_results=[('cat', 'Category', [])])
+                descriptives.descriptives(ctx.get_result('root'), df, make_variables(),
+                                          memoize=True, workers=workers)
+                self.assertEqual(table_data(ctx), expected)
+                ctx.dump_results()
+        
+def table_data(ctx):
+    return { id_: result.data for id_, result in ctx._result_manager.results.items()
+             if isinstance(result, TableResult) and id_ != 'root.warnings' }
+
+def run_descriptives(df, variables=None, **kwargs):
+    ctx = ResultTree(container_results=[('cat', 'Category', [])])
+    descriptives.descriptives(ctx.get_result('root'), df, variables or make_variables(), **kwargs)
+    return ctx
+        
+class DescriptivesTests(unittest.TestCase):
+    def test_frequency_counts(self):
+        rng = np.random.default_rng(0)
+        years = pd.Series(rng.choice([2019, 2020, np.nan], 500), name='AÑO')
+        floats = pd.Series(rng.choice([1.0, 2.0, 3.0, np.nan], 500), name='X')
+        cats = pd.Series(pd.Categorical(rng.choice(['a', 'b', None], 500),
+                                        categories=['c', 'a', 'b']), name='Y')
+        codes = descriptives.year_codes(years)
+        for series in (floats, cats):
+            counts = descriptives.frequency_counts(series, codes)
+            pd.testing.assert_series_equal(counts.value_counts, series.value_counts())
+            pd.testing.assert_frame_equal(counts.cross_year, pd.crosstab(years, series))
+            self.assertEqual(counts.num_nans, series.isna().sum())
+            
+    def test_grouped_mean_confidence_intervals(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'x': rng.normal(size=300),
+            'y': rng.integers(0, 10, 300).astype(float),
+            'group': rng.choice(['a', 'b', 'c'], 300),
+        })
+        df.loc[::7, 'y'] = np.nan
+        intervals = descriptives.grouped_mean_confidence_intervals(df, ['x', 'y'], 'group', 0.9)
+        for (varname, group), row in intervals.iterrows():
+            data = df.loc[df['group'] == group, varname].values
+            expected = descriptives.mean_confidence_interval(data, 0.9)
+            np.testing.assert_allclose([row['mean'], row['lower'], row['upper'], row['n']], expected)
+            self.assertEqual(row['total'], len(data))
+            
+    def test_accumulators(self):
+        rng = np.random.default_rng(0)
+        values = pd.Series(rng.choice([1.0, 2.5, 4.0, 1e6, np.nan], 500), name='X')
+        years = pd.Series(rng.choice([2021, 2019, 2020], 500), name='AÑO')
+        mean_variance = accumulators.MeanVarianceAccumulator()
+        frequencies = accumulators.FrequencyAccumulator()
+        for start in range(0, 500, 70):
+            chunk_mean_variance = accumulators.MeanVarianceAccumulator()
+            chunk_mean_variance.update(values[start:start+70])
+            mean_variance.merge(chunk_mean_variance)
+            frequencies.update(values[start:start+70], years[start:start+70])
+        np.testing.assert_allclose(mean_variance.confidence_interval(0.9),
+                                   descriptives.mean_confidence_interval(values.values, 0.9))
+        expected = descriptives.frequency_counts(values, descriptives.year_codes(years))
+        counts = frequencies.counts()
+        pd.testing.assert_series_equal(counts.value_counts, expected.value_counts)
+        pd.testing.assert_frame_equal(counts.cross_year, expected.cross_year)
+        self.assertEqual(counts[1:3], expected[1:3])
+        
+        edges = [0.0, 2.0, 10.0, 2e6]
+        histogram = accumulators.HistogramAccumulator(edges, (0.0, 2e6))
+        for start in range(0, 500, 70):
+            histogram.update(values[start:start+70])
+        x, bins, weights = histogram.hist_args()
+        np.testing.assert_array_equal(np.histogram(x, bins, weights=weights)[0],
+                                      np.histogram(values.dropna(), edges)[0])
+        
+    def test_streaming_descriptives(self):
+        df, _ = load()
+        expected = table_data(run_descriptives(df))
+        for workers in (1, 2):
+            ctx = ResultTree(container_results=[('cat', 'Category', [])])
+            chunks = (df.iloc[start:start+3] for start in range(0, len(df), 3))
+            descriptives.streaming_descriptives(ctx.get_result('root'), chunks, make_variables(),
+                                                workers=workers)
+            self.assertEqual(table_data(ctx), expected)
+            
+    def test_batched_descriptives(self):
+        df, _ = load()
+        self.assertEqual(table_data(run_descriptives(df, batched=True)),
+                         table_data(run_descriptives(df)))
+        
+    def test_parallel_descriptives(self):
+        df, _ = load()
+        expected = run_descriptives(df)
+        # Metadata is pickled with the spawn start method (BD is computed by a closure)
+        with unittest.mock.patch('sys.platform', 'darwin'):
+            self.assertEqual(table_data(run_descriptives(df, workers=2)), table_data(expected))
+        ctx = run_descriptives(df, workers=2)
+        self.assertEqual(table_data(ctx), table_data(expected))
+        self.assertEqual(ctx.get_result('root.cat').children,
+                         expected.get_result('root.cat').children)
+        for id_, result in ctx._result_manager.results.items():
+            if isinstance(result, FigureResult):
+                self.assertTrue(os.path.exists(result.full_path))
+            elif isinstance(result, ChartResult):
+                self.assertEqual(result.data, expected.get_result(id_).data)
+
+                
+class CrossesTests(unittest.TestCase):
+    def test_chi2_all_pairs(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'A': pd.Categorical(rng.choice(['a1', 'a2', 'a3', None], 200), categories=['a3', 'a1', 'a2', 'a4']),
+            'B': rng.choice([0.0, 1.0, np.nan], 200),
+            'D': rng.choice([0.0, 1.0], 200),
+            'E': rng.choice([3, 1, 2, 9], 200),
+        })
+        variables = make_variables()
+        variables['E'] = { 'type': VarType.Int, 'desc': 'Variable E', 'category': 'cat' }
+        results = crosses.chi2_all_pairs(df, variables, list(df.columns))
+        self.assertEqual(len(results), 6)
+        for (name1, name2), result in results.items():
+            expected = crosses.chi2_contingency(df, variables, name1, name2)
+            pd.testing.assert_frame_equal(result.crosstab, expected.crosstab)
+            pd.testing.assert_frame_equal(result.contingency_table, expected.contingency_table)
+            np.testing.assert_allclose([result.p, result.chi2], [expected.p, expected.chi2])
+            self.assertEqual((result.n, result.too_small_freqs), (expected.n, expected.too_small_freqs))
+
+            
+    def test_sparse_chi2_contingency(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'A': pd.Categorical(rng.choice(['a1', 'a2', 'a3', None], 300), categories=['a3', 'a1', 'a2']),
+            'B': rng.choice([0.0, 1.0], 300),
+            'D': rng.choice([0.0, 1.0], 300),
+            'E': rng.zipf(1.5, 300) % 40,
+        })
+        variables = make_variables()
+        variables['E'] = { 'type': VarType.Int, 'desc': 'Variable E', 'category': 'cat' }
+        for name1, name2 in (('A', 'E'), ('B', 'D'), ('E', 'A')):
+            result = crosses.sparse_chi2_contingency(df, variables, name1, name2, top_n=None)
+            expected = crosses.chi2_contingency(df, variables, name1, name2)
+            pd.testing.assert_frame_equal(result.crosstab, expected.crosstab)
+            pd.testing.assert_frame_equal(result.contingency_table, expected.contingency_table)
+            np.testing.assert_allclose([result.p, result.chi2], [expected.p, expected.chi2])
+            self.assertEqual((result.n, result.too_small_freqs), (expected.n, expected.too_small_freqs))
+            self.assertEqual(result.full_shape, expected.crosstab.shape)
+        
+        result = crosses.sparse_chi2_contingency(df, variables, 'E', 'A', top_n=5)
+        self.assertEqual(result.crosstab.shape, (5, 3))
+        self.assertEqual(sorted(result.crosstab.sum(axis=1)),
+                         sorted(expected.crosstab.sum(axis=1))[-5:])
+        self.assertAlmostEqual(result.p, expected.p)
+        ctx = ResultTree()
+        crosses.add_chi2_results(ctx.get_result('root'), result)
+        self.assertIn('5 de', ctx.get_result('root.freq_table').post)
+            
+    def test_monte_carlo_chi2(self):
+        # For 2x2 tables, the permutation p-value is the two-sided Fisher exact test
+        observed = np.array([[3, 1], [1, 3]])
+        p, error = crosses.monte_carlo_chi2_p(observed, num_simulations=20000, seed=1)
+        self.assertAlmostEqual(p, stats.fisher_exact(observed).pvalue, delta=4*error)
+        self.assertEqual(crosses.monte_carlo_chi2_p(observed, 3500, seed=2),
+                         crosses.monte_carlo_chi2_p(observed, 3500, seed=2, workers=2))
+        
+        df, _ = load()
+        result = crosses.chi2_contingency(df, make_variables(), 'A', 'B', simulate_p_value='auto')
+        self.assertTrue(result.too_small_freqs)
+        self.assertIsNotNone(result.mc_p)
+        ctx = ResultTree()
+        crosses.add_chi2_results(ctx.get_result('root'), result)
+        self.assertIn('p (Monte Carlo)', dict(ctx.get_result('root.chi_square_independence').rows))
+        self.assertIsNone(crosses.chi2_contingency(df, make_variables(), 'A', 'B').mc_p)
+        pairs = [crosses.chi2_all_pairs(df, make_variables(), ['A', 'B', 'D'], simulate_p_value=True,
+                                        num_simulations=2000, workers=workers) for workers in (1, 2)]
+        self.assertEqual([result.mc_p for result in pairs[0].values()],
+                         [result.mc_p for result in pairs[1].values()])
+            
+    def test_kendall_tau(self):
+        rng = np.random.default_rng(0)
+        x = rng.integers(0, 5, 500).astype(float)
+        df = pd.DataFrame({
+            'x': np.where(np.arange(500) % 13 == 0, np.nan, x),
+            'y': x + rng.integers(0, 3, 500),
+            'z': rng.normal(size=500),
+            'c': pd.Categorical(rng.choice(['alto', 'bajo', 'medio'], 500),
+                                categories=['bajo', 'medio', 'alto'], ordered=True),
+        })
+        variables = { name: { 'type': VarType.Int, 'desc': name } for name in df }
+        results = crosses.kendall_tau_pairs(df, variables, list(df.columns), workers=2)
+        self.assertEqual(len(results), 6)
+        for (name1, name2), result in results.items():
+            self.assertEqual(result, crosses.kendall_tau(df, variables, name1, name2))
+            complete = df[[name1, name2]].dropna()
+            expected = stats.kendalltau(complete[name1].cat.codes if name1 == 'c' else complete[name1],
+                                        complete[name2].cat.codes if name2 == 'c' else complete[name2])
+            np.testing.assert_allclose([result.tau, result.p], [expected.statistic, expected.pvalue])
+            self.assertEqual(result.n, len(complete))
+        
+        ctx = ResultTree()
+        crosses.add_kendall_tau_matrix_results(ctx.get_result('root'), results, variables, list(df.columns))
+        self.assertEqual(len(ctx.get_result('root.kendall_tau_table').rows), 4)
+
+
+def _subgroup_analysis(container, df, column='x', workers=1):
+    # workers is a keyword argument of subgroup_results, too
+    container.add_table('summary', 'Resumen', ['Filas', 'Suma'], [[len(df.index), float(df[column].sum()) * workers]])
+
+class SubgroupTests(unittest.TestCase):
+    def test_segment_positions(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'region': pd.Categorical(rng.choice(['norte', 'sur', None], 300), categories=['sur', 'este', 'norte']),
+            'year': rng.choice([2021.0, 2019.0, np.nan], 300),
+            'x': rng.normal(size=300),
+        }, index=rng.permutation(300))
+        segments = subgroups.segment_positions(df, 'region')
+        self.assertEqual([key for key, _ in segments], ['sur', 'norte'])
+        for key, positions in segments:
+            pd.testing.assert_frame_equal(df.take(positions), df[df['region'] == key])
+        segments = subgroups.segment_positions(df, ['year', 'region'])
+        self.assertEqual([key for key, _ in segments],
+                         [(2019.0, 'sur'), (2019.0, 'norte'), (2021.0, 'sur'), (2021.0, 'norte')])
+        for (year, region), positions in segments:
+            pd.testing.assert_frame_equal(df.take(positions), df[(df['year'] == year) & (df['region'] == region)])
+
+    def test_subgroup_results(self):
+        df, _ = load()
+        df['x'] = np.arange(len(df.index), dtype=float)
+        variables = make_variables()
+        expected = None
+        for workers in (1, 2):
+            ctx = ResultTree()
+            by_a = ctx.get_result('root').add_container('by_a', 'Por A')
+            segments = subgroups.subgroup_results(by_a, df, 'A', _subgroup_analysis,
+                                                  variable_meta=variables, workers=workers)
+            self.assertEqual([segment.name for segment in segments], ['A uno', 'A dos', 'A tres'])
+            self.assertEqual(by_a.children, ['root.by_a.' + segment.id for segment in segments])
+            data = [ctx.get_result(child + '.summary').rows for child in by_a.children]
+            if expected is None:
+                expected = data
+                self.assertEqual(data[0], [[(df['A'] == 'a1').sum(), float(df.loc[df['A'] == 'a1', 'x'].sum())]])
+            self.assertEqual(data, expected)
+            
+            # Arguments of fun are passed apart from those of subgroup_results
+            df['y'] = df['x'] / 4
+            subgroups.subgroup_results(by_a, df, 'A', _subgroup_analysis, ('y',), { 'workers': 4 },
+                                       workers=workers)
+            self.assertEqual([ctx.get_result(child + '.summary').rows for child in by_a.children], expected)
+
+
+# Imports prettyresults, reopens a results directory and generates the web page,
+# printing the heavy modules loaded after the import and at the end
+IMPORT_CHECK = '''
+import sys, tempfile
+HEAVY_MODULES = ('matplotlib', 'pandas', 'numpy', 'scipy', 'docx', 'PIL')
+def print_heavy_modules():
+    print(' '.join(name for name in HEAVY_MODULES if name in sys.modules))
+import prettyresults
+print_heavy_modules()
+with tempfile.TemporaryDirectory() as directory:
+    ctx = prettyresults.ResultTree(directory)
+    ctx.get_result('root').add_table('t', 'Tabla', ['x'], [['1']])
+    ctx.dump_results()
+    ctx = prettyresults.ResultTree(directory)
+    ctx.generate_web(directory + '/web', static_hosting=True)
+print_heavy_modules()
+# The analysis modules (loaded by worker processes, too) need pandas, but not pyplot
+import prettyresults.crosses, prettyresults.descriptives
+print('matplotlib.pyplot' in sys.modules)
+'''
+
+class ImportTests(unittest.TestCase):
+    def test_lazy_imports(self):
+        output = subprocess.run([sys.executable, '-c', IMPORT_CHECK], check=True, capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        # Heavy dependencies are only loaded by the features using them
+        self.assertEqual(output.stdout.split('\n')[:3], ['', '', 'False'])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file